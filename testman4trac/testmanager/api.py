@@ -35,9 +35,11 @@ from trac.wiki.parser import WikiParser
 
 from testmanager.model import TestCatalog, TestCase, TestCaseInPlan, TestPlan
 from testmanager.util import get_page_title
-from tracgenericclass.model import GenericClassModelProvider
+from tracgenericclass.model import GenericClassModelProvider, \
+    ConcurrentModificationError
 from tracgenericclass.util import formatExceptionInfo, from_any_timestamp, \
-    upload_file_to_subdir, get_dictionary_from_string
+    upload_file_to_subdir, decode_key, get_streaming_cursor, \
+    iter_cursor_rows, get_stream_batch_size, get_integrity_error
 
 
 try:
@@ -48,6 +50,10 @@ except ImportError:
 	tag_ = _
 	add_domain = lambda env_path, locale_dir: None
 
+# Number of times a test case status update is attempted, in case of
+# concurrent modifications by other testers.
+STATUS_UPDATE_ATTEMPTS = 3
+
     
 class TestManagerSystem(Component):
     """Test Manager system for Trac."""
@@ -254,12 +260,12 @@ class TestManagerSystem(Component):
         """Returns a list of all test plans."""
 
         db = self.env.get_read_db()
-        cursor = db.cursor()
+        cursor = get_streaming_cursor(self.env, db)
 
         sql = "SELECT id, catid, page_name, name, author, time FROM testplan ORDER BY catid, id"
         
         cursor.execute(sql)
-        for id, catid, page_name, name, author, ts  in cursor:
+        for id, catid, page_name, name, author, ts in iter_cursor_rows(cursor, get_stream_batch_size(self.env)):
             yield id, catid, page_name, name, author, str(from_any_timestamp(ts))
 
 
@@ -316,15 +322,32 @@ class TestManagerSystem(Component):
 
             try:
                 self.env.log.debug("Setting status %s to test case %s in plan %s" % (status, id, planid))
-                tcip = TestCaseInPlan(self.env, id, planid)
-                if tcip.exists:
-                    tcip.set_status(status, author)
-                    tcip.save_changes(author, "Status changed")
-                else:
-                    tc = TestCase(self.env, id)
-                    tcip['page_name'] = tc['page_name']
-                    tcip.set_status(status, author)
-                    tcip.insert()
+                
+                # Concurrent updates by other testers make save_changes()
+                # fail, after rolling back the status history as well,
+                # and so do concurrent first executions of the test case
+                # with insert(), which key is already taken. In these 
+                # cases the test case is read again and the update 
+                # retried.
+                integrity_error = get_integrity_error(self.env)
+                for attempt in range(STATUS_UPDATE_ATTEMPTS):
+                    try:
+                        @self.env.with_transaction()
+                        def do_set_status(db):
+                            tcip = TestCaseInPlan(self.env, id, planid, db=db)
+                            if tcip.exists:
+                                tcip.set_status(status, author, db)
+                                tcip.save_changes(author, "Status changed", db=db)
+                            else:
+                                tc = TestCase(self.env, id, db=db)
+                                tcip['page_name'] = tc['page_name']
+                                tcip.set_status(status, author, db)
+                                tcip.insert(db=db)
+                        break
+                    except (ConcurrentModificationError, integrity_error):
+                        if attempt == STATUS_UPDATE_ATTEMPTS - 1:
+                            raise
+                        self.env.log.debug("Test case %s in plan %s modified concurrently, retrying" % (id, planid))
 
                 result = 'OK'
                 
@@ -884,7 +907,8 @@ class TestManagerSystem(Component):
 
         tcat = TestCatalog(self.env, tcat_id)
         
-        sub_order = 1
+        # Position of the test cases in the catalog, starting from 0
+        sub_order = 0
         for node in sub_nodes_list:
             if node['tcid'] == '':
                 # It's a test catalog
@@ -913,12 +937,9 @@ class TestManagerSystem(Component):
                     if tcat['id'] == old_tcatid:
                         # Change order inside same catalog (no need to change
                         # wiki page name, etc...)
-                        if tc['exec_order'] != new_order:
+                        if tcat.get_testcase_position(tc) != new_order:
                             tcat.change_testcase_order(tc, new_order)
 
-                            # Set new order to test case
-                            tc.set_order(new_order)
-
                     else:
                         tc.move_to(tcat, new_order, False)
 
@@ -932,10 +953,14 @@ class TestManagerSystem(Component):
                     id = self.get_next_id('testcase')
                     pagename = tcat['page_name'] + '_TC'+str(id)
 
-                    # Copy the test case with a new id into the new catalog
-                    tc['page_name'] = pagename
-                    tc['exec_order'] = new_order
-                    tc.save_as({'id': id})
+                    # Copy the test case with a new id into the new catalog.
+                    # The order key is kept by pre_insert(), since no 
+                    # other test case has it.
+                    @self.env.with_transaction()
+                    def do_copy_testcase(db):
+                        tc['page_name'] = pagename
+                        tc['exec_order'] = tcat.allocate_order_key(new_order, db=db)
+                        tc.save_as({'id': id}, db=db)
 
                 except:
                     self.env.log.error("Error copying the test case with id %s and title '%s'!", tc_id, tc.title)
@@ -957,7 +982,7 @@ class TestManagerSystem(Component):
         self.env.log.debug(">>> get_resource_url - %s" % resource)
         
         tmmodelprovider = GenericClassModelProvider(self.env)
-        obj = tmmodelprovider.get_object(resource.realm, get_dictionary_from_string(resource.id))
+        obj = tmmodelprovider.get_object(resource.realm, decode_key(resource.id))
         
         if obj and obj.exists:
             args = {}
@@ -982,7 +1007,7 @@ class TestManagerSystem(Component):
 
     def resource_exists(self, resource):
         tmmodelprovider = GenericClassModelProvider(self.env)
-        obj = tmmodelprovider.get_object(resource.realm, get_dictionary_from_string(resource.id))
+        obj = tmmodelprovider.get_object(resource.realm, decode_key(resource.id))
         
         return obj.exists
     
@@ -1309,11 +1334,11 @@ class TestManagerSystem(Component):
         
         db = self.env.get_read_db()
         cursor = db.cursor()
-        cursor.execute("SELECT id, page_name from testcatalog")
+        cursor.execute("SELECT id, page_name, title from testcatalog")
         items = []
-        for c_id, c_name in cursor:
-            wikipage = WikiPage(self.env, c_name)
-            c_title = get_page_title(wikipage.text)
+        for c_id, c_name, c_title in cursor.fetchall():
+            if c_title is None:
+                c_title = get_page_title(WikiPage(self.env, c_name).text)
             c_template_id = self.get_tc_template_id_for_catalog(c_id)
             cat = {'id': c_id, 'name': c_name, 'title': c_title, 'template': c_template_id}
             items.append(cat)
@@ -1334,14 +1359,24 @@ class TestManagerSystem(Component):
         else:
             components = {'name': pagename, 'tcat_id': '-1', 'childrenC': {},'childrenT': {}, 'tot': 0, 'color': default_status_color}
 
+        tmmodelprovider = GenericClassModelProvider(self.env)
+        
         if planid is not None:
-            tp = TestPlan(self.env, planid)
+            tp = tmmodelprovider.get_object('testplan', {'id': planid})
             contains_all = tp['contains_all']
             snapshot = tp['freeze_tc_versions']
         else:
             contains_all = True
             snapshot = False
 
+        # When all the test cases are in the model, count them by
+        # catalog with a single query instead of one by one
+        tc_counts = None
+        if contains_all:
+            tc_search = TestCase(self.env)
+            tc_search['page_name'] = pagename + '_%'
+            tc_counts = tc_search.aggregate_matching_objects('count', group_by='parent_id', exact_match=False)
+
         ts = 0
         author = ''
         status = ''
@@ -1349,8 +1384,7 @@ class TestManagerSystem(Component):
 
         unique_idx = 0
 
-        for subpage_name, text in self.list_matching_subpages(pagename+'_'):
-            subpage_title = get_page_title(text)
+        for subpage_name, subpage_title in self.list_matching_subpage_titles(pagename+'_'):
 
             path_name = subpage_name.partition(pagename+'_')[2]
             tokens = path_name.split("_")
@@ -1408,9 +1442,9 @@ class TestManagerSystem(Component):
                     if sortby == 'name':
                         key = subpage_title
                     elif sortby == 'custom':
-                        tc = TestCase(self.env, tc_id)
+                        tc = tmmodelprovider.get_object('testcase', {'id': tc_id})
                         if tc.exists:
-                            key = "%05d" % (tc['exec_order'],)
+                            key = "%010d" % (tc['exec_order'],)
                             exec_order = key
                         else:
                             key = subpage_title
@@ -1425,7 +1459,8 @@ class TestManagerSystem(Component):
                     compLoop = parent
                     
                     while (True):
-                        compLoop['tot']+=1
+                        if tc_counts is None:
+                            compLoop['tot']+=1
                         
                         if include_status:
                             compLoop['color'] = self._calc_worse_color(compLoop['color'], status, default_status_color)
@@ -1435,8 +1470,23 @@ class TestManagerSystem(Component):
                         else:
                             break
 
+        if tc_counts is not None:
+            self._sum_catalog_totals(components, tc_counts)
+
         return components
     
+    def _sum_catalog_totals(self, comp, tc_counts):
+        """
+        Sets the 'tot' of each catalog in the model to the number of test
+        cases in its subtree, given the number of test cases directly
+        contained in each catalog.
+        """
+        comp['tot'] = tc_counts.get(comp['tcat_id'], 0)
+        for child in comp['childrenC'].itervalues():
+            comp['tot'] += self._sum_catalog_totals(child, tc_counts)
+            
+        return comp['tot']
+
     def _calc_worse_color(self, old_color, new_status, default_status_color):
         new_color = self.outcomes_by_name[new_status][0]
         
@@ -1742,6 +1792,27 @@ class TestManagerSystem(Component):
             
         return do_sort
         
+    def list_matching_subpage_titles(self, curpage):
+        """
+        Returns the page names and titles of the test catalogs and test
+        cases which page name starts with the specified prefix, ordered
+        by page name, reading the stored titles instead of the wiki
+        pages.
+        """
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+
+        cursor.execute("SELECT page_name, title FROM testcatalog WHERE page_name LIKE %s "
+                       "UNION ALL "
+                       "SELECT page_name, title FROM testcase WHERE page_name LIKE %s "
+                       "ORDER BY page_name", (curpage + '%', curpage + '%'))
+
+        for name, title in cursor.fetchall():
+            if title is None:
+                title = get_page_title(WikiPage(self.env, name).text)
+                
+            yield name, title
+        
     def list_matching_subpages(self, curpage):
         db = self.env.get_read_db()
         cursor = db.cursor()
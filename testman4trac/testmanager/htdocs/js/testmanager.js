@@ -1048,6 +1048,45 @@ function doAjaxCall(url, method, params) {
     return responseText;
 }
 
+function loadChangeHistory(button) {
+    var url = baseLocation+"/propertyhistory";
+    var params = {
+        realm: $(button).attr('data-realm'),
+        key: $(button).attr('data-key'),
+        before: $(button).attr('data-next'),
+        exclude: $(button).attr('data-exclude'),
+        limit: $(button).attr('data-limit')
+    };
+
+    var result = doAjaxCall(url, "GET", params);
+
+    var page = null;
+    try {
+        page = $.parseJSON(result);
+    } catch (e) {
+        page = null;
+    }
+
+    if (page == null || page.changes == null) {
+        return;
+    }
+
+    var tbody = $(button).siblings('table').children('tbody');
+    $.each(page.changes, function(i, change) {
+        var row = $('<tr></tr>');
+        $.each([change.time, change.author, change.field, change.oldvalue, change.newvalue], function(j, value) {
+            row.append($('<td></td>').text(value));
+        });
+        tbody.append(row);
+    });
+
+    if (page.next) {
+        $(button).attr('data-next', page.next);
+    } else {
+        $(button).hide();
+    }
+}
+
 var editingFields = {};
 
 function showEditingPencil(name) {
@@ -27,8 +27,10 @@ from trac.wiki.api import WikiSystem
 from trac.wiki.model import WikiPage
 from trac.wiki.web_ui import WikiModule
 
-from testmanager.util import get_page_title, get_page_description
-from tracgenericclass.model import IConcreteClassProvider, AbstractVariableFieldsObject, AbstractWikiPageWrapper, need_db_create_for_realm, create_db_for_realm, need_db_upgrade_for_realm, upgrade_db_for_realm
+from testmanager.util import get_page_title, get_page_description, get_page_summary
+from tracgenericclass.model import IConcreteClassProvider, AbstractVariableFieldsObject, AbstractWikiPageWrapper, GenericClassModelProvider, need_db_create_for_realm, create_db_for_realm, need_db_upgrade_for_realm, upgrade_db_for_realm, get_identity_map, \
+    invalidate_object_cache, get_row_class
+from tracgenericclass.query import ObjectQuery, SubQuery
 from tracgenericclass.util import to_any_timestamp, get_timestamp_db_type, \
     db_insert_or_ignore, formatExceptionInfo
 
@@ -39,6 +41,14 @@ except ImportError:
     from trac.util.translation import _, N_
     tag_ = _
 
+# Distance between the execution order keys of consecutive test cases, 
+# leaving room to insert or move test cases in between without changing 
+# the other test cases
+ORDER_GAP = 1024
+
+# Marks the test description properties still to be read from the wiki page
+_NOT_LOADED = object()
+
 class AbstractTestDescription(AbstractWikiPageWrapper):
     """
     A test description object based on a Wiki page.
@@ -50,10 +60,18 @@ class AbstractTestDescription(AbstractWikiPageWrapper):
     page respectively as the first line and the rest of the text.
     The title is automatically wiki-formatted as a second-level title
     (i.e. sorrounded by '==').
+    
+    The wiki page, and the title, description and author derived from 
+    it, are only loaded when first accessed. Use prefetch_wiki_pages()
+    to load them for many objects at once.
+    The title and a short summary of the description are also stored
+    in the 'title' and 'summary' fields, so that listings do not need
+    to read the wiki pages. They are kept up to date also when the 
+    wiki page is edited directly, see update_test_description_title().
     """
     
     # Fields that must not be modified directly by the user
-    protected_fields = ('id', 'page_name')
+    protected_fields = ('id', 'page_name', 'title', 'summary')
 
     def __init__(self, env, realm='testdescription', id=None, page_name=None, title=None, description=None, db=None):
     
@@ -66,25 +84,51 @@ class AbstractTestDescription(AbstractWikiPageWrapper):
 
         self.title = title
         self.description = description
-
-        self.env.log.debug('Title: %s' % self.title)
-        self.env.log.debug('Description: %s' % self.description)
+        self.author = None
     
         key = self.build_key_object()
     
         AbstractWikiPageWrapper.__init__(self, env, realm, key, db)
 
     def post_fetch_object(self, db):
-        # Fetch the wiki page
         AbstractWikiPageWrapper.post_fetch_object(self, db)
 
-        # Then parse it and derive title, description and author
-        self.title = get_page_title(self.wikipage.text)
-        self.description = get_page_description(self.wikipage.text)
-        self.author = self.wikipage.author
+        # Title, description and author are derived from the wiki page
+        # when first accessed
+        self._title = self._description = self._author = _NOT_LOADED
+
+    def _get_title(self):
+        if self._title is _NOT_LOADED:
+            if self.values.get('title') is not None:
+                self._title = self.values['title']
+            else:
+                self._title = get_page_title(self.wikipage.text)
+        return self._title
+
+    def _set_title(self, title):
+        self._title = title
 
-        self.env.log.debug('Title: %s' % self.title)
-        #self.env.log.debug('Description: %s' % self.description)
+    title = property(_get_title, _set_title)
+
+    def _get_description(self):
+        if self._description is _NOT_LOADED:
+            self._description = get_page_description(self.wikipage.text)
+        return self._description
+
+    def _set_description(self, description):
+        self._description = description
+
+    description = property(_get_description, _set_description)
+
+    def _get_author(self):
+        if self._author is _NOT_LOADED:
+            self._author = self.wikipage.author
+        return self._author
+
+    def _set_author(self, author):
+        self._author = author
+
+    author = property(_get_author, _set_author)
 
     def pre_insert(self, db):
         """ Assuming the following fields have been given a value before this call:
@@ -92,6 +136,7 @@ class AbstractTestDescription(AbstractWikiPageWrapper):
         """
     
         self.text = '== '+self.title+' ==' + CRLF + CRLF + self.description
+        self._set_title_fields()
         AbstractWikiPageWrapper.pre_insert(self, db)
 
         return True
@@ -99,21 +144,41 @@ class AbstractTestDescription(AbstractWikiPageWrapper):
     def pre_save_changes(self, db):
         """ Assuming the following fields have been given a value before this call:
             title, description, author, remote_addr 
+            
+        When the wiki page is not saved, the title fields are derived 
+        from the current wiki page instead.
         """
     
-        self.text = '== '+self.title+' ==' + CRLF + CRLF + self.description
+        if self.save_wiki_page:
+            self.text = '== '+self.title+' ==' + CRLF + CRLF + self.description
+        else:
+            self.text = self.wikipage.text
+            
+        self._set_title_fields()
         AbstractWikiPageWrapper.pre_save_changes(self, db)
         
         return True
 
+    def _set_title_fields(self):
+        self['title'] = get_page_title(self.text)
+        self['summary'] = get_page_summary(self.text)
+
     def get_search_results(self, req, terms, filters):
         """
-        Currently delegates the search to the Wiki module. 
+        Delegates the search to the Wiki module. Used only when the
+        database backend does not support the full-text index.
         """
         for result in WikiModule(self.env).get_search_results(req, terms, ('wiki',)):
             if result[0].rpartition('/')[2].startswith("TC"):
                 yield result
 
+    def get_fulltext_document(self):
+        document = AbstractWikiPageWrapper.get_fulltext_document(self)
+        if self.title:
+            document['title'] = self.title
+        
+        return document
+
 
 class TestCatalog(AbstractTestDescription):
     """
@@ -141,6 +206,9 @@ class TestCatalog(AbstractTestDescription):
                              Note that test case IDs are independent on 
                              test catalog IDs.
     """
+    # Fields that must not be modified directly by the user
+    protected_fields = ('id', 'page_name', 'title', 'summary', 'parent_id', 'depth')
+
     def __init__(self, env, id=None, page_name=None, title=None, description=None, db=None):
     
         AbstractTestDescription.__init__(self, env, 'testcatalog', id, page_name, title, description, db)
@@ -149,35 +217,43 @@ class TestCatalog(AbstractTestDescription):
         """
         Returns the catalog containing this test catalog, or None if its a root catalog.
         """
-        page_name = self.values['page_name']
-        cat_page = page_name.rpartition('_TT')[0]
-
-        if cat_page == 'TC':
+        path = _get_catalog_path(self.values['page_name'])
+        if len(path) < 2:
             return None
-        else:
-            cat_id = page_name.rpartition('TT')[0].page_name.rpartition('TT')[2].rpartition('_')[0]
 
-            return TestCatalog(self.env, cat_id, cat_page)
+        cat_page = self.values['page_name'].rpartition('_TT')[0]
+
+        return _get_catalog(self.env, path[-2], cat_page)
         
+    def list_ancestors(self, db=None):
+        """
+        Returns a list of the catalogs enclosing this catalog, from the
+        root of the tree down to its direct parent.
+        """
+        query = ObjectQuery(self.env, 'testcatalog')
+        query.filter('id', 'in', 
+            SubQuery("SELECT ancestor FROM testcatalogclosure "
+                     "WHERE descendant = %s AND depth > 0", [self.values['id']]))
+        query.order_by('depth')
+
+        for tcat in query.execute(db):
+            yield tcat
+
     def list_subcatalogs(self, db=None):
         """
         Returns a list of the sub catalogs of this catalog.
         """
-        tc_search = TestCatalog(self.env)
-        tc_search['page_name'] = self.values['page_name'] + '_TT%'
-        
-        cat_re = re.compile('^TT[0-9]*$')
-        
-        for tc in tc_search.list_matching_objects(exact_match=False, db=db):
-            # Only return direct sub-catalogs and exclude test cases
-            if cat_re.match(tc['page_name'].partition(self.values['page_name']+'_')[2]) :
-                yield tc
+        query = ObjectQuery(self.env, 'testcatalog').filter('parent_id', '=', self.values['id'])
+
+        for tcat in query.execute(db):
+            yield tcat
         
     def list_testcases(self, plan_id=None, deep=False, db=None):
         """
         Returns a list of the test cases in this catalog.
-        If plan_id is provided, returns a list of TestCaseInPlan objects,
-        otherwise, of TestCase objects.
+        If plan_id is provided, returns a list of read-only records with
+        the status of the test cases in the plan, see 
+        list_testcases_in_plan(), otherwise a list of TestCase objects.
         
         :deep: if True indicates to return all TCs in the catalog and 
                recursively in all the contained sub-catalogs.
@@ -185,53 +261,137 @@ class TestCatalog(AbstractTestDescription):
         self.env.log.debug('>>> list_testcases')
         
         if plan_id is not None:
-            from testmanager.api import TestManagerSystem
-            default_status = TestManagerSystem(self.env).get_default_tc_status()
+            for tcip in self.list_testcases_in_plan(plan_id, deep, db):
+                yield tcip
+
+            self.env.log.debug('<<< list_testcases')
+            return
         
-        tc_search = TestCase(self.env)
-        tc_search['page_name'] = self.values['page_name'] + ('_TC%', '%_TC%')[deep]
+        query = ObjectQuery(self.env, 'testcase')
+        if deep:
+            query.filter('parent_id', 'in', 
+                SubQuery("SELECT descendant FROM testcatalogclosure "
+                         "WHERE ancestor = %s", [self.values['id']]))
+        else:
+            query.filter('parent_id', '=', self.values['id'])
         
-        for tc in tc_search.list_matching_objects(exact_match=False, db=db):
+        for tc in query.execute(db):
             self.env.log.debug('    ---> Found testcase %s' % tc['id'])
-            if plan_id is None:
-                yield tc
-            else:
-                tcip = TestCaseInPlan(self.env, tc['id'], plan_id)
-                if not tcip.exists or 'status' not in tcip.fields:
-                    tcip['status'] = default_status
-                    
-                tcip['exec_order'] = tc['exec_order']
-
-                yield tcip
+            yield tc
 
         self.env.log.debug('<<< list_testcases')
                 
-    def list_testplans(self, db=None):
+    def list_testcases_in_plan(self, plan_id, deep=False, db=None):
+        """
+        Returns the status of the test cases of this catalog in the 
+        specified plan, read with a single query joining the test cases
+        with their status in the plan and its custom fields.
+
+        Each result is a read-only ProjectionRow record, as returned by
+        list_matching_rows(), with the 'id', 'planid', 'page_name',
+        'page_version', 'status' and 'exec_order' fields, followed by
+        the testcaseinplan custom fields.
+        Test cases not yet executed in the plan have the default status,
+        the page name of the test case and -1 as page version. Missing
+        custom field values are set to the field default value, as for
+        list_matching_rows().
+        Results are ordered by execution order.
+        
+        :deep: if True indicates to return all TCs in the catalog and 
+               recursively in all the contained sub-catalogs.
+        """
+        self.env.log.debug('>>> list_testcases_in_plan')
+        
+        from testmanager.api import TestManagerSystem
+        default_status = TestManagerSystem(self.env).get_default_tc_status()
+
+        custom_fields = []
+        custom_defaults = []
+        for field in GenericClassModelProvider(self.env).get_custom_fields('testcaseinplan'):
+            custom_fields.append(field['name'])
+            custom_defaults.append(field.get('value', ''))
+
+        row_class = get_row_class('testcaseinplan', 
+            ('id', 'planid', 'page_name', 'page_version', 'status', 'exec_order') + 
+            tuple(custom_fields))
+
+        if not db:
+            db = self.env.get_read_db()
+
+        columns = ['tc.id', 'tc.page_name', 'tc.exec_order', 
+                   'tcip.id', 'tcip.page_name', 'tcip.page_version', 'tcip.status']
+        joins = ['LEFT JOIN testcaseinplan tcip ON tcip.id = tc.id AND tcip.planid = %s']
+        params = [plan_id]
+
+        for i, name in enumerate(custom_fields):
+            columns.append('c%d.value' % i)
+            joins.append('LEFT JOIN testcaseinplan_custom c%(i)d ON c%(i)d.id = tc.id '
+                         'AND c%(i)d.planid = %%s AND c%(i)d.name = %%s' % {'i': i})
+            params += [plan_id, name]
+
+        if deep:
+            sql_where = ('tc.parent_id IN (SELECT descendant FROM testcatalogclosure '
+                         'WHERE ancestor = %s)')
+            params.append(self.values['id'])
+        else:
+            sql_where = 'tc.parent_id = %s'
+            params.append(self.values['id'])
+
+        cursor = db.cursor()
+        cursor.execute('SELECT %s FROM testcase tc %s WHERE %s ORDER BY tc.exec_order'
+                       % (','.join(columns), ' '.join(joins), sql_where), params)
+
+        for row in cursor:
+            tc_id, tc_page_name, exec_order, tcip_id, page_name, page_version, status = row[:7]
+
+            if tcip_id is None:
+                page_name = tc_page_name
+                page_version = -1
+                
+            if status is None:
+                status = default_status
+
+            self.env.log.debug('    ---> Found testcase %s' % tc_id)
+            custom_values = tuple([default if value is None else value 
+                                   for value, default in zip(row[7:], custom_defaults)])
+
+            yield row_class((tc_id, plan_id, page_name, page_version, status, exec_order) + 
+                            custom_values)
+
+        self.env.log.debug('<<< list_testcases_in_plan')
+
+    def list_testplans(self, db=None, newest_first=False):
         """
         Returns a list of test plans for this catalog.
+        
+        :param newest_first: if True, the test plans are returned ordered
+                             by creation time, latest first.
         """
 
         self.env.log.debug('>>> list_testplans')
         
-        tp_search = TestPlan(self.env)
-        tp_search['catid'] = self.values['id']
-        tp_search['contains_all'] = None
-        tp_search['freeze_tc_versions'] = None
+        query = ObjectQuery(self.env, 'testplan').filter('catid', '=', self.values['id'])
+        if newest_first:
+            query.order_by('time', desc=True)
         
-        for tp in tp_search.list_matching_objects(db=db):
+        for tp in query.execute(db):
             yield tp
 
         self.env.log.debug('<<< list_testplans')
 
+    def count_testplans(self, db=None):
+        """
+        Returns the number of test plans for this catalog.
+        """
+        return ObjectQuery(self.env, 'testplan').filter('catid', '=', self.values['id']).count(db)
+
     def get_last_order(self, db=None):
-        tcat_page_filter = "%s_TC%%" % self.values['page_name']
-        
         if not db:
             db = self.env.get_read_db()
         
         cursor = db.cursor()
-        cursor.execute("SELECT max(exec_order) FROM testcase WHERE page_name LIKE %s",
-            (tcat_page_filter,))
+        cursor.execute("SELECT max(exec_order) FROM testcase WHERE parent_id = %s",
+            (self.values['id'],))
 
         row = cursor.fetchone()
         last_order = row[0]
@@ -241,65 +401,182 @@ class TestCatalog(AbstractTestDescription):
         
         return last_order
         
-    def remove_testcase_from_order(self, tc, db=None):
-        """ 
-        Removes the test case from the ordered list of test cases, rearranging the
-        other test cases to fill the empty position.
+    def get_next_order(self, db=None):
+        """
+        Returns the execution order key for a test case to be appended 
+        at the end of the catalog.
+        """
+        return max(self.get_last_order(db), 0) + ORDER_GAP
+
+    def get_testcase_position(self, tc, db=None):
+        """
+        Returns the position, starting from 0, of the test case in the
+        ordered list of test cases of this catalog.
+        """
+        if not db:
+            db = self.env.get_read_db()
+        
+        cursor = db.cursor()
+        cursor.execute("SELECT count(*) FROM testcase WHERE parent_id = %s AND exec_order < %s",
+            (self.values['id'], tc['exec_order']))
+
+        return cursor.fetchone()[0]
+
+    def get_order_key(self, position, tc=None, db=None):
         """
+        Returns the execution order key that places a test case at the
+        specified position, starting from 0, in the ordered list of the
+        other test cases of this catalog, i.e. excluding the test case
+        'tc', if specified.
+
+        Test case keys are sparse, so the returned key normally lies 
+        between the keys of the two neighbours and no other test case
+        needs to be changed. When there is no room left between the
+        neighbours, None is returned: use allocate_order_key() to also
+        renumber the test cases of the catalog in that case.
+        """
+        if not db:
+            db = self.env.get_read_db()
+
+        before, after = self._get_order_neighbours(position, tc, db)
+
+        if after is not None and after - before <= 1:
+            self.env.log.debug("No order key left for position %s" % position)
+            return None
+
+        if after is None:
+            key = max(before, 0) + ORDER_GAP
+        else:
+            key = (before + after) // 2
 
+        self.env.log.debug("Order key for position %s: %s" % (position, key))
+            
+        return key
+
+    def allocate_order_key(self, position, tc=None, db=None):
+        """
+        Returns the execution order key that places a test case at the
+        specified position, as get_order_key() does, renumbering the 
+        test cases of the catalog first if there is no room left.
+        
+        Call this method inside the transaction writing the test case,
+        so that the renumbering, which is rarely needed, is committed 
+        or rolled back along with the test case that needs it.
+        """
+        key = []
+        
         @self.env.with_transaction(db)
-        def do_remove_testcase_from_order(db):
-            old_order = tc['exec_order']
-            tcat_page_filter = "%s_TC%%" % self.values['page_name']
+        def do_allocate_order_key(db):
+            key.append(self.get_order_key(position, tc, db))
+            if key[0] is None:
+                self.renumber_testcases(tc, db)
+                key[0] = self.get_order_key(position, tc, db)
+
+        return key[0]
+
+    def _get_order_neighbours(self, position, tc, db):
+        """
+        Returns the keys of the test cases that would come before and 
+        after the specified position. The first is -1 if the position 
+        is the first one, the second is None if it is the last one.
+        """
+        # Test case IDs are never empty
+        tc_id = ''
+        if tc is not None:
+            tc_id = tc['id']
+        
+        cursor = db.cursor()
+        if position > 0:
+            cursor.execute("SELECT exec_order FROM testcase WHERE parent_id = %s AND id <> %s "
+                           "ORDER BY exec_order LIMIT 2 OFFSET %s", 
+                           (self.values['id'], tc_id, position - 1))
+            keys = [row[0] for row in cursor]
+
+            if not keys:
+                # Past the end of the list
+                cursor.execute("SELECT max(exec_order) FROM testcase WHERE parent_id = %s AND id <> %s",
+                    (self.values['id'], tc_id))
+                last_order = cursor.fetchone()[0]
+                return (last_order, -1)[last_order is None], None
+                
+            return keys[0], (None, keys[-1])[len(keys) > 1]
+
+        cursor.execute("SELECT min(exec_order) FROM testcase WHERE parent_id = %s AND id <> %s",
+            (self.values['id'], tc_id))
+
+        return -1, cursor.fetchone()[0]
+
+    def renumber_testcases(self, tc=None, db=None):
+        """
+        Spreads the execution order keys of the test cases of this 
+        catalog at ORDER_GAP intervals, keeping their order.
+        
+        :param tc: a test case to leave untouched, because it is about
+                   to be given a new key.
+        """
+        tc_id = ''
+        if tc is not None:
+            tc_id = tc['id']
+
+        @self.env.with_transaction(db)
+        def do_renumber_testcases(db):
+            self.env.log.debug("Renumbering the test cases in catalog %s" % self['id'])
 
             cursor = db.cursor()
+            cursor.execute("SELECT id FROM testcase WHERE parent_id = %s AND id <> %s "
+                           "ORDER BY exec_order, id", (self.values['id'], tc_id))
             
-            # Spostare indietro di 1 posizione tutti gli elementi
-            # da old_order + 1 in poi
-            cursor.execute("UPDATE testcase SET exec_order = exec_order - 1 WHERE page_name LIKE %s AND exec_order >= %s", 
-                (tcat_page_filter, old_order + 1))
+            cursor.executemany("UPDATE testcase SET exec_order = %s WHERE id = %s",
+                [((i + 1) * ORDER_GAP, row[0]) for i, row in enumerate(cursor.fetchall())])
+
+            self._invalidate_testcases(db)
                 
     def insert_testcase_into_order(self, tc, new_order, db=None):
         """ 
-        Inserts the test case into the ordered list of test cases, at the specified
-        position, rearranging the other test cases accordingly.
+        Returns the execution order key to insert the test case into 
+        the ordered list of test cases, before any test case with a key 
+        greater than or equal to new_order.
+        The key new_order itself is returned if no other test case has
+        it, e.g. when it comes from allocate_order_key().
+        No other test case is changed, unless the catalog needs to be
+        renumbered, see allocate_order_key().
         """
+        read_db = db or self.env.get_read_db()
 
-        @self.env.with_transaction(db)
-        def do_insert_testcase_into_order(db):
-            tcat_page_filter = "%s_TC%%" % self.values['page_name']
-            
-            cursor = db.cursor()
-            
-            # Spostare avanti di 1 posizione tutti gli elementi
-            # da new_order in poi
-            cursor.execute("UPDATE testcase SET exec_order = exec_order + 1 WHERE page_name LIKE %s AND exec_order >= %s", 
-                (tcat_page_filter, new_order))
+        cursor = read_db.cursor()
+        cursor.execute("SELECT count(*) FROM testcase WHERE parent_id = %s AND exec_order = %s AND id <> %s",
+            (self.values['id'], new_order, tc['id']))
+        
+        if cursor.fetchone()[0] == 0:
+            return new_order
+
+        cursor.execute("SELECT count(*) FROM testcase WHERE parent_id = %s AND exec_order < %s AND id <> %s",
+            (self.values['id'], new_order, tc['id']))
+
+        return self.allocate_order_key(cursor.fetchone()[0], tc, db)
                 
     def change_testcase_order(self, tc, new_order, db=None):
         """ 
-        Moves the test case to a different position inside the same catalog.
+        Moves the test case to a different position, starting from 0,
+        inside the same catalog.
+        Only the test case itself is changed, unless the catalog needs 
+        to be renumbered, see allocate_order_key().
         """
-
         @self.env.with_transaction(db)
         def do_change_testcase_order(db):
-            old_order = tc['exec_order']
-            tcat_page_filter = "%s_TC%%" % self.values['page_name']
+            tc.set_order(self.allocate_order_key(new_order, tc, db), db)
 
-            cursor = db.cursor()
-            
-            if new_order < old_order:
-                # Spostare in avanti di 1 posizione tutti gli elementi compresi
-                # tra new_order incluso e old_order -1 inluso
-                #update testcase set exec_order = old_order + 1 where 
-                cursor.execute("UPDATE testcase SET exec_order = exec_order + 1 WHERE page_name LIKE %s AND exec_order >= %s AND exec_order <= %s", 
-                    (tcat_page_filter, new_order, old_order - 1))
+    def _invalidate_testcases(self, db):
+        """
+        Evicts the test cases from the active identity map, if any, and
+        from the object cache, after their execution order has been 
+        changed directly in the database.
+        """
+        identity_map = get_identity_map(self.env)
+        if identity_map is not None:
+            identity_map.clear('testcase')
 
-            else:
-                # Spostare indietro di 1 posizione tutti gli elementi compresi
-                # tra old_order + 1 incluso e new_order incluso
-                cursor.execute("UPDATE testcase SET exec_order = exec_order - 1 WHERE page_name LIKE %s AND exec_order >= %s AND exec_order <= %s", 
-                    (tcat_page_filter, old_order + 1, new_order))
+        invalidate_object_cache(self.env, 'testcase', db)
 
     def pre_delete(self, db):
         """ 
@@ -317,17 +594,52 @@ class TestCatalog(AbstractTestDescription):
         
         return True
 
+    def pre_insert(self, db):
+        """
+        Sets the parent and the depth of the catalog in the tree, 
+        derived from its page name.
+        """
+        AbstractTestDescription.pre_insert(self, db)
+
+        path = _get_catalog_path(self['page_name'])
+        self['parent_id'] = path[-2] if len(path) > 1 else None
+        self['depth'] = len(path) - 1
+
+        return True
+
+    def post_insert(self, db):
+        """
+        Adds the catalog to the hierarchy closure table, with one row
+        for each enclosing catalog and one for the catalog itself.
+        """
+        path = _get_catalog_path(self['page_name'])
+
+        cursor = db.cursor()
+        cursor.executemany("INSERT INTO testcatalogclosure (ancestor, descendant, depth) "
+                           "VALUES (%s, %s, %s)", 
+                           [(ancestor, self['id'], len(path) - 1 - i) 
+                            for i, ancestor in enumerate(path)])
+
+        AbstractTestDescription.post_insert(self, db)
+
     def post_delete(self, db):
         """
         Deletes the test plans associated to this catalog and the status 
         of the test cases in those plans and their status change 
         history.
+        Sub-catalogs have already been deleted at this point, so only
+        the rows of this catalog are left in the hierarchy closure 
+        table.
         """
         self.env.log.debug("Deleting all test plans related to this catalog id '%s'" % self['id'])
 
         for tp in self.list_testplans(db):
             tp.delete(db=db)
 
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM testcatalogclosure WHERE descendant = %s OR ancestor = %s", 
+            (self['id'], self['id']))
+
         AbstractTestDescription.post_delete(self, db)
 
     def create_instance(self, key):
@@ -338,13 +650,10 @@ class TestCatalog(AbstractTestDescription):
         """
         Returns a list of the root-level catalogs.
         """
-        tc_search = cls(env)
-        tc_search['page_name'] ='TC_TT%'
+        query = ObjectQuery(env, 'testcatalog').filter('parent_id', 'is null')
         
-        for tc in tc_search.list_matching_objects(exact_match=False):
-            # Only return root catalogs
-            if tc['page_name'].count('_') == 1:
-                yield tc
+        for tcat in query.execute():
+            yield tcat
    
     def get_search_results(self, req, terms, filters):
         if not 'testcatalog' in filters:
@@ -358,7 +667,7 @@ class TestCatalog(AbstractTestDescription):
 class TestCase(AbstractTestDescription):
 
     # Fields that must not be modified directly by the user
-    protected_fields = ('id', 'page_name', 'exec_order')
+    protected_fields = ('id', 'page_name', 'title', 'summary', 'exec_order', 'parent_id')
 
     def __init__(self, env, id=None, page_name=None, title=None, description=None, exec_order=0, db=None):
     
@@ -370,17 +679,19 @@ class TestCase(AbstractTestDescription):
         Returns the catalog containing this test case.
         """
         page_name = self.values['page_name']
-        cat_id = page_name.rpartition('TT')[2].rpartition('_')[0]
+        cat_id = self.values.get('parent_id') or _get_catalog_path(page_name)[-1]
         cat_page = page_name.rpartition('_TC')[0]
         
-        return TestCatalog(self.env, cat_id, cat_page)
+        return _get_catalog(self.env, cat_id, cat_page)
         
     def create_instance(self, key):
         return TestCase(self.env, key['id'])
 
     def set_order(self, new_order, db=None):
         """
-        Changes the order of the test case in the current catalog.
+        Changes the execution order key of the test case in the current
+        catalog. Use TestCatalog.change_testcase_order() to move the
+        test case to a given position instead.
         """
 
         if new_order != self['exec_order']:
@@ -393,7 +704,8 @@ class TestCase(AbstractTestDescription):
 
     def move_to(self, tcat, new_order=-1, delete_tcip=True, db=None):
         """ 
-        Moves the test case into a different catalog.
+        Moves the test case into a different catalog, at the specified
+        position, starting from 0, or at the end if new_order is -1.
         
         delete_tcip: True to delete the status of the test case in any plan
                           and the corresponding history,
@@ -405,16 +717,12 @@ class TestCase(AbstractTestDescription):
 
         @self.env.with_transaction(db)
         def do_move_to(db):
-            # Remove the test case from the ordered list of the old catalog
-            old_cat = self.get_enclosing_catalog()
-            old_cat.remove_testcase_from_order(self)
-
-            t_new_order = new_order
-            if t_new_order == -1:
-                t_new_order = tcat.get_last_order(db) + 1
-            
-            # Add it to the ordered list of the new catalog
-            tcat.insert_testcase_into_order(self, t_new_order)
+            # Find a place in the ordered list of the new catalog. The 
+            # gap left in the old catalog needs no changes.
+            if new_order == -1:
+                t_new_order = tcat.get_next_order(db)
+            else:
+                t_new_order = tcat.allocate_order_key(new_order, self, db)
         
             # Rename the wiki page
             new_page_name = tcat['page_name'] + '_TC' + self['id']
@@ -442,6 +750,7 @@ class TestCase(AbstractTestDescription):
 
             # Update self properties and save
             self['page_name'] = new_page_name
+            self['parent_id'] = tcat['id']
             self['exec_order'] = t_new_order
             self.wikipage = WikiPage(self.env, new_page_name)
             
@@ -476,18 +785,17 @@ class TestCase(AbstractTestDescription):
         """
         AbstractTestDescription.pre_insert(self, db)
 
-        if self['exec_order'] is None or self['exec_order'] == -1:
-            tcat = self.get_enclosing_catalog()
-            last_order = tcat.get_last_order(db)
-
-            self.env.log.debug("last_order: %s" % last_order)
-            
-            self['exec_order'] = last_order + 1
+        self['parent_id'] = _get_catalog_path(self['page_name'])[-1]
 
-        # Inserts the test case into the enclosing catalog, 
-        # in the right position.
         tcat = self.get_enclosing_catalog()
-        tcat.insert_testcase_into_order(self, self['exec_order'], db)
+        if self['exec_order'] is None or self['exec_order'] == -1:
+            self['exec_order'] = tcat.get_next_order(db)
+        else:
+            # Inserts the test case into the enclosing catalog, 
+            # in the right position.
+            self['exec_order'] = tcat.insert_testcase_into_order(self, self['exec_order'], db)
+
+        self.env.log.debug("exec_order: %s" % self['exec_order'])
             
         return True
 
@@ -502,16 +810,13 @@ class TestCase(AbstractTestDescription):
         
         # Delete test cases in plan
         cursor.execute('DELETE FROM testcaseinplan WHERE id = %s', (self['id'],))
+        invalidate_object_cache(self.env, 'testcaseinplan', db)
 
 		# TODO Delete from testcaseinplan_custom and testcaseinplan_change
 
         # Delete test case status history
         cursor.execute('DELETE FROM testcasehistory WHERE id = %s', (self['id'],))
 
-        if self['exec_order'] is not None and self['exec_order'] != -1:
-            tcat = self.get_enclosing_catalog()
-            tcat.remove_testcase_from_order(self)
-
         AbstractTestDescription.post_delete(self, db)
         
     def get_search_results(self, req, terms, filters):
@@ -543,7 +848,7 @@ class TestCaseInPlan(AbstractVariableFieldsObject):
     """
     
     # Fields that must not be modified directly by the user
-    protected_fields = ('id', 'planid', 'page_name', 'page_version', 'status')
+    protected_fields = ('id', 'planid', 'page_name', 'page_version', 'status', 'version')
 
     def __init__(self, env, id=None, planid=None, page_name=None, page_version=-1, status=None, db=None):
         """
@@ -719,18 +1024,30 @@ class TestPlan(AbstractVariableFieldsObject):
 
             author = self.values['author']
 
+            tc_ids = []
             for tc_page_name in self.selected_tcs:
                 if tc_page_name != '':
                     tc_id = tc_page_name.rpartition('TC')[2]
-                    tcip = TestCaseInPlan(self.env, tc_id, self.values['id'])
-                    if not tcip.exists:
-                        tc = TestCase(self.env, tc_id)
-                        tcip['page_name'] = tc['page_name']
-                        if self.values['freeze_tc_versions']:
-                            # Set the wiki page version to the current latest version
-                            tcip['page_version'] = tc.wikipage.version
-                        tcip.set_status(default_status, author)
-                        tcip.insert()
+                    if tc_id not in tc_ids:
+                        tc_ids.append(tc_id)
+
+            existing_ids = self._get_existing_testcases_in_plan(tc_ids, db)
+
+            tcs = TestCase.fetch_many(self.env, 'testcase', [{'id': tc_id} for tc_id in tc_ids], db)
+            if self.values['freeze_tc_versions']:
+                TestCase.prefetch_wiki_pages(self.env, tcs, db)
+
+            tcips = []
+            for tc in tcs:
+                if tc['id'] not in existing_ids:
+                    tcip = self._create_testcase_in_plan(tc)
+                    if self.values['freeze_tc_versions']:
+                        # Set the wiki page version to the current latest version
+                        tcip['page_version'] = tc.wikipage.version
+                    tcip.set_status(default_status, author, db)
+                    tcips.append(tcip)
+                    
+            TestCaseInPlan.insert_many(self.env, tcips, db=db)
                     
         elif self.values['freeze_tc_versions']:
             # Create a TestCaseInPlan for each test case in the catalog, and
@@ -742,17 +1059,43 @@ class TestPlan(AbstractVariableFieldsObject):
 
             author = self.values['author']
 
-            for tc in tcat.list_testcases(deep=True):
-                tcip = TestCaseInPlan(self.env, tc.values['id'], self.values['id'])
-                if not tcip.exists:
-                    tcip['page_name'] = tc['page_name']
+            tcs = list(tcat.list_testcases(deep=True, db=db))
+            existing_ids = self._get_existing_testcases_in_plan([tc['id'] for tc in tcs], db)
+            TestCase.prefetch_wiki_pages(self.env, [tc for tc in tcs if tc['id'] not in existing_ids], db)
+
+            tcips = []
+            for tc in tcs:
+                if tc['id'] not in existing_ids:
+                    tcip = self._create_testcase_in_plan(tc)
                     tcip['page_version'] = tc.wikipage.version
-                    tcip.set_status(default_status, author)
+                    tcip.set_status(default_status, author, db)
+                    tcips.append(tcip)
                     
-                    tcip.insert()
+            TestCaseInPlan.insert_many(self.env, tcips, db=db)
 
         self.env.log.debug("<<< post_insert")
                     
+    def _create_testcase_in_plan(self, tc):
+        """
+        Returns a new TestCaseInPlan for the specified test case in this
+        plan, without looking it up in the database.
+        """
+        tcip = TestCaseInPlan(self.env)
+        tcip.set_values({'id': tc['id'], 'planid': self.values['id'], 'page_name': tc['page_name']})
+        tcip.key = tcip.build_key_object()
+        
+        return tcip
+
+    def _get_existing_testcases_in_plan(self, tc_ids, db):
+        """
+        Returns the set of IDs, among the specified ones, of the test 
+        cases already associated to this plan.
+        """
+        keys = [{'id': tc_id, 'planid': self.values['id']} for tc_id in tc_ids]
+        
+        return set([tcip['id'] for tcip in 
+                    TestCaseInPlan.fetch_many(self.env, 'testcaseinplan', keys, db)])
+
     def post_delete(self, db):
         self.env.log.debug("Deleting this test plan %s" % self['id'])
         
@@ -768,6 +1111,7 @@ class TestPlan(AbstractVariableFieldsObject):
         
         # Delete test cases in plan
         cursor.execute('DELETE FROM testcaseinplan WHERE planid = %s', (self['id'],))
+        invalidate_object_cache(self.env, 'testcaseinplan', db)
 
 		# TODO Delete from testcaseinplan_custom and testcaseinplan_change
 
@@ -792,13 +1136,97 @@ class TestPlan(AbstractVariableFieldsObject):
 
         cursor.execute('SELECT id FROM testcaseinplan WHERE planid = %s', (self.values['id'],))
 
-        for row in cursor:
-            tcip_id = row[0]
-            yield TestCaseInPlan(self.env, tcip_id, self.values['id'])
+        keys = [{'id': row[0], 'planid': self.values['id']} for row in cursor]
+
+        for tcip in TestCaseInPlan.fetch_many(self.env, 'testcaseinplan', keys, db):
+            yield tcip
             
         self.env.log.debug('<<< get_selected_testcases')      
 
         
+def update_test_description_title(env, page, db=None):
+    """
+    Updates the stored title and summary of the test catalog or test
+    case based on the specified wiki page, after the page has been 
+    edited directly. Pages not belonging to a test catalog or test case,
+    or saved by the test catalog or test case itself, are ignored.
+    
+    The object is saved without saving the wiki page again, so that its
+    wide table and full-text index are kept up to date as with any 
+    other change. The title and summary fields are not recorded in the
+    change history, since the wiki page has its own.
+    """
+    if not page.name.startswith('TC_') or getattr(page, 'generic_object', None) is not None:
+        return
+
+    title = get_page_title(page.text)
+    summary = get_page_summary(page.text)
+
+    @env.with_transaction(db)
+    def do_update_test_description_title(db):
+        for realm in ('testcatalog', 'testcase'):
+            query = ObjectQuery(env, realm).filter('page_name', '=', page.name)
+            for obj in query.execute(db):
+                if obj['title'] == title and obj['summary'] == summary:
+                    continue
+                    
+                env.log.debug("Updating the title of %s %s" % (realm, page.name))
+
+                obj.wikipage = page
+                obj['title'] = title
+                obj['summary'] = summary
+                obj.save_changes(page.author, None, db=db, save_wiki_page=False)
+
+def get_test_description_titles(env, page_names, db=None):
+    """
+    Returns a dictionary with the titles of the test catalogs and test
+    cases with the specified page names, read from the stored titles.
+    Only the pages without a stored title are read from the wiki.
+    """
+    if not db:
+        db = env.get_read_db()
+
+    page_names = list(page_names)
+    titles = {}
+
+    cursor = db.cursor()
+    for realm in ('testcatalog', 'testcase'):
+        if page_names:
+            cursor.execute("SELECT page_name, title FROM %s WHERE page_name IN (%s)"
+                           % (realm, ','.join(['%s'] * len(page_names))), page_names)
+            for page_name, title in cursor:
+                if title is not None:
+                    titles[page_name] = title
+
+    for page_name in page_names:
+        if page_name not in titles:
+            titles[page_name] = get_page_title(WikiPage(env, page_name).text)
+
+    return titles
+
+def _get_catalog_path(page_name):
+    """
+    Returns the IDs of the catalogs on the path from the root of the 
+    tree down to the specified test catalog or test case page.
+    For a test catalog, the path ends with the catalog's own ID, while
+    for a test case it ends with the ID of its enclosing catalog.
+    
+    For example, the path of 'TC_TT0_TT34_TC65' is ['0', '34'].
+    """
+    return [token[2:] for token in page_name.split('_')[1:] if token.startswith('TT')]
+
+def _get_catalog(env, id, page_name):
+    """
+    Returns the test catalog with the specified ID, going through the 
+    active identity map, if any.
+    """
+    tcat = GenericClassModelProvider(env).get_object('testcatalog', {'id': id})
+    if tcat is None or not tcat.exists:
+        tcat = TestCatalog(env, id, page_name)
+        
+    return tcat
+
+        
 class TestManagerModelProvider(Component):
     """
     This class provides the data model for the test management plugin.
@@ -842,19 +1270,44 @@ class TestManagerModelProvider(Component):
                     {'table':
                         Table('testcatalog', key = ('id'))[
                               Column('id'),
-                              Column('page_name')],
+                              Column('page_name'),
+                              Column('parent_id'),
+                              Column('depth', type='int'),
+                              Column('title'),
+                              Column('summary'),
+                              Index(['page_name']),
+                              Index(['parent_id'])],
                      'has_custom': True,
                      'has_change': True,
+                     'custom_indexes': [Index(['name', 'value'])],
+                     'pattern_indexes': ['page_name'],
+                     'version': 4},
+                'testcatalogclosure':  
+                    {'table':
+                        Table('testcatalogclosure', key = ('ancestor', 'descendant'))[
+                              Column('ancestor'),
+                              Column('descendant'),
+                              Column('depth', type='int'),
+                              Index(['descendant'])],
+                     'has_custom': False,
+                     'has_change': False,
                      'version': 1},
                 'testcase':  
                     {'table':
                         Table('testcase', key = ('id'))[
                               Column('id'),
                               Column('page_name'),
-                              Column('exec_order', type='int')],
+                              Column('exec_order', type='int'),
+                              Column('parent_id'),
+                              Column('title'),
+                              Column('summary'),
+                              Index(['page_name']),
+                              Index(['parent_id'])],
                      'has_custom': True,
                      'has_change': True,
-                     'version': 2},
+                     'custom_indexes': [Index(['name', 'value'])],
+                     'pattern_indexes': ['page_name'],
+                     'version': 6},
                 'testcaseinplan':  
                     {'table':
                         Table('testcaseinplan', key = ('id', 'planid'))[
@@ -862,10 +1315,15 @@ class TestManagerModelProvider(Component):
                               Column('planid'),
                               Column('page_name'),
                               Column('page_version', type='int'),
-                              Column('status')],
+                              Column('status'),
+                              Column('version', type='int'),
+                              Index(['planid']),
+                              Index(['page_name'])],
                      'has_custom': True,
                      'has_change': True,
-                     'version': 2},
+                     'custom_indexes': [Index(['name', 'value'])],
+                     'pattern_indexes': ['page_name'],
+                     'version': 4},
                 'testcasehistory':  
                     {'table':
                         Table('testcasehistory', key = ('id', 'planid', 'time'))[
@@ -890,28 +1348,39 @@ class TestManagerModelProvider(Component):
                               Column('contains_all', type='int'),
                               Column('freeze_tc_versions', type='int'),
                               Index(['id']),
-                              Index(['catid'])],
+                              Index(['catid']),
+                              Index(['page_name'])],
                      'has_custom': True,
                      'has_change': True,
-                     'version': 2}
+                     'custom_indexes': [Index(['name', 'value'])],
+                     'pattern_indexes': ['page_name'],
+                     'version': 3}
             }
 
     FIELDS = {
                 'testcatalog': [
                     {'name': 'id', 'type': 'text', 'label': N_('ID')},
-                    {'name': 'page_name', 'type': 'text', 'label': N_('Wiki page name')}
+                    {'name': 'page_name', 'type': 'text', 'label': N_('Wiki page name')},
+                    {'name': 'parent_id', 'type': 'text', 'label': N_('Parent Catalog ID')},
+                    {'name': 'depth', 'type': 'int', 'label': N_('Depth')},
+                    {'name': 'title', 'type': 'text', 'label': N_('Title'), 'no_history': True},
+                    {'name': 'summary', 'type': 'text', 'label': N_('Summary'), 'no_history': True}
                 ],
                 'testcase': [
                     {'name': 'id', 'type': 'text', 'label': N_('ID')},
                     {'name': 'page_name', 'type': 'text', 'label': N_('Wiki page name')},
-                    {'name': 'exec_order', 'type': 'int', 'label': N_('Order')}
+                    {'name': 'exec_order', 'type': 'int', 'label': N_('Order')},
+                    {'name': 'parent_id', 'type': 'text', 'label': N_('Catalog ID')},
+                    {'name': 'title', 'type': 'text', 'label': N_('Title'), 'no_history': True},
+                    {'name': 'summary', 'type': 'text', 'label': N_('Summary'), 'no_history': True}
                 ],
                 'testcaseinplan': [
                     {'name': 'id', 'type': 'text', 'label': N_('ID')},
                     {'name': 'planid', 'type': 'text', 'label': N_('Plan ID')},
                     {'name': 'page_name', 'type': 'text', 'label': N_('Wiki page name')},
                     {'name': 'page_version', 'type': 'int', 'label': N_('Wiki page version')},                    
-                    {'name': 'status', 'type': 'text', 'label': N_('Status')}
+                    {'name': 'status', 'type': 'text', 'label': N_('Status')},
+                    {'name': 'version', 'type': 'int', 'label': N_('Version')}
                 ],
                 'testplan': [
                     {'name': 'id', 'type': 'text', 'label': N_('ID')},
@@ -929,19 +1398,24 @@ class TestManagerModelProvider(Component):
                         'label': "Test Catalog", 
                         'searchable': True,
                         'has_custom': True,
-                        'has_change': True
+                        'has_change': True,
+                        'fulltext_index': True,
+                        'page_name_prefix': 'TC_'
                     },
                 'testcase': {
                         'label': "Test Case", 
                         'searchable': True,
                         'has_custom': True,
-                        'has_change': True
+                        'has_change': True,
+                        'fulltext_index': True,
+                        'page_name_prefix': 'TC_'
                     },
                 'testcaseinplan': {
                         'label': "Test Case in a Plan", 
                         'searchable': False,
                         'has_custom': True,
-                        'has_change': True
+                        'has_change': True,
+                        'has_version': True
                     },
                 'testplan': {
                         'label': "Test Plan", 
@@ -1000,10 +1474,10 @@ class TestManagerModelProvider(Component):
 
     def check_permission(self, req, realm, key_str=None, operation='set', name=None, value=None):
         if 'TEST_VIEW' not in req.perm:
-            raise PermissionError('TEST_VIEW', realm)
+            raise PermissionError('TEST_VIEW')
             
         if operation == 'set' and 'TEST_MODIFY' not in req.perm:
-            raise PermissionError('TEST_MODIFY', realm)
+            raise PermissionError('TEST_MODIFY')
 
 
     # IEnvironmentSetupParticipant methods
@@ -1166,3 +1640,60 @@ class TestManagerModelProvider(Component):
                 next_id += 1
 
 
+    def rebuild_catalog_hierarchy(self, db=None):
+        """
+        Recomputes the parent and depth of all the test catalogs, and 
+        the contents of the hierarchy closure table, from the catalog 
+        page names.
+        Used by the upgrade modules to fill the hierarchy index of 
+        existing databases.
+        """
+        @self.env.with_transaction(db)
+        def do_rebuild_catalog_hierarchy(db):
+            cursor = db.cursor()
+            cursor.execute("SELECT id, page_name FROM testcatalog")
+
+            catalogs = []
+            closure = []
+            for id_, page_name in cursor.fetchall():
+                path = _get_catalog_path(page_name)
+                catalogs.append((path[-2] if len(path) > 1 else None, len(path) - 1, id_))
+                closure += [(ancestor, id_, len(path) - 1 - i) for i, ancestor in enumerate(path)]
+
+            self.env.log.info("Rebuilding the hierarchy of %d test catalogs" % len(catalogs))
+
+            cursor.executemany("UPDATE testcatalog SET parent_id = %s, depth = %s WHERE id = %s",
+                catalogs)
+                
+            cursor.execute("DELETE FROM testcatalogclosure")
+            cursor.executemany("INSERT INTO testcatalogclosure (ancestor, descendant, depth) "
+                               "VALUES (%s, %s, %s)", closure)
+
+        invalidate_object_cache(self.env, 'testcatalog', db)
+
+    def rebuild_titles(self, realm, db=None):
+        """
+        Recomputes the stored title and summary of all the test catalogs
+        or test cases, depending on the realm, from the latest version
+        of their wiki pages.
+        Used by the upgrade modules to fill the titles of existing
+        databases.
+        """
+        @self.env.with_transaction(db)
+        def do_rebuild_titles(db):
+            cursor = db.cursor()
+            cursor.execute("SELECT t.id, w.text FROM %s t, wiki w, "
+                           "(SELECT name, max(version) AS version FROM wiki GROUP BY name) m "
+                           "WHERE w.name = t.page_name AND m.name = w.name AND m.version = w.version"
+                           % realm)
+
+            rows = [(get_page_title(text), get_page_summary(text), id_) 
+                    for id_, text in cursor.fetchall()]
+
+            self.env.log.info("Rebuilding the titles of %d objects of class %s" % (len(rows), realm))
+
+            cursor.executemany("UPDATE %s SET title = %%s, summary = %%s WHERE id = %%s" % realm, 
+                rows)
+
+        invalidate_object_cache(self.env, realm, db)
+
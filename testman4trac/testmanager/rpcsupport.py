@@ -16,6 +16,7 @@ from trac.util import get_reporter_id
 
 from testmanager.api import TestManagerSystem
 from testmanager.model import TestCatalog, TestCase, TestCaseInPlan, TestPlan
+from tracgenericclass.model import GenericClassModelProvider
 from tracgenericclass.util import formatExceptionInfo
 from trac.core import Component, implements
 
@@ -346,7 +347,10 @@ try:
             (test_catalog_id, wiki_page_name, title, description, customfields) """
             
             try:
-                for tc in TestCatalog.list_root_catalogs(self.env):
+                tcats = list(TestCatalog.list_root_catalogs(self.env))
+                TestCatalog.prefetch_wiki_pages(self.env, tcats)
+                
+                for tc in tcats:
                     customfields = []
                     self._append_custom_fields(tc, customfields)
 
@@ -368,7 +372,10 @@ try:
                 if not tcat.exists:
                     self.env.log.error("Input test catalog with ID %s not found." % catalog_id)
                 else:
-                    for tc in tcat.list_subcatalogs():
+                    tcats = list(tcat.list_subcatalogs())
+                    TestCatalog.prefetch_wiki_pages(self.env, tcats)
+                    
+                    for tc in tcats:
                         customfields = []
                         self._append_custom_fields(tc, customfields)
 
@@ -419,17 +426,21 @@ try:
                 else:
                     tc_list = {}
                     if plan_id is None or plan_id == '':
-                        for tc in tcat.list_testcases():
+                        tcs = list(tcat.list_testcases())
+                        TestCase.prefetch_wiki_pages(self.env, tcs)
+                        
+                        for tc in tcs:
                             # Returned object is a TestCase
                             customfields = []
                             self._append_custom_fields(tc, customfields)
 
                             tc_list[tc['exec_order']] = (tc['id'], tc['page_name'], tc.title, tc.description, customfields)
                     else:
+                        tcip_fields = GenericClassModelProvider(self.env).get_custom_fields('testcaseinplan')
                         for tcip in tcat.list_testcases(plan_id):
-                            # Returned object is a TestCaseInPlan
-                            customfields = []
-                            self._append_custom_fields(tcip, customfields)
+                            # Returned object is a read-only record
+                            customfields = [(f['name'], tcip[f['name']], f.get('label')) 
+                                            for f in tcip_fields]
 
                             tc_list[tcip['exec_order']] = (tcip['id'], tcip['page_name'], tcip['status'], customfields)
 
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+import unittest
+
+from testmanager.tests import api, fulltext, model, query, upgrades, wiki
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(api.suite())
+    suite.addTest(fulltext.suite())
+    suite.addTest(model.suite())
+    suite.addTest(query.suite())
+    suite.addTest(upgrades.suite())
+    suite.addTest(wiki.suite())
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+import json
+import threading
+import time
+import unittest
+
+from genshi.core import Stream, TEXT
+from trac.test import Mock, MockPerm
+
+from testmanager.model import TestCase, TestCaseInPlan, TestPlan
+from testmanager.tests.base import ChangeRecorder, TestManagerTestCase
+from tracgenericclass.api import ChangeEventDispatcher, GenericClassSystem
+from tracgenericclass.model import get_identity_map
+
+
+class BatchPropertyUpdateTestCase(TestManagerTestCase):
+
+    config = [('testcaseinplan-tm_custom', 'notes', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.create_testcase('2', self.tcat)
+        self.create_testcase('3', self.tcat)
+        self.create_testplan('7', self.tcat)
+        self.create_testplan('8', self.tcat)
+
+    def _batch(self, operations, perm=None):
+        output = []
+        if not isinstance(operations, basestring):
+            operations = json.dumps(operations)
+        req = Mock(path_info='/propertyupdate/batch', args={'operations': operations},
+                   authname='tester', perm=(perm, MockPerm())[perm is None], remote_addr='127.0.0.1',
+                   send_header=lambda name, value: None, write=output.append)
+
+        GenericClassSystem(self.env).process_request(req)
+
+        return json.loads(''.join(output))
+
+    def test_update_several_objects(self):
+        results = self._batch([
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'name', 'value': 'First'},
+            {'realm': 'testplan', 'key': "{'id':'8'}", 'name': 'name', 'value': 'Second'},
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'author', 'value': 'joe'},
+            {'realm': 'testcaseinplan', 'key': {'id': '2', 'planid': '7'}, 
+             'name': 'notes', 'value': 'Some notes', 
+             'props': {'page_name': 'TC_TT1_TC2', 'status': 'successful'}}])
+
+        self.assertEqual(['OK'] * 4, [r['result'] for r in results])
+        
+        self.assertEqual(('First', 'joe'), (TestPlan(self.env, '7')['name'], 
+                                            TestPlan(self.env, '7')['author']))
+        self.assertEqual('Second', TestPlan(self.env, '8')['name'])
+
+        tcip = TestCaseInPlan(self.env, '2', '7')
+        self.assertTrue(tcip.exists)
+        self.assertEqual(('Some notes', 'successful'), (tcip['notes'], tcip['status']))
+
+    def test_change_history(self):
+        self._batch([
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'name', 'value': 'First'},
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'author', 'value': 'joe'}])
+
+        changes = list(TestPlan(self.env, '7').list_change_history())
+        self.assertEqual([('tester', 'author', 'joe'), ('tester', 'name', 'First')],
+                         [(author, field, new) for ts, author, field, old, new in changes])
+
+    def test_invalid_operations(self):
+        results = self._batch([
+            {'realm': 'testplan', 'name': 'name', 'value': 'No key'},
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'name', 'value': 'First'}])
+
+        self.assertEqual(('ERROR', 'Invalid operation.'), 
+                         (results[0]['result'], results[0]['message']))
+        self.assertEqual('OK', results[1]['result'])
+        self.assertEqual('First', TestPlan(self.env, '7')['name'])
+
+        results = self._batch('not json')
+        self.assertEqual(['ERROR'], [r['result'] for r in results])
+
+    def test_permission_denied(self):
+        results = self._batch([
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'name', 'value': 'First'}],
+            perm=[])
+
+        self.assertEqual(('ERROR', 'Permission denied.'), 
+                         (results[0]['result'], results[0]['message']))
+        self.assertEqual('Plan 7', TestPlan(self.env, '7')['name'])
+
+    def test_single_transaction(self):
+        results = self._batch([
+            {'realm': 'testplan', 'key': {'id': '7'}, 'name': 'name', 'value': 'First'},
+            {'realm': 'testcatalog', 'key': {'id': '99'}, 'name': 'parent_id', 'value': '1'}])
+
+        self.assertEqual([('ERROR', 'Error saving the changes.')] * 2, 
+                         [(r['result'], r['message']) for r in results])
+        self.assertEqual('Plan 7', TestPlan(self.env, '7')['name'])
+
+
+class RequestIdentityMapTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.system = GenericClassSystem(self.env)
+        self.req = Mock(path_info='/testcase', args={}, authname='tester', perm=MockPerm())
+
+    def tearDown(self):
+        identity_map = get_identity_map(self.env)
+        if identity_map is not None:
+            identity_map.deactivate()
+        TestManagerTestCase.tearDown(self)
+
+    def test_deactivated_after_rendering(self):
+        self.system.pre_process_request(self.req, None)
+        identity_map = get_identity_map(self.env)
+        self.assertNotEqual(None, identity_map)
+
+        self.system.post_process_request(self.req, 'template.html', {}, None)
+        self.assertTrue(get_identity_map(self.env) is identity_map)
+
+        stream = Stream([(TEXT, 'text', None)])
+        stream = self.system.filter_stream(self.req, 'xhtml', 'template.html', stream, {})
+
+        # Fragments rendered along the response are left alone
+        fragment = Stream([])
+        self.assertTrue(self.system.filter_stream(self.req, 'xhtml', 'fragment.html', 
+                                                  fragment, {}) is fragment)
+        self.assertTrue(get_identity_map(self.env) is identity_map)
+
+        self.assertEqual('text', stream.render('text'))
+        self.assertEqual(None, get_identity_map(self.env))
+
+    def test_deactivated_without_rendering(self):
+        self.system.pre_process_request(self.req, None)
+        self.system.post_process_request(self.req, None, None, None)
+        self.assertEqual(None, get_identity_map(self.env))
+
+    def test_replaced_by_next_request(self):
+        self.system.pre_process_request(self.req, None)
+        identity_map = get_identity_map(self.env)
+
+        self.system.pre_process_request(self.req, None)
+        self.assertNotEqual(None, get_identity_map(self.env))
+        self.assertFalse(get_identity_map(self.env) is identity_map)
+
+    def test_deactivated_after_property_update(self):
+        self.system.pre_process_request(self.req, None)
+        self.assertNotEqual(None, get_identity_map(self.env))
+
+        tcat = self.create_catalog('1')
+        req = Mock(path_info='/propertyupdate', authname='tester', perm=MockPerm(), 
+                   remote_addr='127.0.0.1', send_header=lambda name, value: None, 
+                   write=lambda data: None,
+                   args={'realm': 'testcatalog', 'key': "{'id':'1'}", 
+                         'name': 'title', 'value': 'Changed'})
+        self.system.process_request(req)
+        self.assertEqual(None, get_identity_map(self.env))
+
+
+class BlockingListener(object):
+    """
+    Records the events delivered by a dispatcher, as tuples of the
+    listener method name, the object id, its title and the additional
+    arguments. 
+    Delivery is blocked in the first event until release() is called.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def release(self):
+        self.released.set()
+
+    def _record(self, method, g_object, *args):
+        self.started.set()
+        self.released.wait(10)
+        self.events.append((method, g_object['id'], g_object['title']) + args)
+
+    def object_created(self, realm, g_object):
+        self._record('object_created', g_object)
+
+    def object_changed(self, realm, g_object, comment, author, old_values):
+        self._record('object_changed', g_object, comment, author, old_values)
+
+    def object_deleted(self, realm, g_object):
+        self._record('object_deleted', g_object)
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class ChangeEventDispatcherTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.listener = BlockingListener()
+        self.tcat = self.create_catalog('1')
+        self.tc = self.create_testcase('2', self.tcat)
+
+    def tearDown(self):
+        self.listener.release()
+        TestManagerTestCase.tearDown(self)
+
+    def _block(self, dispatcher):
+        """Keeps the worker busy delivering the creation of catalog 1."""
+        dispatcher.dispatch([self.listener], 'object_created', 'testcatalog', [self.tcat])
+        self.assertTrue(self.listener.started.wait(10))
+
+    def _wait_delivered(self, count):
+        self.listener.release()
+        self.assertTrue(wait_until(lambda: len(self.listener.events) >= count))
+        time.sleep(0.05)
+        self.assertEqual(count, len(self.listener.events))
+
+    def test_changes_coalesced(self):
+        dispatcher = ChangeEventDispatcher(self.env, num_workers=1)
+        self._block(dispatcher)
+
+        dispatcher.dispatch([self.listener], 'object_changed', 'testcase', [self.tc],
+                            ('first', 'joe', {'title': 'Test case 2'}))
+        dispatcher.dispatch([self.listener], 'object_changed', 'testcase', [self.tc],
+                            ('second', 'bob', {'title': 'Changed', 'description': 'Old'}))
+        self.assertEqual(1, dispatcher.queued)
+
+        self._wait_delivered(2)
+        self.assertEqual(('object_changed', '2', 'Test case 2', 'second', 'bob',
+                          {'title': 'Test case 2', 'description': 'Old'}), 
+                         self.listener.events[1])
+
+    def test_per_object_order(self):
+        dispatcher = ChangeEventDispatcher(self.env, num_workers=2)
+        self._block(dispatcher)
+
+        # Neither the deletion and the later creation, nor the events of
+        # other objects in between, are merged
+        tc3 = TestCase(self.env, '3', 'TC_TT1_TC3', 'Test case 3')
+        for method, obj in (('object_changed', self.tc), ('object_created', tc3), 
+                            ('object_deleted', self.tc), ('object_created', self.tc),
+                            ('object_changed', tc3), ('object_changed', self.tc)):
+            args = method == 'object_changed' and ('', 'joe', {}) or ()
+            dispatcher.dispatch([self.listener], method, 'testcase', [obj], args)
+
+        self._wait_delivered(7)
+        self.assertEqual(['object_changed', 'object_deleted', 'object_created', 
+                          'object_changed'],
+                         [e[0] for e in self.listener.events if e[1] == '2'])
+        self.assertEqual(['object_created', 'object_changed'],
+                         [e[0] for e in self.listener.events if e[1] == '3'])
+
+    def test_full_queue_blocks_caller(self):
+        dispatcher = ChangeEventDispatcher(self.env, max_queue_size=1, num_workers=1)
+        self._block(dispatcher)
+
+        dispatcher.dispatch([self.listener], 'object_created', 'testcase', [self.tc])
+        
+        caller = threading.Thread(target=dispatcher.dispatch, args=([self.listener], 
+            'object_deleted', 'testcase', [self.tc]))
+        caller.setDaemon(True)
+        caller.start()
+        caller.join(0.2)
+        self.assertTrue(caller.isAlive())
+        self.assertEqual(1, dispatcher.queued)
+
+        self.listener.release()
+        caller.join(10)
+        self.assertFalse(caller.isAlive())
+        self._wait_delivered(3)
+        self.assertEqual(['object_created', 'object_created', 'object_deleted'],
+                         [e[0] for e in self.listener.events])
+
+    def test_objects_snapshot(self):
+        dispatcher = ChangeEventDispatcher(self.env, num_workers=1)
+        self._block(dispatcher)
+
+        self.tc['title'] = 'Changed'
+        dispatcher.dispatch([self.listener], 'object_changed', 'testcase', [self.tc],
+                            ('', 'joe', {'title': 'Test case 2'}))
+        self.tc['title'] = 'Changed again'
+
+        self._wait_delivered(2)
+        self.assertEqual('Changed', self.listener.events[1][2])
+
+
+class AfterCommitNotificationTestCase(TestManagerTestCase):
+
+    config = [('tracgenericclass', 'async_listeners', 'true')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.recorder = ChangeRecorder(self.env)
+        self.tcat = self.create_catalog('1')
+        self.assertTrue(wait_until(lambda: len(self.recorder.events) == 1))
+        del self.recorder.events[:]
+
+    def test_notified_after_commit(self):
+        @self.env.with_transaction()
+        def do_create(db):
+            self.create_testcase('2', self.tcat)
+            self.create_testcase('3', self.tcat)
+            time.sleep(0.1)
+            self.assertEqual([], self.recorder.events)
+
+        self.assertTrue(wait_until(lambda: len(self.recorder.events) == 2))
+        self.assertEqual([('object_created', 'testcase', ['2']), 
+                          ('object_created', 'testcase', ['3'])], 
+                         self.recorder.events)
+
+    def test_dropped_on_rollback(self):
+        try:
+            @self.env.with_transaction()
+            def do_create(db):
+                self.create_testcase('2', self.tcat)
+                self.tcat.description = 'Changed'
+                self._save(self.tcat, 'Changed')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.create_testcase('3', self.tcat)
+        self.assertTrue(wait_until(lambda: len(self.recorder.events) == 1))
+        time.sleep(0.1)
+        self.assertEqual([('object_created', 'testcase', ['3'])], 
+                         self.recorder.events)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BatchPropertyUpdateTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RequestIdentityMapTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ChangeEventDispatcherTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(AfterCommitNotificationTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
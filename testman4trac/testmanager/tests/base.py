@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+import shutil
+import tempfile
+import unittest
+
+from trac.core import Component, implements
+from trac.env import Environment
+
+from testmanager.model import TestCatalog, TestCase, TestPlan
+from tracgenericclass.api import IGenericObjectChangeListener
+from tracgenericclass.model import GenericClassModelProvider
+
+
+class ChangeRecorder(Component):
+    """
+    Records the change events notified to the listeners, as tuples of
+    the listener method name, the realm and the object ids.
+    """
+
+    implements(IGenericObjectChangeListener)
+
+    def __init__(self):
+        self.events = []
+
+    def objects_created(self, realm, g_objects):
+        self.events.append(('objects_created', realm, [obj['id'] for obj in g_objects]))
+
+    def object_created(self, realm, g_object):
+        self.events.append(('object_created', realm, [g_object['id']]))
+
+    def object_changed(self, realm, g_object, comment, author, old_values):
+        self.events.append(('object_changed', realm, [g_object['id']]))
+
+    def object_deleted(self, realm, g_object):
+        self.events.append(('object_deleted', realm, [g_object['id']]))
+
+
+class TestManagerTestCase(unittest.TestCase):
+    """
+    Base class of the tests needing an environment with the Test 
+    Manager data model.
+    
+    Sub-classes can set the 'config' class attribute to a list of
+    (section, name, value) options of the environment, e.g. to declare
+    custom fields.
+    """
+
+    config = []
+
+    def setUp(self):
+        # A database file is used, instead of the shared in-memory
+        # database, so every test starts from a new data model. 
+        # Change listeners are notified synchronously, so no worker
+        # thread is left using the database.
+        self.path = tempfile.mkdtemp(prefix='testmanager-')
+        self.env = Environment(self.path, create=True, options=[
+            ('trac', 'database', 'sqlite:db/trac.db'),
+            ('components', 'tracgenericclass.*', 'enabled'),
+            ('components', 'testmanager.*', 'enabled'),
+            ('components', 'tracgenericworkflow.*', 'enabled'),
+            ('tracgenericclass', 'async_listeners', 'false')] + self.config)
+
+        # Custom fields are cached across environments
+        provider = GenericClassModelProvider(self.env)
+        for realm in provider.get_known_realms():
+            provider.custom_fields(realm, refresh=True)
+
+    def tearDown(self):
+        self.env.shutdown()
+        shutil.rmtree(self.path)
+
+    def _insert(self, obj, values={}, db=None):
+        obj.set_values(values)
+        obj.author = 'tester'
+        obj.remote_addr = '127.0.0.1'
+        obj.insert(db=db)
+        return obj
+
+    def _save(self, obj, comment='', db=None, **kwargs):
+        obj.author = 'tester'
+        obj.remote_addr = '127.0.0.1'
+        obj.save_changes('tester', comment, db=db, **kwargs)
+        return obj
+
+    def create_catalog(self, id, parent=None, **values):
+        page_name = (parent['page_name'] if parent is not None else 'TC') + '_TT' + id
+        return self._insert(TestCatalog(self.env, id, page_name, 
+                                        'Catalog ' + id, 'Catalog description'), values)
+
+    def create_testcase(self, id, tcat, **values):
+        return self._insert(TestCase(self.env, id, tcat['page_name'] + '_TC' + id,
+                                     'Test case ' + id, 'Test case description'), values)
+
+    def create_testplan(self, id, tcat, contains_all=1, selected_tcs=[], **values):
+        return self._insert(TestPlan(self.env, id, tcat['id'], tcat['page_name'],
+                                     'Plan ' + id, 'tester', contains_all, 0, 
+                                     selected_tcs), values)
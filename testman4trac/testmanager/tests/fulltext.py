@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+#
+# This file is part of the Test Manager plugin for Trac.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at:
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+#
+
+import unittest
+
+from trac.test import Mock
+from trac.web.href import Href
+from trac.wiki.model import WikiPage
+
+from testmanager.tests.base import TestManagerTestCase
+from tracgenericclass.fulltext import FULLTEXT_TABLE, is_fulltext_indexed, \
+    rebuild_fulltext_index, search_fulltext_index
+from tracgenericclass.util import db_supports_fulltext, list_available_tables
+
+
+class FullTextIndexTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.req = Mock(href=Href('/trac'), authname='tester')
+        self.tcat = self.create_catalog('1')
+        self.tc = self.create_testcase('2', self.tcat)
+        self.create_testcase('3', self.tcat)
+
+    def _search(self, *terms, **kwargs):
+        realms = kwargs.get('realms', ('testcase', 'testcatalog'))
+        return list(search_fulltext_index(self.env, self.req, realms, terms))
+
+    def _titles(self, *terms, **kwargs):
+        return sorted([result[1] for result in self._search(*terms, **kwargs)])
+
+    def _documents(self):
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT realm,key_str,title FROM %s ORDER BY realm,key_str"
+                       % FULLTEXT_TABLE)
+        return cursor.fetchall()
+
+    def test_index_created(self):
+        db = self.env.get_read_db()
+        self.assertEqual('fts5', db_supports_fulltext(self.env, db))
+
+        tables = list_available_tables(self.env.config.get('trac', 'database'),
+                                       db.cursor())
+        self.assertTrue(FULLTEXT_TABLE in tables)
+        self.assertTrue(FULLTEXT_TABLE + '_fts' in tables)
+
+        for realm in ('testcatalog', 'testcase'):
+            self.assertTrue(is_fulltext_indexed(self.env, realm))
+        self.assertFalse(is_fulltext_indexed(self.env, 'testplan'))
+
+    def test_objects_indexed_on_creation(self):
+        self.assertEqual([('testcase', "{'id':'2'}", 'Test case 2'),
+                          ('testcase', "{'id':'3'}", 'Test case 3'),
+                          ('testcatalog', "{'id':'1'}", 'Catalog 1')],
+                         self._documents())
+
+    def test_search_results(self):
+        results = self._search('case', '2')
+
+        self.assertEqual(1, len(results))
+        href, title, time, author, excerpt = results[0]
+        self.assertEqual('/trac/wiki/TC_TT1_TC2', href)
+        self.assertEqual('Test case 2', title)
+        self.assertEqual(self.tc.wikipage.time, time)
+        self.assertEqual('tester', author)
+        self.assertTrue('description' in excerpt)
+
+    def test_search_prefix_and_realms(self):
+        self.assertEqual(['Catalog 1', 'Test case 2', 'Test case 3'],
+                         self._titles('descr'))
+        self.assertEqual(['Catalog 1'], self._titles('descr', realms=['testcatalog']))
+        self.assertEqual([], self._titles('descr', realms=[]))
+        self.assertEqual([], self._titles('descr', 'missing'))
+
+    def test_terms_quoted(self):
+        # FTS5 operators and syntax characters are matched as plain text
+        for terms in (['AND'], ['OR', 'case'], ['NEAR(case'], ['"case'],
+                      ['case"', '*'], ['-case'], ['title:case'], ['^case']):
+            self._search(*terms)
+
+        self.tc.description = 'Check the AND gate and "quoted" text'
+        self._save(self.tc, 'Changed')
+
+        self.assertEqual(['Test case 2'], self._titles('AND', 'gate'))
+        self.assertEqual(['Test case 2'], self._titles('"quoted"'))
+
+    def test_incremental_update(self):
+        self.tc.description = 'Now about zeppelins'
+        self._save(self.tc, 'Changed')
+
+        self.assertEqual(['Test case 2'], self._titles('zeppelin'))
+        self.assertEqual(['Catalog 1', 'Test case 3'], self._titles('descr'))
+
+        self.tc.delete()
+
+        self.assertEqual([], self._titles('zeppelin'))
+        self.assertEqual(2, len(self._documents()))
+
+    def test_update_rolled_back(self):
+        try:
+            @self.env.with_transaction()
+            def do_save(db):
+                self.tc.description = 'Now about zeppelins'
+                self._save(self.tc, 'Changed', db=db)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual([], self._titles('zeppelin'))
+        self.assertEqual(['Catalog 1', 'Test case 2', 'Test case 3'],
+                         self._titles('descr'))
+
+    def test_wiki_page_edit_reindexed(self):
+        page = WikiPage(self.env, 'TC_TT1_TC3')
+        page.text = '== Test case 3 ==\r\n\r\nEdited on the wiki about zeppelins'
+        page.save('bob', 'Direct edit', '127.0.0.1')
+
+        results = self._search('zeppelin')
+        self.assertEqual(1, len(results))
+        self.assertEqual('Test case 3', results[0][1])
+        self.assertEqual('bob', results[0][3])
+
+        # Pages not based on any object are not indexed
+        page = WikiPage(self.env, 'SomeZeppelins')
+        page.text = 'About zeppelins'
+        page.save('bob', '', '127.0.0.1')
+
+        self.assertEqual(['Test case 3'], self._titles('zeppelin'))
+
+    def test_rebuild(self):
+        @self.env.with_transaction()
+        def do_delete(db):
+            db.cursor().execute("DELETE FROM %s" % FULLTEXT_TABLE)
+
+        self.assertEqual([], self._titles('descr'))
+
+        rebuild_fulltext_index(self.env, 'testcase')
+
+        self.assertEqual(['Test case 2', 'Test case 3'], self._titles('descr'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FullTextIndexTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,1558 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+from datetime import datetime, timedelta
+import time
+import unittest
+
+from trac.core import TracError
+from trac.util.datefmt import utc
+from trac.wiki.model import WikiPage
+
+from testmanager.api import TestManagerSystem
+from testmanager.model import TestCatalog, TestCase, TestCaseInPlan, TestPlan, \
+    TestManagerModelProvider, ORDER_GAP
+from testmanager.tests.base import ChangeRecorder, TestManagerTestCase
+from tracgenericclass.api import GenericClassSystem
+from tracgenericclass.model import AbstractVariableFieldsObject, GenericClassModelProvider, \
+    IdentityMap, MAX_SQL_PARAMS, ConcurrentModificationError, get_identity_map, \
+    get_wide_table_columns, rebuild_wide_table
+from tracgenericclass import model, query, util
+from tracgenericclass.query import ObjectQuery
+from tracgenericclass.util import get_integrity_error, to_any_timestamp
+
+
+class FetchManyTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+
+    def test_fetch_in_key_order(self):
+        for id in ('2', '3', '4'):
+            self.create_testcase(id, self.tcat, priority='p' + id)
+
+        tcs = AbstractVariableFieldsObject.fetch_many(self.env, 'testcase', 
+            [{'id': '4'}, {'id': '2'}, {'id': '3'}])
+
+        self.assertEqual(['4', '2', '3'], [tc['id'] for tc in tcs])
+        self.assertEqual(['p4', 'p2', 'p3'], [tc['priority'] for tc in tcs])
+        self.assertEqual(['TC_TT1_TC4', 'TC_TT1_TC2', 'TC_TT1_TC3'], 
+                         [tc['page_name'] for tc in tcs])
+        for tc in tcs:
+            self.assertTrue(tc.exists)
+
+    def test_missing_keys_are_skipped(self):
+        self.create_testcase('2', self.tcat)
+
+        tcs = AbstractVariableFieldsObject.fetch_many(self.env, 'testcase', 
+            [{'id': '99'}, {'id': '2'}])
+
+        self.assertEqual(['2'], [tc['id'] for tc in tcs])
+
+    def test_no_keys(self):
+        self.assertEqual([], AbstractVariableFieldsObject.fetch_many(self.env, 'testcase', []))
+
+    def test_keys_beyond_one_statement(self):
+        self.create_testcase('2', self.tcat)
+
+        keys = [{'id': str(i)} for i in range(1000, 1000 + MAX_SQL_PARAMS)] + [{'id': '2'}]
+        tcs = AbstractVariableFieldsObject.fetch_many(self.env, 'testcase', keys)
+
+        self.assertEqual(['2'], [tc['id'] for tc in tcs])
+
+    def test_same_values_as_single_fetch(self):
+        self.create_testcase('2', self.tcat, priority='high')
+
+        fetched = AbstractVariableFieldsObject.fetch_many(self.env, 'testcase', [{'id': '2'}])[0]
+        single = TestCase(self.env, '2')
+
+        self.assertEqual(single.values, fetched.values)
+
+
+class ListMatchingObjectsTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('testcase-tm_custom', 'owner', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.create_testcase('2', self.tcat, priority='high', owner='joe')
+        self.create_testcase('3', self.tcat, priority='low')
+        self.create_testcase('4', self.tcat)
+        self.create_testcase('5', self.create_catalog('9'), priority='high')
+
+    def _list(self, **kwargs):
+        tc_search = TestCase(self.env)
+        tc_search['parent_id'] = '1'
+        return sorted(tc_search.list_matching_objects(**kwargs), key=lambda tc: tc['id'])
+
+    def test_same_values_as_single_fetch(self):
+        tcs = self._list()
+
+        self.assertEqual(['2', '3', '4'], [tc['id'] for tc in tcs])
+        for tc in tcs:
+            single = TestCase(self.env, tc['id'])
+            self.assertEqual(single.values, tc.values)
+            self.assertEqual(single.key, tc.key)
+            self.assertEqual(single.resource, tc.resource)
+            self.assertTrue(tc.exists)
+            self.assertEqual({}, tc._old)
+
+    def test_custom_fields(self):
+        self.assertEqual([('high', 'joe'), ('low', None), (None, None)],
+                         [(tc['priority'], tc['owner']) for tc in self._list()])
+
+    def test_no_per_object_fetch(self):
+        fetched = []
+        fetch_object = AbstractVariableFieldsObject._fetch_object
+        def counting_fetch_object(obj, key, db=None):
+            fetched.append(key)
+            return fetch_object(obj, key, db)
+
+        AbstractVariableFieldsObject._fetch_object = counting_fetch_object
+        try:
+            self.assertEqual(3, len(self._list()))
+            self.assertEqual([], fetched)
+
+            self.assertEqual(3, len(self._list(hydrate=False)))
+            self.assertEqual(3, len(fetched))
+        finally:
+            AbstractVariableFieldsObject._fetch_object = fetch_object
+
+    def test_same_objects_as_not_hydrated(self):
+        self.assertEqual([tc.values for tc in self._list(hydrate=False)],
+                         [tc.values for tc in self._list()])
+
+    def test_like_match(self):
+        tc_search = TestCase(self.env)
+        tc_search['page_name'] = 'TC_TT1_TC%'
+
+        self.assertEqual(['2', '3', '4'],
+                         sorted([tc['id'] for tc in tc_search.list_matching_objects(exact_match=False)]))
+
+    def test_wiki_page_loaded_on_access(self):
+        tc = self._list()[0]
+
+        self.assertEqual('Test case 2', tc.title)
+        self.assertEqual('TC_TT1_TC2', tc.wikipage.name)
+
+
+class RealmDescriptorTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('testcase-tm_custom', 'owner', 'text'),
+              ('testcase-tm_custom', 'owner.order', '1')]
+
+    def test_shared_by_the_objects_of_a_realm(self):
+        tcat = self.create_catalog('1')
+        tc = self.create_testcase('2', tcat)
+
+        descriptor = TestCase(self.env).descriptor
+        self.assertTrue(TestCase(self.env, '2').descriptor is descriptor)
+        self.assertTrue(tc.descriptor is descriptor)
+        self.assertTrue(tc.fields is descriptor.fields)
+        self.assertTrue(tc.metadata is descriptor.metadata)
+        self.assertFalse(tcat.descriptor is descriptor)
+
+    def test_fields(self):
+        descriptor = GenericClassModelProvider(self.env).get_descriptor('testcase')
+        fields = GenericClassModelProvider(self.env).get_fields('testcase')
+
+        self.assertEqual('testcase', descriptor.realm)
+        self.assertEqual(('id',), descriptor.key_names)
+        self.assertEqual(tuple([f['name'] for f in fields if not f.get('custom')]),
+                         descriptor.std_fields)
+        self.assertEqual(('priority', 'owner'), descriptor.custom_fields)
+        self.assertEqual((), descriptor.time_fields)
+        self.assertEqual(fields, list(descriptor.fields))
+        self.assertEqual('text', descriptor.fields_by_name['priority']['type'])
+        self.assertTrue(descriptor.fields_by_name['priority']['custom'])
+
+    def test_composite_key(self):
+        descriptor = GenericClassModelProvider(self.env).get_descriptor('testcaseinplan')
+        self.assertEqual(('id', 'planid'), descriptor.key_names)
+
+    def test_time_fields(self):
+        descriptor = GenericClassModelProvider(self.env).get_descriptor('testplan')
+        self.assertEqual(('time',), descriptor.time_fields)
+
+    def test_not_affected_by_copies(self):
+        provider = GenericClassModelProvider(self.env)
+        descriptor = provider.get_descriptor('testcase')
+
+        provider.get_fields('testcase')[0]['label'] = 'Changed'
+        provider.get_metadata('testcase')['label'] = 'Changed'
+
+        self.assertNotEqual('Changed', descriptor.fields[0]['label'])
+        self.assertNotEqual('Changed', descriptor.metadata['label'])
+        self.assertTrue(provider.get_descriptor('testcase') is descriptor)
+
+    def test_compiled_again_on_refresh(self):
+        provider = GenericClassModelProvider(self.env)
+        descriptor = provider.get_descriptor('testcase')
+
+        self.env.config.set('testcase-tm_custom', 'component', 'text')
+        provider.custom_fields('testcase', refresh=True)
+
+        refreshed = provider.get_descriptor('testcase')
+        self.assertFalse(refreshed is descriptor)
+        self.assertTrue('component' in refreshed.custom_fields)
+        self.assertFalse('component' in descriptor.custom_fields)
+
+    def test_statement_cache_invalidated_on_refresh(self):
+        provider = GenericClassModelProvider(self.env)
+        tcat = self.create_catalog('1')
+        self.create_testcase('2', tcat, priority='high')
+        TestCase(self.env, '2')
+
+        stats = provider.get_statement_cache_stats()['testcase']
+        self.assertTrue(stats['statements'] > 0)
+        self.assertTrue(stats['misses'] > 0)
+
+        self.env.config.set('testcase-tm_custom', 'component', 'text')
+        provider.custom_fields('testcase', refresh=True)
+
+        self.assertFalse('testcase' in provider.get_statement_cache_stats())
+
+        # The statements are built again with the new custom field
+        self.create_testcase('3', tcat, priority='low', component='core')
+        tc = TestCase(self.env, '3')
+        self.assertEqual('core', tc['component'])
+        self.assertEqual('low', tc['priority'])
+
+        stats = provider.get_statement_cache_stats()['testcase']
+        self.assertEqual(stats['statements'], stats['misses'])
+
+    def test_unknown_realm(self):
+        self.assertRaises(TracError, GenericClassModelProvider(self.env).get_descriptor, 'unknown')
+
+
+class IdentityMapTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.create_testcase('2', self.tcat)
+        self.create_testcase('3', self.tcat)
+
+        self.identity_map = IdentityMap(self.env)
+        self.identity_map.activate()
+
+    def tearDown(self):
+        self.identity_map.deactivate()
+        TestManagerTestCase.tearDown(self)
+
+    def _get(self, id):
+        return GenericClassModelProvider(self.env).get_object('testcase', {'id': id})
+
+    def test_same_object(self):
+        tc = self._get('2')
+
+        self.assertTrue(tc.exists)
+        self.assertTrue(self._get('2') is tc)
+        self.assertTrue(self.identity_map.get('testcase', {'id': 2}) is tc)
+        self.assertFalse(self._get('3') is tc)
+
+    def test_get_many(self):
+        tc = self._get('2')
+
+        fetched = []
+        fetch_many = AbstractVariableFieldsObject.fetch_many
+        def counting_fetch_many(env, realm, keys, db=None):
+            fetched.append(sorted([key['id'] for key in keys]))
+            return fetch_many(env, realm, keys, db)
+
+        AbstractVariableFieldsObject.fetch_many = staticmethod(counting_fetch_many)
+        try:
+            objs = self.identity_map.get_many('testcase', 
+                [{'id': '3'}, {'id': '2'}, {'id': '99'}])
+            self.assertEqual([['3', '99']], fetched)
+
+            self.assertEqual(['3', '2'], [obj['id'] for obj in objs])
+            self.assertTrue(objs[1] is tc)
+            self.assertTrue(self._get('3') is objs[0])
+
+            self.identity_map.get_many('testcase', [{'id': '2'}, {'id': '3'}])
+            self.assertEqual(1, len(fetched))
+        finally:
+            AbstractVariableFieldsObject.fetch_many = staticmethod(fetch_many)
+
+    def test_flush(self):
+        tc2 = self._get('2')
+        tc3 = self._get('3')
+        tc2['exec_order'] = 7
+        tc2.author = 'tester'
+        tc2.remote_addr = '127.0.0.1'
+
+        self.assertEqual([tc2], self.identity_map.get_dirty_objects())
+        self.assertEqual(1, self.identity_map.flush('tester', 'Flushed'))
+        self.assertEqual([], self.identity_map.get_dirty_objects())
+        self.assertEqual(0, self.identity_map.flush('tester'))
+
+        self.identity_map.deactivate()
+        self.assertEqual(7, TestCase(self.env, '2')['exec_order'])
+        self.assertEqual(tc3['exec_order'], TestCase(self.env, '3')['exec_order'])
+
+    def test_insert_and_delete(self):
+        tc = self.create_testcase('4', self.tcat)
+        self.assertTrue(self._get('4') is tc)
+
+        tc.delete()
+        self.assertFalse(self._get('4') is tc)
+        self.assertFalse(self._get('4').exists)
+
+    def test_clear(self):
+        tc = self._get('2')
+        tcat = GenericClassModelProvider(self.env).get_object('testcatalog', {'id': '1'})
+
+        self.identity_map.clear('testcase')
+        self.assertFalse(self._get('2') is tc)
+        self.assertTrue(GenericClassModelProvider(self.env).get_object(
+            'testcatalog', {'id': '1'}) is tcat)
+
+        tc = self._get('2')
+        self.identity_map.clear()
+        self.assertFalse(self._get('2') is tc)
+
+    def test_deactivate(self):
+        self.assertTrue(get_identity_map(self.env) is self.identity_map)
+
+        IdentityMap(self.env).deactivate()
+        self.assertTrue(get_identity_map(self.env) is self.identity_map)
+
+        tc = self._get('2')
+        self.identity_map.deactivate()
+        self.assertEqual(None, get_identity_map(self.env))
+        self.assertFalse(self._get('2') is tc)
+
+
+class ListMatchingRowsTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('testcase-tm_custom', 'priority.value', 'medium'),
+              ('testcase-tm_custom', 'owner', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.create_testcase('2', self.tcat, priority='high', owner='joe')
+        self.create_testcase('3', self.tcat)
+
+    def _rows(self, fields=None):
+        tc_search = TestCase(self.env)
+        tc_search['parent_id'] = '1'
+        return sorted(tc_search.list_matching_rows(fields))
+
+    def test_access(self):
+        row = self._rows(('id', 'title', 'priority'))[0]
+
+        self.assertEqual(('2', 'Test case 2', 'high'), tuple(row))
+        self.assertEqual('Test case 2', row[1])
+        self.assertEqual('Test case 2', row['title'])
+        self.assertEqual('Test case 2', row.title)
+        self.assertEqual('high', row.get('priority'))
+        self.assertEqual('x', row.get('owner', 'x'))
+        self.assertEqual({'id': '2', 'title': 'Test case 2', 'priority': 'high'}, 
+                         row.as_dict())
+        self.assertRaises(AttributeError, getattr, row, 'owner')
+
+    def test_same_values_as_objects(self):
+        fields = ('id', 'page_name', 'exec_order', 'parent_id', 'title')
+        for row in self._rows(fields):
+            tc = TestCase(self.env, row.id)
+            self.assertEqual([tc[f] for f in fields], list(row))
+
+    def test_default_standard_fields(self):
+        row = self._rows()[0]
+        self.assertEqual(GenericClassModelProvider(self.env).get_descriptor('testcase').std_fields, 
+                         row.fields)
+        self.assertEqual('TC_TT1_TC2', row.page_name)
+
+    def test_custom_field_default(self):
+        self.assertEqual([('2', 'high', 'joe'), ('3', 'medium', '')], 
+                         [tuple(row) for row in self._rows(('id', 'priority', 'owner'))])
+
+    def test_time_fields(self):
+        self.create_testplan('7', self.tcat)
+        tp_search = TestPlan(self.env)
+        tp_search['id'] = '7'
+
+        row = list(tp_search.list_matching_rows(('id', 'time')))[0]
+        self.assertEqual(TestPlan(self.env, '7')['time'], row.time)
+        self.assertTrue(isinstance(row.time, datetime))
+
+    def test_unknown_field(self):
+        self.assertRaises(TracError, self._rows, ('id', 'unknown'))
+
+
+class SkippedTestCase(TestCase):
+
+    def pre_insert(self, db):
+        return False
+
+
+class InsertManyTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('testcase-tm_custom', 'owner', 'text'),
+              ('tracgenericclass', 'wide_custom_tables', 'testcase')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.recorder = ChangeRecorder(self.env)
+        del self.recorder.events[:]
+
+    def _testcase(self, id, cls=TestCase, **values):
+        tc = cls(self.env, id, 'TC_TT1_TC' + id, 'Test case ' + id, 'Description ' + id)
+        tc.set_values(values)
+        tc.author = 'tester'
+        tc.remote_addr = '127.0.0.1'
+        return tc
+
+    def test_insert(self):
+        objs = [self._testcase('2', priority='high', owner='joe'),
+                self._testcase('3', priority='low'),
+                self._testcase('4')]
+
+        self.assertEqual(objs, AbstractVariableFieldsObject.insert_many(self.env, objs))
+
+        for obj in objs:
+            self.assertTrue(obj.exists)
+            self.assertEqual({}, obj._old)
+
+        self.assertEqual([('2', 'high', 'joe'), ('3', 'low', None), ('4', None, None)],
+                         [(tc['id'], tc['priority'], tc['owner']) 
+                          for tc in [TestCase(self.env, id) for id in ('2', '3', '4')]])
+        self.assertEqual('Test case 3', TestCase(self.env, '3').title)
+
+    def test_several_realms(self):
+        tcat = TestCatalog(self.env, '9', 'TC_TT9', 'Catalog 9', '')
+        tcat.author = 'tester'
+        tcat.remote_addr = '127.0.0.1'
+
+        AbstractVariableFieldsObject.insert_many(self.env, [self._testcase('2'), tcat, 
+                                                           self._testcase('3')])
+
+        self.assertTrue(TestCatalog(self.env, '9').exists)
+        self.assertEqual([('objects_created', 'testcase', ['2', '3']),
+                          ('object_created', 'testcatalog', ['9'])],
+                         sorted(self.recorder.events, key=lambda e: e[1]))
+
+    def test_listeners(self):
+        AbstractVariableFieldsObject.insert_many(self.env, [self._testcase('2')])
+        AbstractVariableFieldsObject.insert_many(self.env, [self._testcase('3'), 
+                                                           self._testcase('4')])
+
+        self.assertEqual([('object_created', 'testcase', ['2']),
+                          ('objects_created', 'testcase', ['3', '4'])],
+                         self.recorder.events)
+
+    def test_skipped_by_pre_insert(self):
+        objs = [self._testcase('2'), self._testcase('3', SkippedTestCase), self._testcase('4')]
+
+        inserted = AbstractVariableFieldsObject.insert_many(self.env, objs)
+
+        self.assertEqual(['2', '4'], [obj['id'] for obj in inserted])
+        self.assertFalse(objs[1].exists)
+        self.assertFalse(TestCase(self.env, '3').exists)
+        self.assertEqual([('objects_created', 'testcase', ['2', '4'])], self.recorder.events)
+
+    def test_wide_table(self):
+        rebuild_wide_table(self.env, 'testcase')
+
+        AbstractVariableFieldsObject.insert_many(self.env, 
+            [self._testcase('2', priority='high', owner='joe'), self._testcase('3')])
+
+        cursor = self.env.get_read_db().cursor()
+        cursor.execute("SELECT id, priority, owner FROM testcase_custom_wide ORDER BY id")
+        self.assertEqual([('2', 'high', 'joe'), ('3', None, None)], cursor.fetchall())
+
+    def test_rolled_back(self):
+        duplicate = self._testcase('2')
+        duplicate['page_name'] = 'TC_TT1_TC2_DUPLICATE'
+        objs = [self._testcase('2'), duplicate]
+
+        self.assertRaises(get_integrity_error(self.env), 
+                          AbstractVariableFieldsObject.insert_many, self.env, objs)
+
+        self.assertFalse(TestCase(self.env, '2').exists)
+        self.assertEqual([], self.recorder.events)
+
+
+class SaveChangesTestCase(TestManagerTestCase):
+
+    config = [('testplan-tm_custom', 'priority', 'text'),
+              ('testplan-tm_custom', 'owner', 'text'),
+              ('testplan-tm_custom', 'notes', 'text'),
+              ('tracgenericclass', 'wide_custom_tables', 'testplan')]
+
+    upsert = True
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.dburi = self.env.config.get('trac', 'database')
+        if not self.upsert:
+            util.upsert_support[self.dburi] = False
+            # Compile the statements again, without the upsert
+            GenericClassModelProvider(self.env).custom_fields('testplan', refresh=True)
+
+        rebuild_wide_table(self.env, 'testplan')
+        self.create_testplan('7', self.create_catalog('1'), priority='high')
+
+    def tearDown(self):
+        util.upsert_support.pop(self.dburi, None)
+        GenericClassModelProvider(self.env).custom_fields('testplan', refresh=True)
+        TestManagerTestCase.tearDown(self)
+
+    def _query(self, sql):
+        cursor = self.env.get_read_db().cursor()
+        cursor.execute(sql)
+        return cursor.fetchall()
+
+    def test_statement(self):
+        upsert_sql = TestPlan(self.env).descriptor.get_statement(
+            model._sql_upsert_custom, self.env)
+        self.assertEqual(self.upsert, upsert_sql is not None)
+
+    def test_save(self):
+        tp = TestPlan(self.env, '7')
+        tp['name'] = 'Changed'
+        tp['priority'] = 'low'
+        tp['owner'] = 'joe'
+        when = datetime(2015, 1, 1, tzinfo=utc)
+
+        self.assertTrue(tp.save_changes('tester', 'Changed', when))
+
+        self.assertEqual([('owner', 'joe'), ('priority', 'low')], 
+            self._query("SELECT name, value FROM testplan_custom WHERE id='7' ORDER BY name"))
+        self.assertEqual([('low', 'joe')], 
+            self._query("SELECT priority, owner FROM testplan_custom_wide WHERE id='7'"))
+        self.assertEqual([(to_any_timestamp(when), 'tester', 'name', 'Plan 7', 'Changed'),
+                          (to_any_timestamp(when), 'tester', 'owner', None, 'joe'),
+                          (to_any_timestamp(when), 'tester', 'priority', 'high', 'low')], 
+            self._query("SELECT time, author, field, oldvalue, newvalue FROM testplan_change "
+                        "WHERE id='7' ORDER BY field"))
+
+        tp = TestPlan(self.env, '7')
+        self.assertEqual(('Changed', 'low', 'joe', None), 
+                         (tp['name'], tp['priority'], tp['owner'], tp['notes']))
+
+    def test_only_custom_fields(self):
+        tp = TestPlan(self.env, '7')
+        tp['notes'] = 'Some notes'
+        tp.save_changes('tester', '')
+
+        tp = TestPlan(self.env, '7')
+        tp['notes'] = 'Other notes'
+        tp.save_changes('tester', '')
+
+        self.assertEqual([('notes', 'Other notes'), ('priority', 'high')], 
+            self._query("SELECT name, value FROM testplan_custom WHERE id='7' ORDER BY name"))
+        self.assertEqual([('high', 'Other notes')], 
+            self._query("SELECT priority, notes FROM testplan_custom_wide WHERE id='7'"))
+        self.assertEqual([(None, 'Some notes'), ('Some notes', 'Other notes')], 
+            self._query("SELECT oldvalue, newvalue FROM testplan_change "
+                        "WHERE id='7' ORDER BY time, newvalue DESC"))
+
+    def test_other_objects_not_affected(self):
+        self.create_testplan('8', TestCatalog(self.env, '1'), priority='low')
+
+        tp = TestPlan(self.env, '7')
+        tp['priority'] = 'medium'
+        tp.save_changes('tester', '')
+
+        self.assertEqual([('7', 'medium'), ('8', 'low')], 
+            self._query("SELECT id, value FROM testplan_custom ORDER BY id"))
+        self.assertEqual([], self._query("SELECT * FROM testplan_change WHERE id='8'"))
+
+    def test_not_modified(self):
+        self.assertFalse(TestPlan(self.env, '7').save_changes('tester', ''))
+        self.assertEqual([], self._query("SELECT * FROM testplan_change"))
+
+
+class ReplaceSaveChangesTestCase(SaveChangesTestCase):
+    """
+    The same tests, on a database backend without upsert support.
+    """
+
+    upsert = False
+
+
+class AggregateMatchingObjectsTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('testcase-tm_custom', 'estimate', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        tcat = self.create_catalog('1')
+        self.create_testcase('2', tcat, priority='high', estimate='3')
+        self.create_testcase('3', tcat, priority='high', estimate='5')
+        self.create_testcase('4', tcat, priority='low')
+        self.create_testcase('5', self.create_catalog('9'), priority='low', estimate='100')
+
+    def _search(self, **values):
+        tc_search = TestCase(self.env)
+        tc_search.set_values(values)
+        return tc_search
+
+    def test_count(self):
+        self.assertEqual(3, self._search(parent_id='1').count_matching_objects())
+        self.assertEqual(4, self._search(page_name='TC_TT%').count_matching_objects(exact_match=False))
+        self.assertEqual(0, self._search(parent_id='99').count_matching_objects())
+
+    def test_same_count_as_list(self):
+        for tc_search in (self._search(parent_id='1'), self._search(id='5'), self._search()):
+            self.assertEqual(len(list(tc_search.list_matching_objects())), 
+                             tc_search.count_matching_objects())
+
+    def test_functions(self):
+        tc_search = self._search(parent_id='1')
+
+        self.assertEqual(8, tc_search.aggregate_matching_objects('sum', 'estimate'))
+        self.assertEqual(4, tc_search.aggregate_matching_objects('avg', 'estimate'))
+        self.assertEqual('3', tc_search.aggregate_matching_objects('min', 'estimate'))
+        self.assertEqual('5', tc_search.aggregate_matching_objects('MAX', 'estimate'))
+        self.assertEqual('4', tc_search.aggregate_matching_objects('max', 'id'))
+
+    def test_group_by(self):
+        self.assertEqual({'high': 2, 'low': 2}, 
+            self._search().aggregate_matching_objects('count', group_by='priority'))
+        self.assertEqual({'1': 3, '9': 1}, 
+            self._search().aggregate_matching_objects('count', group_by='parent_id'))
+        self.assertEqual({'high': 8, 'low': 100}, 
+            self._search().aggregate_matching_objects('sum', 'estimate', group_by='priority'))
+
+    def test_errors(self):
+        tc_search = self._search()
+        self.assertRaises(TracError, tc_search.aggregate_matching_objects, 'median', 'estimate')
+        self.assertRaises(TracError, tc_search.aggregate_matching_objects, 'sum')
+        self.assertRaises(TracError, tc_search.aggregate_matching_objects, 'sum', 'unknown')
+        self.assertRaises(TracError, tc_search.aggregate_matching_objects, 'count', 
+                          group_by='unknown')
+
+
+class RecordingCursor(object):
+    """
+    A cursor recording the number of rows of each fetchmany() call.
+    """
+
+    def __init__(self, cursor, fetched):
+        self.cursor = cursor
+        self.fetched = fetched
+
+    def fetchmany(self, size):
+        rows = self.cursor.fetchmany(size)
+        self.fetched.append(len(rows))
+        return rows
+
+    def fetchall(self):
+        raise AssertionError("Streamed results must not be fetched all at once")
+
+    def __iter__(self):
+        raise AssertionError("Streamed results must be fetched in batches")
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class StreamingTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('tracgenericclass', 'stream_batch_size', '2')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        tcat = self.create_catalog('1')
+        for id in range(2, 7):
+            self.create_testcase(str(id), tcat, priority='p%d' % id)
+
+        self.fetched = []
+        def get_streaming_cursor(env, db):
+            return RecordingCursor(util.get_streaming_cursor(env, db), self.fetched)
+
+        model.get_streaming_cursor = query.get_streaming_cursor = get_streaming_cursor
+
+    def tearDown(self):
+        model.get_streaming_cursor = query.get_streaming_cursor = util.get_streaming_cursor
+        TestManagerTestCase.tearDown(self)
+
+    def _check(self, objs, ids=('2', '3', '4', '5', '6'), fetched=[2, 2, 1, 0]):
+        self.assertEqual(list(ids), sorted([tc['id'] for tc in objs]))
+        self.assertEqual(['p' + id for id in ids], sorted([tc['priority'] for tc in objs]))
+        self.assertEqual(fetched, self.fetched)
+
+    def test_list_matching_objects(self):
+        tc_search = TestCase(self.env)
+        tc_search['parent_id'] = '1'
+        self._check(list(tc_search.list_matching_objects(stream=True)))
+
+    def test_list_matching_objects_not_hydrated(self):
+        tc_search = TestCase(self.env)
+        tc_search['parent_id'] = '1'
+        self._check(list(tc_search.list_matching_objects(hydrate=False, stream=True)))
+
+    def test_query(self):
+        objs = list(ObjectQuery(self.env, 'testcase').filter('id', '!=', '6')
+                                                      .order_by('id').execute(stream=True))
+        self.assertEqual(['2', '3', '4', '5'], [tc['id'] for tc in objs])
+        self._check(objs, ('2', '3', '4', '5'), [2, 2, 0])
+
+    def test_same_results(self):
+        tc_query = ObjectQuery(self.env, 'testcase').order_by('exec_order')
+        self.assertEqual([tc.values for tc in tc_query.execute()],
+                         [tc.values for tc in tc_query.execute(stream=True)])
+
+    def test_stream_batch_size(self):
+        self.assertEqual(2, util.get_stream_batch_size(self.env))
+        self.env.config.set('tracgenericclass', 'stream_batch_size', '0')
+        self.assertEqual(util.DEFAULT_STREAM_BATCH_SIZE, util.get_stream_batch_size(self.env))
+
+
+class WideTableTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text'),
+              ('testcase-tm_custom', 'owner', 'text'),
+              ('tracgenericclass', 'wide_custom_tables', 'testcase')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+
+    def _get_rows(self):
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT id, priority, owner FROM testcase_custom_wide ORDER BY id")
+        return cursor.fetchall()
+
+    def test_rebuild(self):
+        self.assertEqual(None, get_wide_table_columns(self.env, 'testcase'))
+
+        self.create_testcase('2', self.tcat, priority='high', owner='joe')
+        self.create_testcase('3', self.tcat, priority='low')
+        self.create_testcase('4', self.tcat)
+
+        rebuild_wide_table(self.env, 'testcase')
+
+        self.assertEqual(['owner', 'priority'], sorted(get_wide_table_columns(self.env, 'testcase')))
+        self.assertEqual([('2', 'high', 'joe'), ('3', 'low', None), ('4', None, None)],
+                         self._get_rows())
+
+    def test_rebuild_again(self):
+        self.create_testcase('2', self.tcat, priority='high')
+        rebuild_wide_table(self.env, 'testcase')
+        rebuild_wide_table(self.env, 'testcase')
+
+        self.assertEqual([('2', 'high', None)], self._get_rows())
+
+    def test_kept_up_to_date(self):
+        rebuild_wide_table(self.env, 'testcase')
+
+        self.create_testcase('2', self.tcat, priority='high')
+        tc = self.create_testcase('3', self.tcat, priority='low')
+        self.assertEqual([('2', 'high', None), ('3', 'low', None)], self._get_rows())
+
+        tc['owner'] = 'joe'
+        self._save(tc, save_wiki_page=False)
+        self.assertEqual([('2', 'high', None), ('3', 'low', 'joe')], self._get_rows())
+
+        TestCase(self.env, '2').delete()
+        self.assertEqual([('3', 'low', 'joe')], self._get_rows())
+
+    def test_used_by_queries(self):
+        self.create_testcase('2', self.tcat, priority='high', owner='joe')
+        self.create_testcase('3', self.tcat, priority='high')
+        rebuild_wide_table(self.env, 'testcase')
+
+        query = ObjectQuery(self.env, 'testcase').filter('priority', '=', 'high') \
+                                                 .order_by('owner')
+        self.assertTrue('testcase_custom_wide' in query.get_sql()[0])
+        self.assertEqual(['3', '2'], [tc['id'] for tc in query.execute()])
+
+    def test_no_custom_fields(self):
+        self.assertRaises(TracError, rebuild_wide_table, self.env, 'testplan')
+
+
+class ChangeHistoryTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        tcat = self.create_catalog('1')
+        self.create_testplan('7', tcat)
+
+        # Three saves, each one changing two fields
+        self.times = []
+        for i in range(3):
+            when = datetime(2015, 1, 1, tzinfo=utc) + timedelta(hours=i)
+            self.times.append(to_any_timestamp(when))
+
+            tp = TestPlan(self.env, '7')
+            tp['name'] = 'Plan %d' % i
+            tp['author'] = 'author%d' % i
+            tp.save_changes('tester', 'Change %d' % i, when)
+
+    def _history(self, **kwargs):
+        tp = TestPlan(self.env, '7')
+        return [(ts, field) for ts, author, field, old, new 
+                in tp.list_change_history(**kwargs)]
+
+    def test_full_history(self):
+        t0, t1, t2 = self.times
+        self.assertEqual([(t2, 'author'), (t2, 'name'), (t1, 'author'), (t1, 'name'),
+                          (t0, 'author'), (t0, 'name')], self._history())
+
+    def test_values(self):
+        tp = TestPlan(self.env, '7')
+        ts, author, field, old, new = list(tp.list_change_history(limit=1))[0]
+        self.assertEqual(('tester', 'author', 'author1', 'author2'), 
+                         (author, field, old, new))
+
+    def test_paging_backward(self):
+        tp = TestPlan(self.env, '7')
+        t0, t1, t2 = self.times
+
+        page = list(tp.list_change_history(limit=3))
+        self.assertEqual((t1, 'author'), (page[-1][0], page[-1][2]))
+        marker = tp.get_change_history_marker(page[-1])
+
+        self.assertEqual([(t1, 'name'), (t0, 'author')], self._history(before=marker, limit=2))
+        self.assertEqual([(t1, 'name'), (t0, 'author'), (t0, 'name')], 
+                         self._history(before=marker))
+
+    def test_paging_forward(self):
+        tp = TestPlan(self.env, '7')
+        t0, t1, t2 = self.times
+
+        oldest = list(tp.list_change_history())[-2]
+        marker = tp.get_change_history_marker(oldest)
+
+        # The changes right after the marker, still newest first
+        self.assertEqual([(t1, 'author'), (t1, 'name')], self._history(after=marker, limit=2))
+        self.assertEqual([(t2, 'author'), (t2, 'name'), (t1, 'author'), (t1, 'name')],
+                         self._history(after=marker))
+
+    def test_time_markers(self):
+        t0, t1, t2 = self.times
+        self.assertEqual([(t0, 'author'), (t0, 'name')], self._history(before=t1))
+        self.assertEqual([(t2, 'author'), (t2, 'name')], 
+                         self._history(after=datetime(2015, 1, 1, 1, tzinfo=utc)))
+        self.assertEqual([(t1, 'author'), (t1, 'name')], self._history(before=t2, after=t0))
+
+    def test_fields(self):
+        t0, t1, t2 = self.times
+        self.assertEqual([(t2, 'name'), (t1, 'name'), (t0, 'name')], 
+                         self._history(fields=['name']))
+        self.assertEqual([(t2, 'author'), (t1, 'author'), (t0, 'author')], 
+                         self._history(exclude_fields=['name']))
+        self.assertEqual([], self._history(fields=[]))
+
+    def test_stream(self):
+        self.assertEqual(self._history(), self._history(stream=True))
+
+
+class RowVersionTestCase(TestManagerTestCase):
+
+    config = [('testcaseinplan-tm_custom', 'notes', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        tcat = self.create_catalog('1')
+        self.create_testcase('2', tcat)
+        self.create_testcase('3', tcat)
+        self.create_testplan('7', tcat)
+        self._insert(TestCaseInPlan(self.env, '2', '7', 'TC_TT1_TC2', -1, 'untested'))
+
+    def _get_tcip(self):
+        return TestCaseInPlan(self.env, '2', '7')
+
+    def test_version_incremented(self):
+        tcip = self._get_tcip()
+        version = tcip['version']
+
+        tcip['status'] = 'successful'
+        self._save(tcip)
+        self.assertEqual(version + 1, self._get_tcip()['version'])
+
+        # Changes to custom fields only also increment the version
+        tcip = self._get_tcip()
+        tcip['notes'] = 'Some notes'
+        self._save(tcip)
+        self.assertEqual(version + 2, self._get_tcip()['version'])
+
+    def test_concurrent_modification(self):
+        first = self._get_tcip()
+        second = self._get_tcip()
+
+        first['status'] = 'successful'
+        self._save(first)
+
+        second['status'] = 'failed'
+        self.assertRaises(ConcurrentModificationError, self._save, second)
+        self.assertEqual('successful', self._get_tcip()['status'])
+
+        # The conflict is solved by reading the object again
+        second = self._get_tcip()
+        second['status'] = 'failed'
+        self._save(second)
+        self.assertEqual('failed', self._get_tcip()['status'])
+
+    def test_concurrent_custom_field_modification(self):
+        first = self._get_tcip()
+        second = self._get_tcip()
+
+        first['status'] = 'successful'
+        self._save(first)
+
+        second['notes'] = 'Some notes'
+        self.assertRaises(ConcurrentModificationError, self._save, second)
+        self.assertEqual(None, self._get_tcip()['notes'])
+
+    def test_null_version(self):
+        @self.env.with_transaction()
+        def do_clear_version(db):
+            cursor = db.cursor()
+            cursor.execute("UPDATE testcaseinplan SET version = NULL")
+
+        tcip = self._get_tcip()
+        tcip['status'] = 'successful'
+        self._save(tcip)
+
+        tcip = self._get_tcip()
+        self.assertEqual(('successful', 1), (tcip['status'], tcip['version']))
+
+    def test_concurrent_insert(self):
+        first = TestCaseInPlan(self.env, '3', '7', 'TC_TT1_TC3', -1, 'successful')
+        second = TestCaseInPlan(self.env, '3', '7', 'TC_TT1_TC3', -1, 'failed')
+
+        self._insert(first)
+        self.assertRaises(get_integrity_error(self.env), self._insert, second)
+
+
+class ObjectCacheTestCase(TestManagerTestCase):
+
+    config = [('tracgenericclass', 'object_cache_size', '2'),
+              ('tracgenericclass', 'object_cache_ttl', '60')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.cache = model.get_object_cache(self.env)
+        self.tcat = self.create_catalog('1')
+        for id in ('2', '3', '4'):
+            self.create_testcase(id, self.tcat)
+
+    def tearDown(self):
+        model._object_caches.pop(self.env, None)
+        TestManagerTestCase.tearDown(self)
+
+    def _generation(self, realm, db=None):
+        if db is None:
+            db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name=%s",
+                       (model.ObjectCache.GENERATION_KEY + realm,))
+        return int(cursor.fetchone()[0])
+
+    def _is_cached(self, id):
+        return self.cache.get('testcase', [id]) is not None
+
+    def test_generations_created(self):
+        for realm in GenericClassModelProvider(self.env).get_known_realms():
+            self.assertTrue(self._generation(realm) >= 0)
+        self.assertEqual(0, self._generation('testplan'))
+        self.assertEqual([], model.get_missing_object_cache_generations(self.env))
+
+    def test_generations_created_by_upgrade(self):
+        @self.env.with_transaction()
+        def do_delete(db):
+            db.cursor().execute("DELETE FROM system WHERE name=%s",
+                                (model.ObjectCache.GENERATION_KEY + 'testplan',))
+
+        system = GenericClassSystem(self.env)
+        db = self.env.get_read_db()
+        self.assertEqual(['testplan'], model.get_missing_object_cache_generations(self.env))
+        self.assertTrue(system.environment_needs_upgrade(db))
+
+        @self.env.with_transaction()
+        def do_upgrade(db):
+            system.upgrade_environment(db)
+
+        self.assertFalse(system.environment_needs_upgrade(db))
+        self.assertEqual(0, self._generation('testplan'))
+
+    def test_read_through(self):
+        self.assertEqual('Test case 2', TestCase(self.env, '2').title)
+        self.assertTrue(self._is_cached('2'))
+
+        hits = self.cache.hits
+        tc = TestCase(self.env, '2')
+        self.assertEqual(hits + 1, self.cache.hits)
+        self.assertEqual('Test case 2', tc['title'])
+
+    def test_lru_eviction(self):
+        self.cache.discard()
+        evictions = self.cache.evictions
+
+        TestCase(self.env, '2')
+        TestCase(self.env, '3')
+        TestCase(self.env, '2')
+        TestCase(self.env, '4')
+
+        self.assertTrue(self._is_cached('4'))
+        self.assertTrue(self._is_cached('2'))
+        self.assertFalse(self._is_cached('3'))
+        self.assertEqual(evictions + 1, self.cache.evictions)
+        self.assertEqual(2, self.cache.get_stats()['size'])
+
+    def test_ttl_expiration(self):
+        self.cache.ttl = 0.05
+        TestCase(self.env, '2')
+        self.assertTrue(self._is_cached('2'))
+
+        time.sleep(0.1)
+        self.assertFalse(self._is_cached('2'))
+
+    def test_invalidated_by_changes(self):
+        tc = TestCase(self.env, '2')
+        tc['title'] = 'Changed'
+        self._save(tc)
+
+        self.assertFalse(self._is_cached('2'))
+        self.assertEqual('Changed', TestCase(self.env, '2')['title'])
+
+        TestCase(self.env, '2').delete()
+        self.assertFalse(self._is_cached('2'))
+        self.assertFalse(TestCase(self.env, '2').exists)
+
+    def test_generation_incremented_once_after_commit(self):
+        before = self._generation('testcase')
+        known = self.cache.get_generation('testcase')
+
+        @self.env.with_transaction()
+        def do_changes(db):
+            for id in ('2', '3'):
+                tc = TestCase(self.env, id, db=db)
+                tc['title'] = 'Changed'
+                self._save(tc, db=db)
+            self.create_testcase('5', self.tcat)
+
+            self.assertEqual(before, self._generation('testcase', db))
+
+        self.assertEqual(before + 1, self._generation('testcase'))
+        self.assertEqual(known + 1, self.cache.get_generation('testcase'))
+
+    def test_generation_unchanged_on_rollback(self):
+        before = self._generation('testcase')
+        known = self.cache.get_generation('testcase')
+
+        try:
+            @self.env.with_transaction()
+            def do_changes(db):
+                self.create_testcase('5', self.tcat)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(before, self._generation('testcase'))
+        self.assertEqual(known, self.cache.get_generation('testcase'))
+
+    def test_changed_by_other_process(self):
+        TestCase(self.env, '2')
+        TestCatalog(self.env, '1')
+        self.assertTrue(self.cache.get('testcatalog', ['1']) is not None)
+
+        @self.env.with_transaction()
+        def do_other_process(db):
+            db.cursor().execute("UPDATE system SET value=%s WHERE name=%s",
+                ('100', model.ObjectCache.GENERATION_KEY + 'testcase'))
+
+        self.cache.check_generation()
+
+        self.assertFalse(self._is_cached('2'))
+        self.assertTrue(self.cache.get('testcatalog', ['1']) is not None)
+        self.assertEqual(100, self.cache.get_generation('testcase'))
+
+    def test_stale_values_not_cached(self):
+        generation = self.cache.get_generation('testcase')
+        values = [('id', '2'), ('title', 'Old')]
+
+        model.invalidate_object_cache(self.env, 'testcase')
+
+        self.cache.put('testcase', ['2'], values, generation)
+        self.assertFalse(self._is_cached('2'))
+
+        self.cache.put('testcase', ['2'], values, self.cache.get_generation('testcase'))
+        self.assertTrue(self._is_cached('2'))
+
+
+class CatalogHierarchyTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        # 1 -> 3 -> 5 and 1 -> 4
+        self.tcat1 = self.create_catalog('1')
+        self.tcat3 = self.create_catalog('3', self.tcat1)
+        self.tcat4 = self.create_catalog('4', self.tcat1)
+        self.tcat5 = self.create_catalog('5', self.tcat3)
+
+        self.create_testcase('10', self.tcat1)
+        self.create_testcase('11', self.tcat3)
+        self.create_testcase('12', self.tcat5)
+
+    def _get_closure(self):
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT ancestor, descendant, depth FROM testcatalogclosure "
+                       "ORDER BY ancestor, descendant")
+        return cursor.fetchall()
+
+    def _deep_ids(self, tcat):
+        return sorted([tc['id'] for tc in TestCatalog(self.env, tcat['id']).list_testcases(deep=True)])
+
+    def test_insert(self):
+        self.assertEqual([('1', '1', 0), ('1', '3', 1), ('1', '4', 1), ('1', '5', 2),
+                          ('3', '3', 0), ('3', '5', 1), ('4', '4', 0), ('5', '5', 0)],
+                         self._get_closure())
+
+        tcat = TestCatalog(self.env, '5')
+        self.assertEqual(('3', 2), (tcat['parent_id'], tcat['depth']))
+        self.assertEqual((None, 0), (self.tcat1['parent_id'], self.tcat1['depth']))
+
+    def test_ancestors(self):
+        self.assertEqual(['1', '3'], [tcat['id'] for tcat in self.tcat5.list_ancestors()])
+        self.assertEqual([], list(self.tcat1.list_ancestors()))
+
+    def test_subcatalogs(self):
+        self.assertEqual(['3', '4'], sorted([tcat['id'] for tcat in self.tcat1.list_subcatalogs()]))
+        self.assertEqual(['1'], [tcat['id'] for tcat in TestCatalog.list_root_catalogs(self.env)])
+
+    def test_deep_testcases(self):
+        self.assertEqual(['10', '11', '12'], self._deep_ids(self.tcat1))
+        self.assertEqual(['11', '12'], self._deep_ids(self.tcat3))
+        self.assertEqual(['10'], [tc['id'] for tc in self.tcat1.list_testcases()])
+
+    def test_deep_testcases_in_plan(self):
+        self.create_testplan('7', self.tcat1)
+        self.assertEqual(['11', '12'], 
+                         sorted([tcip['id'] for tcip in self.tcat3.list_testcases('7', deep=True)]))
+
+    def test_move_testcase(self):
+        tc = TestCase(self.env, '12')
+        tc.author = 'tester'
+        tc.remote_addr = '127.0.0.1'
+        tc.move_to(self.tcat4)
+
+        self.assertEqual(('4', 'TC_TT1_TT4_TC12'), 
+                         (TestCase(self.env, '12')['parent_id'], TestCase(self.env, '12')['page_name']))
+        self.assertEqual(['11'], self._deep_ids(self.tcat3))
+        self.assertEqual(['12'], self._deep_ids(self.tcat4))
+        self.assertEqual(['10', '11', '12'], self._deep_ids(self.tcat1))
+
+    def test_delete(self):
+        TestCatalog(self.env, '3').delete()
+
+        self.assertEqual([('1', '1', 0), ('1', '4', 1), ('4', '4', 0)], self._get_closure())
+        self.assertEqual(['10'], self._deep_ids(self.tcat1))
+        self.assertFalse(TestCatalog(self.env, '5').exists)
+        self.assertFalse(TestCase(self.env, '12').exists)
+
+    def test_rebuild(self):
+        closure = self._get_closure()
+
+        @self.env.with_transaction()
+        def do_clear_hierarchy(db):
+            cursor = db.cursor()
+            cursor.execute("DELETE FROM testcatalogclosure")
+            cursor.execute("UPDATE testcatalog SET parent_id = NULL, depth = NULL")
+
+        TestManagerModelProvider(self.env).rebuild_catalog_hierarchy()
+
+        self.assertEqual(closure, self._get_closure())
+        tcat = TestCatalog(self.env, '5')
+        self.assertEqual(('3', 2), (tcat['parent_id'], tcat['depth']))
+
+
+class TestCasesInPlanTestCase(TestManagerTestCase):
+
+    config = [('testcaseinplan-tm_custom', 'notes', 'text'),
+              ('testcaseinplan-tm_custom', 'priority', 'text'),
+              ('testcaseinplan-tm_custom', 'priority.value', 'normal')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        for id in ('2', '3', '4'):
+            self.create_testcase(id, self.tcat)
+        self.create_testplan('7', self.tcat)
+
+        self._insert(TestCaseInPlan(self.env, '3', '7', 'TC_TT1_TC3', 2, 'failed'),
+                     {'notes': 'Broken', 'priority': 'high'})
+        self._insert(TestCaseInPlan(self.env, '4', '7', 'TC_TT1_TC4', 1, 'successful'))
+
+        # The execution order differs from the creation order
+        tc = TestCase(self.env, '4')
+        tc.author = 'tester'
+        tc.remote_addr = '127.0.0.1'
+        self.tcat.change_testcase_order(tc, 0)
+        self.default_status = TestManagerSystem(self.env).get_default_tc_status()
+
+    def _list(self):
+        return list(TestCatalog(self.env, '1').list_testcases('7'))
+
+    def _list_old(self):
+        """The test cases in plan, as they were built before the join."""
+        result = []
+        query = ObjectQuery(self.env, 'testcase').filter('parent_id', '=', '1')
+        for tc in query.order_by('exec_order').execute():
+            tcip = TestCaseInPlan(self.env, tc['id'], '7')
+            if not tcip.exists:
+                tcip['status'] = self.default_status
+            tcip['exec_order'] = tc['exec_order']
+            result.append(tcip)
+
+        return result
+
+    def test_not_executed(self):
+        tcip = [row for row in self._list() if row['id'] == '2'][0]
+
+        self.assertEqual(self.default_status, tcip['status'])
+        self.assertEqual(-1, tcip['page_version'])
+        self.assertEqual('TC_TT1_TC2', tcip['page_name'])
+        self.assertEqual('7', tcip['planid'])
+
+    def test_custom_field_defaults(self):
+        self.assertEqual([('4', '', 'normal'), ('2', '', 'normal'), ('3', 'Broken', 'high')],
+                         [(row['id'], row['notes'], row['priority']) for row in self._list()])
+
+    def test_execution_order(self):
+        rows = self._list()
+
+        self.assertEqual(['4', '2', '3'], [row['id'] for row in rows])
+        orders = [row['exec_order'] for row in rows]
+        self.assertEqual(sorted(orders), orders)
+
+    def test_same_as_test_cases_in_plan(self):
+        fields = ('id', 'planid', 'page_name', 'page_version', 'status', 'exec_order',
+                  'notes', 'priority')
+
+        expected = []
+        for tcip in self._list_old():
+            values = [tcip[f] for f in fields]
+            if not tcip.exists:
+                # Not executed test cases now have the page of the test
+                # case, instead of None
+                values[2] = TestCase(self.env, tcip['id'])['page_name']
+            
+            # Missing custom values are empty, as for list_matching_rows(),
+            # instead of None
+            expected.append([('' if v is None and f in ('notes', 'priority') else v) 
+                             for f, v in zip(fields, values)])
+
+        self.assertEqual(expected, [[row[f] for f in fields] for row in self._list()])
+
+    def test_rpc_list_testcases(self):
+        try:
+            from testmanager.rpcsupport import TestManagerRPC
+        except ImportError:
+            raise unittest.SkipTest("The XML-RPC plugin is not installed")
+
+        rpc = TestManagerRPC(self.env)
+        result = list(rpc.listTestCases(None, '1', '7'))
+
+        expected = []
+        for tcip in self._list_old():
+            customfields = []
+            rpc._append_custom_fields(tcip, customfields)
+            customfields = [(name, '' if value is None else value, label) 
+                            for name, value, label in customfields]
+            page_name = tcip['page_name']
+            if not tcip.exists:
+                page_name = TestCase(self.env, tcip['id'])['page_name']
+            expected.append((tcip['id'], page_name, tcip['status'], customfields))
+
+        self.assertEqual(expected, result)
+
+
+class WikiPageLoadingTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        for id in ('2', '3', '4'):
+            self.create_testcase(id, self.tcat)
+
+        page = WikiPage(self.env, 'TC_TT1_TC3')
+        page.text = '== Test case 3 ==\r\n\r\nEdited description'
+        page.save('bob', 'Edited', '127.0.0.1')
+
+        # Counts the wiki pages loaded one by one
+        self.loaded = []
+        def counting_wiki_page(env, name=None, *args, **kwargs):
+            if name is not None:
+                self.loaded.append(name)
+            return WikiPage(env, name, *args, **kwargs)
+        model.WikiPage = counting_wiki_page
+
+    def tearDown(self):
+        model.WikiPage = WikiPage
+        TestManagerTestCase.tearDown(self)
+
+    def _list(self):
+        query = ObjectQuery(self.env, 'testcase').filter('parent_id', '=', '1')
+        return list(query.order_by('exec_order').execute())
+
+    def test_not_loaded_on_fetch(self):
+        tc = TestCase(self.env, '3')
+
+        self.assertEqual('TC_TT1_TC3', tc['page_name'])
+        self.assertEqual('Test case 3', tc.title)
+        self.assertEqual([], self.loaded)
+
+    def test_loaded_once_on_access(self):
+        tc = TestCase(self.env, '3')
+
+        self.assertEqual('Edited description', tc.description.strip())
+        self.assertEqual('bob', tc.author)
+        self.assertEqual(2, tc.wikipage.version)
+        self.assertEqual(['TC_TT1_TC3'], self.loaded)
+
+    def test_prefetch(self):
+        tcs = self._list()
+        TestCase.prefetch_wiki_pages(self.env, tcs)
+
+        self.assertEqual([], self.loaded)
+        for tc in tcs:
+            page = WikiPage(self.env, tc['page_name'])
+            for attr in ('name', 'version', 'time', 'author', 'text', 'comment', 
+                         'readonly', 'exists'):
+                self.assertEqual(getattr(page, attr), getattr(tc.wikipage, attr))
+        self.assertEqual('Edited description', tcs[1].description.strip())
+
+    def test_prefetch_in_chunks(self):
+        max_sql_params = model.MAX_SQL_PARAMS
+        model.MAX_SQL_PARAMS = 2
+        try:
+            tcs = self._list()
+            TestCase.prefetch_wiki_pages(self.env, tcs)
+        finally:
+            model.MAX_SQL_PARAMS = max_sql_params
+
+        self.assertEqual([], self.loaded)
+        self.assertEqual([1, 2, 1], [tc.wikipage.version for tc in tcs])
+
+    def test_prefetch_skips_loaded_pages(self):
+        tcs = self._list()
+        page = tcs[0].wikipage
+
+        TestCase.prefetch_wiki_pages(self.env, tcs)
+
+        self.assertTrue(tcs[0].wikipage is page)
+        self.assertEqual(['TC_TT1_TC2'], self.loaded)
+
+    def test_prefetch_missing_page(self):
+        tc = TestCase(self.env, '5', 'TC_TT1_TC5')
+        TestCase.prefetch_wiki_pages(self.env, [tc])
+
+        self.assertFalse(tc.wikipage.exists)
+        self.assertEqual('TC_TT1_TC5', tc.wikipage.name)
+        self.assertEqual([], self.loaded)
+
+    def test_frozen_versions(self):
+        self.create_testplan('7', self.tcat, freeze_tc_versions=1)
+
+        self.assertEqual([('2', 1), ('3', 2), ('4', 1)],
+                         [(tcip['id'], tcip['page_version']) 
+                          for tcip in TestCatalog(self.env, '1').list_testcases('7')])
+        self.assertEqual([], self.loaded)
+
+
+class TestDescriptionTitleTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.tc = self.create_testcase('2', self.tcat, priority='high')
+
+    def _changes(self, realm, id):
+        cursor = self.env.get_read_db().cursor()
+        cursor.execute("SELECT field FROM %s_change WHERE id=%%s ORDER BY field" % realm, 
+                       (id,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def test_direct_wiki_edit(self):
+        page = WikiPage(self.env, 'TC_TT1_TC2')
+        page.text = '== Renamed case ==\r\n\r\nEdited   on the\r\nwiki'
+        page.save('bob', 'Direct edit', '127.0.0.1')
+
+        tc = TestCase(self.env, '2')
+        self.assertEqual(('Renamed case', 'Edited on the wiki'), 
+                         (tc['title'], tc['summary']))
+        self.assertEqual([], self._changes('testcase', '2'))
+
+    def test_direct_wiki_edit_catalog(self):
+        page = WikiPage(self.env, 'TC_TT1')
+        page.text = '== Renamed catalog ==\r\n\r\nNew description'
+        page.save('bob', 'Direct edit', '127.0.0.1')
+
+        tcat = TestCatalog(self.env, '1')
+        self.assertEqual(('Renamed catalog', 'New description'), 
+                         (tcat['title'], tcat['summary']))
+        self.assertEqual([], self._changes('testcatalog', '1'))
+
+    def test_unrelated_page_ignored(self):
+        page = WikiPage(self.env, 'TC_Unrelated')
+        page.text = '== Unrelated ==\r\n\r\nText'
+        page.save('bob', '', '127.0.0.1')
+
+        self.assertEqual('Test case 2', TestCase(self.env, '2')['title'])
+
+    def test_save_through_object(self):
+        self.tc.title = 'Renamed case'
+        self.tc.description = 'New description'
+        self.tc['priority'] = 'low'
+        self._save(self.tc, 'Changed')
+
+        tc = TestCase(self.env, '2')
+        self.assertEqual(('Renamed case', 'New description', 'low'), 
+                         (tc['title'], tc['summary'], tc['priority']))
+        self.assertEqual(['priority'], self._changes('testcase', '2'))
+
+        history = [field for ts, author, field, old, new in tc.list_change_history()]
+        self.assertEqual(['priority'], history)
+
+
+class ExecutionOrderTestCase(TestManagerTestCase):
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        for id in ('2', '3', '4'):
+            self.create_testcase(id, self.tcat)
+
+    def _get_orders(self, tcat=None):
+        query = ObjectQuery(self.env, 'testcase').filter('parent_id', '=', (tcat or self.tcat)['id'])
+        return [(tc['id'], tc['exec_order']) for tc in query.order_by('exec_order').execute()]
+
+    def _get_ids(self, tcat=None):
+        return [id for id, order in self._get_orders(tcat)]
+
+    def _get_testcase(self, id):
+        tc = TestCase(self.env, id)
+        tc.author = 'tester'
+        tc.remote_addr = '127.0.0.1'
+        return tc
+
+    def test_append(self):
+        self.assertEqual([('2', ORDER_GAP), ('3', 2 * ORDER_GAP), ('4', 3 * ORDER_GAP)],
+                         self._get_orders())
+        self.assertEqual(4 * ORDER_GAP, self.tcat.get_next_order())
+
+    def test_order_key(self):
+        self.assertEqual(ORDER_GAP // 2 - 1, self.tcat.get_order_key(0))
+        self.assertEqual(3 * ORDER_GAP // 2, self.tcat.get_order_key(1))
+        self.assertEqual(4 * ORDER_GAP, self.tcat.get_order_key(3))
+        self.assertEqual(4 * ORDER_GAP, self.tcat.get_order_key(10))
+
+        # The test case being moved does not count
+        self.assertEqual(5 * ORDER_GAP // 2, self.tcat.get_order_key(1, TestCase(self.env, '2')))
+
+    def test_change_order_changes_only_the_testcase(self):
+        self.tcat.change_testcase_order(self._get_testcase('4'), 1)
+
+        self.assertEqual([('2', ORDER_GAP), ('4', 3 * ORDER_GAP // 2), ('3', 2 * ORDER_GAP)],
+                         self._get_orders())
+
+    def test_renumbering(self):
+        expected = ['2', '3', '4']
+        for i in range(15):
+            self.tcat.change_testcase_order(self._get_testcase(expected[-1]), 0)
+            expected.insert(0, expected.pop())
+
+            self.assertEqual(expected, self._get_ids())
+
+        orders = [order for id, order in self._get_orders()]
+        self.assertEqual(sorted(set(orders)), orders)
+        self.assertTrue(orders[-1] <= 3 * ORDER_GAP)
+
+    def test_no_room_left(self):
+        @self.env.with_transaction()
+        def do_pack_orders(db):
+            cursor = db.cursor()
+            cursor.executemany("UPDATE testcase SET exec_order = %s WHERE id = %s",
+                               [(1, '2'), (2, '3'), (3, '4')])
+
+        self.assertEqual(None, self.tcat.get_order_key(1))
+        self.assertEqual([('2', 1), ('3', 2), ('4', 3)], self._get_orders())
+
+        key = self.tcat.allocate_order_key(1)
+        self.assertEqual([('2', ORDER_GAP), ('3', 2 * ORDER_GAP), ('4', 3 * ORDER_GAP)],
+                         self._get_orders())
+        self.assertEqual(3 * ORDER_GAP // 2, key)
+
+    def test_insert_with_order(self):
+        # A free key is kept
+        self.create_testcase('5', self.tcat, exec_order=ORDER_GAP + 1)
+        self.assertEqual(['2', '5', '3', '4'], self._get_ids())
+        self.assertEqual(ORDER_GAP + 1, TestCase(self.env, '5')['exec_order'])
+
+        # A taken key places the test case before the one holding it
+        self.create_testcase('6', self.tcat, exec_order=2 * ORDER_GAP)
+        self.assertEqual(['2', '5', '6', '3', '4'], self._get_ids())
+        self.assertEqual(2 * ORDER_GAP, TestCase(self.env, '3')['exec_order'])
+
+    def test_move_to_other_catalog(self):
+        tcat = self.create_catalog('9')
+        self.create_testcase('10', tcat)
+        self.create_testcase('11', tcat)
+
+        self._get_testcase('3').move_to(tcat, 1)
+        self.assertEqual(['2', '4'], self._get_ids())
+        self.assertEqual([('2', ORDER_GAP), ('4', 3 * ORDER_GAP)], self._get_orders())
+        self.assertEqual(['10', '3', '11'], self._get_ids(tcat))
+
+        self._get_testcase('4').move_to(tcat)
+        self.assertEqual(['10', '3', '11', '4'], self._get_ids(tcat))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FetchManyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ListMatchingObjectsTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RealmDescriptorTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(IdentityMapTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ListMatchingRowsTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(InsertManyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(SaveChangesTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ReplaceSaveChangesTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(AggregateMatchingObjectsTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(StreamingTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(WideTableTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ChangeHistoryTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RowVersionTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ObjectCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(CatalogHierarchyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(TestCasesInPlanTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(WikiPageLoadingTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(TestDescriptionTitleTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ExecutionOrderTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+import unittest
+
+from trac.core import TracError
+
+from testmanager.tests.base import TestManagerTestCase
+from tracgenericclass.query import ObjectQuery, SubQuery
+
+
+class ObjectQueryTestCase(TestManagerTestCase):
+
+    config = [('testcase-tm_custom', 'priority', 'text')]
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.tcat = self.create_catalog('1')
+        self.create_testcase('2', self.tcat, exec_order=100, priority='high')
+        self.create_testcase('3', self.tcat, exec_order=200, priority='low')
+        self.create_testcase('4', self.tcat, exec_order=300, priority='high')
+        self.create_testcase('5', self.tcat, exec_order=400)
+
+    def _ids(self, query):
+        return [tc['id'] for tc in query.execute()]
+
+    def _query(self):
+        return ObjectQuery(self.env, 'testcase')
+
+    def test_comparison_operators(self):
+        self.assertEqual(['3', '4'], self._ids(self._query()
+            .filter('exec_order', '>=', 200).filter('exec_order', '<', 400)
+            .order_by('exec_order')))
+        self.assertEqual(['2', '4', '5'], self._ids(self._query()
+            .filter('exec_order', '!=', 200).order_by('exec_order')))
+
+    def test_in_list(self):
+        self.assertEqual(['2', '5'], self._ids(self._query()
+            .filter('id', 'in', ['5', '2', '99']).order_by('id')))
+        self.assertEqual(['3', '4'], self._ids(self._query()
+            .filter('id', 'not in', ['2', '5']).order_by('id')))
+        self.assertEqual([], self._ids(self._query().filter('id', 'in', [])))
+        self.assertEqual(4, self._query().filter('id', 'not in', []).count())
+
+    def test_in_subquery(self):
+        query = self._query().filter('id', 'in', 
+            SubQuery("SELECT id FROM testcase WHERE exec_order > %s", [250]))
+        self.assertEqual(['4', '5'], self._ids(query.order_by('id')))
+
+    def test_like(self):
+        self.create_catalog('6', self.tcat)
+        self.assertEqual(['2', '3', '4', '5'], self._ids(self._query()
+            .filter('page_name', 'like', 'TC_TT1_TC%').order_by('id')))
+
+    def test_custom_field_predicates(self):
+        self.assertEqual(['2', '4'], self._ids(self._query()
+            .filter('priority', '=', 'high').order_by('id')))
+        self.assertEqual(['5'], self._ids(self._query()
+            .filter('priority', 'is null')))
+        self.assertEqual(['3', '2', '4'], self._ids(self._query()
+            .filter('priority', 'is not null').order_by('priority', desc=True)
+            .order_by('exec_order')))
+
+    def test_limit_and_offset(self):
+        self.assertEqual(['3', '4'], self._ids(self._query()
+            .order_by('exec_order').limit(2, 1)))
+
+    def test_keyset_pagination(self):
+        pages = []
+        query = self._query().order_by('priority').order_by('id').limit(2)
+        while True:
+            page = list(query.execute())
+            if not page:
+                break
+            pages.append([tc['id'] for tc in page])
+            query.after(page[-1].values)
+
+        # NULL values do not compare, so they are never after a marker
+        self.assertEqual([['5', '2'], ['4', '3']], pages)
+
+    def test_count_ignores_ordering_and_limit(self):
+        query = self._query().filter('priority', '=', 'high').order_by('id').limit(1)
+        self.assertEqual(2, query.count())
+        self.assertEqual(['2'], self._ids(query))
+
+    def test_values(self):
+        self.assertEqual(['high', 'low', 'high', None], self._query()
+            .order_by('exec_order').values('priority'))
+
+    def test_objects_match_single_fetch(self):
+        tc = list(self._query().filter('id', '=', '2').execute())[0]
+        self.assertTrue(tc.exists)
+        self.assertEqual('high', tc['priority'])
+        self.assertEqual(100, tc['exec_order'])
+        self.assertEqual(self.tcat['id'], tc['parent_id'])
+
+    def test_unknown_field(self):
+        self.assertRaises(TracError, self._query().filter, 'nosuchfield', '=', 1)
+        self.assertRaises(TracError, self._query().order_by, 'nosuchfield')
+
+    def test_unknown_operator(self):
+        self.assertRaises(TracError, self._query().filter, 'id', '~', '2')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ObjectQueryTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
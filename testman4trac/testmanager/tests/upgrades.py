@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+import unittest
+
+from trac.db import Table, Column
+
+from testmanager.model import TestCatalog, TestCase, TestCaseInPlan, TestPlan
+from testmanager.tests.base import TestManagerTestCase
+from tracgenericclass.model import create_db_for_realm
+from tracgenericclass.util import get_timestamp_db_type
+
+
+# The first version of the schema of the classes with upgrade steps
+OLD_SCHEMA = {
+    'testcatalog': {'table':
+                        Table('testcatalog', key = ('id'))[
+                              Column('id'),
+                              Column('page_name')],
+                    'has_custom': True,
+                    'has_change': True,
+                    'version': 1},
+    'testcase': {'table':
+                     Table('testcase', key = ('id'))[
+                           Column('id'),
+                           Column('page_name')],
+                 'has_custom': True,
+                 'has_change': True,
+                 'version': 1},
+    'testcaseinplan': {'table':
+                           Table('testcaseinplan', key = ('id', 'planid'))[
+                                 Column('id'),
+                                 Column('planid'),
+                                 Column('page_name'),
+                                 Column('status')],
+                       'has_custom': True,
+                       'has_change': True,
+                       'version': 1},
+    'testplan': {'table':
+                     Table('testplan', key = ('id'))[
+                           Column('id'),
+                           Column('catid'),
+                           Column('page_name'),
+                           Column('name'),
+                           Column('author'),
+                           Column('time', type=get_timestamp_db_type())],
+                 'has_custom': True,
+                 'has_change': True,
+                 'version': 1}}
+
+# The tables added by later upgrade steps
+NEW_TABLES = ['testcatalogclosure']
+
+
+class UpgradeTestCase(TestManagerTestCase):
+    """
+    Upgrades an environment created with the first version of the 
+    schema.
+    """
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        self.schema = self._get_schema()
+
+        @self.env.with_transaction()
+        def do_downgrade(db):
+            cursor = db.cursor()
+            for realm in OLD_SCHEMA.keys() + NEW_TABLES:
+                for table in (realm, realm + '_custom', realm + '_change'):
+                    cursor.execute("DROP TABLE IF EXISTS " + table)
+                cursor.execute("DELETE FROM system WHERE name=%s", (realm + '_version',))
+
+            for realm, realm_schema in OLD_SCHEMA.items():
+                create_db_for_realm(self.env, realm, realm_schema, db)
+
+            cursor.execute("INSERT INTO testcatalog (id, page_name) VALUES ('1', 'TC_TT1')")
+            cursor.execute("INSERT INTO testcatalog (id, page_name) VALUES ('2', 'TC_TT1_TT2')")
+            cursor.execute("INSERT INTO testcase (id, page_name) VALUES ('3', 'TC_TT1_TT2_TC3')")
+            cursor.execute("INSERT INTO testcase (id, page_name) VALUES ('4', 'TC_TT1_TC4')")
+            cursor.execute("INSERT INTO testplan (id, catid, page_name, name, author, time) "
+                           "VALUES ('7', '1', 'TC_TT1', 'Plan', 'tester', 0)")
+            cursor.execute("INSERT INTO testcaseinplan (id, planid, page_name, status) "
+                           "VALUES ('3', '7', 'TC_TT1_TT2_TC3', 'successful')")
+
+            # Two versions of a test case page, only the latest one counts
+            for name, version, text in (
+                    ('TC_TT1', 1, '== Catalog 1 ==\r\n\r\nCatalog   description'),
+                    ('TC_TT1_TT2_TC3', 1, '== Old title ==\r\n\r\nOld description'),
+                    ('TC_TT1_TT2_TC3', 2, '== Test case 3 ==\r\n\r\nTest case\r\ndescription'),
+                    ('TC_TT1_TC4', 1, '== Test case 4 ==\r\n\r\n' + 'x' * 300)):
+                cursor.execute("INSERT INTO wiki (name, version, time, author, ipnr, text) "
+                               "VALUES (%s, %s, 0, 'tester', '127.0.0.1', %s)", 
+                               (name, version, text))
+
+    def _get_schema(self):
+        """
+        Returns the columns and the indexes of the Test Manager tables, 
+        as a dictionary from table name to a pair of lists.
+        """
+        schema = {}
+        cursor = self.env.get_read_db().cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        for table, in cursor.fetchall():
+            if not [realm for realm in OLD_SCHEMA.keys() + NEW_TABLES 
+                    if table.startswith(realm)]:
+                continue
+
+            cursor.execute("PRAGMA table_info(%s)" % table)
+            columns = sorted([(row[1], row[2].lower()) for row in cursor.fetchall()])
+
+            indexes = []
+            cursor.execute("PRAGMA index_list(%s)" % table)
+            for row in cursor.fetchall():
+                cursor.execute("PRAGMA index_info(%s)" % row[1])
+                indexes.append((bool(row[2]), tuple([r[2] for r in cursor.fetchall()])))
+
+            schema[table] = (columns, sorted(indexes))
+
+        return schema
+
+    def test_upgrade(self):
+        self.assertTrue(self.env.needs_upgrade())
+        self.env.upgrade()
+        self.assertFalse(self.env.needs_upgrade())
+
+    def test_same_schema_as_new_environment(self):
+        self.env.upgrade()
+
+        schema = self._get_schema()
+        self.assertEqual(sorted(self.schema.keys()), sorted(schema.keys()))
+        for table in self.schema:
+            self.assertEqual((table, self.schema[table]), (table, schema[table]))
+
+    def test_data(self):
+        self.env.upgrade()
+
+        self.assertEqual('1', TestCatalog(self.env, '2')['parent_id'])
+        self.assertEqual(['1'], [tcat['id'] for tcat in TestCatalog(self.env, '2').list_ancestors()])
+        self.assertEqual('2', TestCase(self.env, '3')['parent_id'])
+        self.assertEqual('1', TestCase(self.env, '4')['parent_id'])
+
+        tp = TestPlan(self.env, '7')
+        self.assertEqual((1, 0), (tp['contains_all'], tp['freeze_tc_versions']))
+
+        tcip = TestCaseInPlan(self.env, '3', '7')
+        self.assertEqual(('successful', -1, 1), 
+                         (tcip['status'], tcip['page_version'], tcip['version']))
+
+    def test_titles(self):
+        self.env.upgrade()
+
+        def titles(realm):
+            cursor = self.env.get_read_db().cursor()
+            cursor.execute("SELECT id, title, summary FROM %s ORDER BY id" % realm)
+            return cursor.fetchall()
+
+        self.assertEqual([('1', 'Catalog 1', 'Catalog description'), 
+                          ('2', None, None)], 
+                         titles('testcatalog'))
+        self.assertEqual([('3', 'Test case 3', 'Test case description'), 
+                          ('4', 'Test case 4', 'x' * 197 + '...')], 
+                         titles('testcase'))
+
+        tc = TestCase(self.env, '3')
+        self.assertEqual(('Test case 3', 'Test case description'), 
+                         (tc['title'], tc['summary']))
+        self.assertEqual([], list(tc.list_change_history()))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(UpgradeTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+import unittest
+
+from testmanager.api import TestManagerSystem
+from testmanager.model import TestCatalog, TestCase, TestCaseInPlan
+from testmanager.tests.base import TestManagerTestCase
+from testmanager.wiki import WikiTestManagerInterface
+
+
+class TotalsTestCase(TestManagerTestCase):
+
+    config = [('testcatalog-tm_custom', 'budget', 'text'),
+              ('testcase-tm_custom', 'estimate', 'text'),
+              ('testcaseinplan-tm_custom', 'effort', 'text'),
+              ('testcaseinplan-tm_custom', 'effort.value', '2')]
+
+    operations = ('sum', 'average', 'count')
+
+    def setUp(self):
+        TestManagerTestCase.setUp(self)
+        tcat = self.create_catalog('1', budget='10')
+        sub_tcat = self.create_catalog('2', tcat, budget='0.0')
+        self.create_catalog('3', tcat, budget='abc')
+
+        self.create_testcase('4', tcat, estimate='3.5')
+        self.create_testcase('5', tcat, estimate='0')
+        self.create_testcase('6', sub_tcat, estimate='0.0')
+        self.create_testcase('7', sub_tcat, estimate='abc')
+        self.create_testcase('8', sub_tcat, estimate='')
+        self.create_testcase('9', sub_tcat)
+
+        other_tcat = self.create_catalog('10', budget='100')
+        self.create_testcase('11', other_tcat, estimate='100')
+
+        self.create_testplan('20', tcat)
+        self.create_testplan('21', tcat, contains_all=0, selected_tcs=['4', '6', '7'])
+
+        for tc_id, planid, effort in (('4', '20', '1.5'), ('5', '20', '0.0'), 
+                                      ('6', '20', ''), ('6', '21', '4'),
+                                      ('11', '20', '100')):
+            tcip = TestCaseInPlan(self.env, tc_id, planid)
+            if tcip.exists:
+                tcip['effort'] = effort
+                self._save(tcip)
+            else:
+                tcip['page_name'] = TestCase(self.env, tc_id)['page_name']
+                self._insert(tcip, {'effort': effort})
+
+    def _totals(self, columns, operation):
+        return dict([(col, {'operation': operation, 'count': 0, 'sum': 0, 'average': 0})
+                     for col in columns])
+
+    def _old_totals(self, totals, curpage, planid):
+        """
+        The totals computed going through every object in the table, as
+        the tree table did before they were computed with queries.
+        """
+        objects = []
+        def add_objects(component):
+            for comp in component['childrenC'].values():
+                objects.append(TestCatalog(self.env, comp['tcat_id']))
+                add_objects(comp)
+
+            for tick in component['childrenT'].values():
+                objects.append(TestCase(self.env, tick['tc_id']))
+                if planid is not None:
+                    objects.append(TestCaseInPlan(self.env, tick['tc_id'], planid))
+
+        add_objects(TestManagerSystem(self.env).get_test_catalog_data_model(
+            curpage, planid is not None, planid))
+
+        wiki = WikiTestManagerInterface(self.env)
+        for obj in objects:
+            for col in totals:
+                col_totals = totals[col]
+                value = wiki._get_field_value(obj[col])
+                if value != 0:
+                    if col_totals['operation'] == 'average':
+                        prev_count = col_totals['count']
+                        col_totals['average'] = (value + col_totals['average'] * prev_count) / \
+                                                (prev_count + 1)
+                    col_totals['count'] += 1
+                    col_totals['sum'] += value
+
+        return totals
+
+    def _check(self, curpage, planid, columns):
+        wiki = WikiTestManagerInterface(self.env)
+
+        for operation in self.operations:
+            totals = self._totals(columns, operation)
+            wiki._compute_totals(totals, curpage, planid)
+
+            expected = self._old_totals(self._totals(columns, operation), curpage, planid)
+            for col in columns:
+                if operation == 'average':
+                    self.assertAlmostEqual(expected[col]['average'], totals[col]['average'])
+                else:
+                    self.assertEqual(expected[col][operation], totals[col][operation])
+
+    def test_catalog(self):
+        self._check('TC_TT1', None, ('budget', 'estimate'))
+
+    def test_all_catalogs(self):
+        self._check('TC', None, ('budget', 'estimate'))
+
+    def test_plan(self):
+        self._check('TC_TT1', '20', ('budget', 'estimate', 'effort'))
+
+    def test_plan_with_selected_test_cases(self):
+        self._check('TC_TT1', '21', ('budget', 'estimate', 'effort'))
+
+    def test_values(self):
+        wiki = WikiTestManagerInterface(self.env)
+
+        totals = self._totals(('budget', 'estimate'), 'count')
+        wiki._compute_totals(totals, 'TC_TT1', None)
+        self.assertEqual((1, 2), (totals['budget']['count'], totals['estimate']['count']))
+
+        # Test cases 7 to 9 not executed, each with the default effort 
+        totals = self._totals(('effort',), 'sum')
+        wiki._compute_totals(totals, 'TC_TT1', '20')
+        self.assertEqual((7.5, 4), (totals['effort']['sum'], totals['effort']['count']))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TotalsTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
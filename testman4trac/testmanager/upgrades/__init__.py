@@ -12,3 +12,11 @@
 # Author: Roberto Longobardi <otrebor.dev@gmail.com>
 # 
 
+"""
+Database upgrade steps of the Test Manager classes.
+
+The module db_<realm>_<version> upgrades the tables of a realm from the
+previous version to the specified one. Each step declares the tables as
+they are at its own version: it must not use the current schema of the
+realm, which may declare columns added by later steps.
+"""
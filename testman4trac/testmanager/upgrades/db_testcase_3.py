@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+
+from trac.db import Table, Column, Index
+
+from tracgenericclass.model import create_indexes_for_realm
+
+# The testcase schema at version 3.
+realm_schema = {'table':
+                    Table('testcase', key = ('id'))[
+                          Column('id'),
+                          Column('page_name'),
+                          Column('exec_order', type='int'),
+                          Index(['page_name'])],
+                'has_custom': True,
+                'has_change': True,
+                'custom_indexes': [Index(['name', 'value'])],
+                'pattern_indexes': ['page_name'],
+                'version': 3}
+
+def do_upgrade(env, ver, db_backend, db):
+    """
+    Add the secondary indexes on page_name and on the custom 
+    properties (name, value) to the testcase tables
+    """
+    realm = 'testcase'
+
+    env.log.info("Creating indexes for class %s" % realm)
+    create_indexes_for_realm(env, realm, realm_schema, db)
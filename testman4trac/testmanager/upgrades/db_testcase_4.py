@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+from trac.db import Table, Column, Index
+
+from testmanager.model import _get_catalog_path
+from tracgenericclass.model import create_indexes_for_realm
+
+# The testcase schema at version 4.
+realm_schema = {'table':
+                    Table('testcase', key = ('id'))[
+                          Column('id'),
+                          Column('page_name'),
+                          Column('exec_order', type='int'),
+                          Column('parent_id'),
+                          Index(['page_name']),
+                          Index(['parent_id'])],
+                'has_custom': True,
+                'has_change': True,
+                'custom_indexes': [Index(['name', 'value'])],
+                'pattern_indexes': ['page_name'],
+                'version': 4}
+
+def do_upgrade(env, ver, db_backend, db):
+    """
+    Add the 'parent_id' column, holding the ID of the enclosing 
+    catalog, to the testcase table and fill it from the test case 
+    page names
+    """
+    cursor = db.cursor()
+    
+    realm = 'testcase'
+
+    env.log.info("Adding parent_id column to table for class %s" % realm)
+    cursor.execute("ALTER TABLE %(realm)s ADD COLUMN parent_id text" % {'realm': realm})
+
+    cursor.execute("SELECT id, page_name FROM %(realm)s" % {'realm': realm})
+    rows = [((_get_catalog_path(page_name) or [None])[-1], id_) 
+            for id_, page_name in cursor.fetchall()]
+
+    cursor.executemany("UPDATE %(realm)s SET parent_id = %%s WHERE id = %%s" % {'realm': realm}, rows)
+
+    create_indexes_for_realm(env, realm, realm_schema, db)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+from testmanager.model import TestManagerModelProvider
+
+def do_upgrade(env, ver, db_backend, db):
+    """
+    Add the 'title' and 'summary' columns to the testcase table, and 
+    fill them from the wiki pages
+    """
+    cursor = db.cursor()
+    
+    realm = 'testcase'
+
+    env.log.info("Adding title columns to table for class %s" % realm)
+    cursor.execute("ALTER TABLE %(realm)s ADD COLUMN title text" % {'realm': realm})
+    cursor.execute("ALTER TABLE %(realm)s ADD COLUMN summary text" % {'realm': realm})
+
+    TestManagerModelProvider(env).rebuild_titles(realm, db)
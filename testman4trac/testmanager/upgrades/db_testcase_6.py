@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+from testmanager.model import ORDER_GAP
+
+def do_upgrade(env, ver, db_backend, db):
+    """
+    Spread the execution order keys of the test cases in each catalog
+    at ORDER_GAP intervals, keeping their order, so that test cases can
+    be inserted and moved without changing the other test cases
+    """
+    cursor = db.cursor()
+    
+    realm = 'testcase'
+
+    env.log.info("Renumbering the execution order of class %s" % realm)
+    cursor.execute("SELECT id, parent_id FROM %(realm)s ORDER BY parent_id, exec_order, id" % {'realm': realm})
+
+    rows = []
+    last_parent_id = None
+    for id_, parent_id in cursor.fetchall():
+        if not rows or parent_id != last_parent_id:
+            order = 0
+        order += ORDER_GAP
+        last_parent_id = parent_id
+        
+        rows.append((order, id_))
+
+    cursor.executemany("UPDATE %(realm)s SET exec_order = %%s WHERE id = %%s" % {'realm': realm}, rows)
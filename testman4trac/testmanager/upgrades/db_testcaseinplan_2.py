@@ -12,7 +12,15 @@
 # Author: Roberto Longobardi <otrebor.dev@gmail.com>
 # 
 
-from testmanager.model import TestManagerModelProvider
+from trac.db import Table, Column
+
+# The testcaseinplan table at version 2.
+table_metadata = Table('testcaseinplan', key = ('id', 'planid'))[
+                       Column('id'),
+                       Column('planid'),
+                       Column('page_name'),
+                       Column('page_version', type='int'),
+                       Column('status')]
 
 def do_upgrade(env, ver, db_backend, db):
     """
@@ -24,8 +32,6 @@ def do_upgrade(env, ver, db_backend, db):
     cursor.execute("CREATE TEMPORARY TABLE %(realm)s_old AS SELECT * FROM %(realm)s" % {'realm': realm})
     cursor.execute("DROP TABLE %(realm)s" % {'realm': realm})
 
-    table_metadata = TestManagerModelProvider(env).get_data_models()[realm]['table']
-
     env.log.info("Updating table for class %s" % realm)
     for stmt in db_backend.to_sql(table_metadata):
         env.log.debug(stmt)
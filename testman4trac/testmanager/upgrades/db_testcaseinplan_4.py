@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+def do_upgrade(env, ver, db_backend, db):
+    """
+    Add the 'version' column, for optimistic concurrency control, to 
+    the testcaseinplan table
+    """
+    cursor = db.cursor()
+    
+    realm = 'testcaseinplan'
+
+    env.log.info("Adding version column to table for class %s" % realm)
+    cursor.execute("ALTER TABLE %(realm)s ADD COLUMN version integer" % {'realm': realm})
+    cursor.execute("UPDATE %(realm)s SET version=1" % {'realm': realm})
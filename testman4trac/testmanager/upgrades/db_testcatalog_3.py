@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+# 
+# This file is part of the Test Manager plugin for Trac.
+# 
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at: 
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+# 
+
+from trac.db import Table, Column, Index
+
+from testmanager.model import TestManagerModelProvider
+from tracgenericclass.model import create_indexes_for_realm, \
+    need_db_create_for_realm, create_db_for_realm
+
+# The testcatalog schema at version 3, and the schema of the hierarchy
+# closure table introduced along with it.
+realm_schema = {'table':
+                    Table('testcatalog', key = ('id'))[
+                          Column('id'),
+                          Column('page_name'),
+                          Column('parent_id'),
+                          Column('depth', type='int'),
+                          Index(['page_name']),
+                          Index(['parent_id'])],
+                'has_custom': True,
+                'has_change': True,
+                'custom_indexes': [Index(['name', 'value'])],
+                'pattern_indexes': ['page_name'],
+                'version': 3}
+
+closure_schema = {'table':
+                    Table('testcatalogclosure', key = ('ancestor', 'descendant'))[
+                          Column('ancestor'),
+                          Column('descendant'),
+                          Column('depth', type='int'),
+                          Index(['descendant'])],
+                  'has_custom': False,
+                  'has_change': False,
+                  'version': 1}
+
+def do_upgrade(env, ver, db_backend, db):
+    """
+    Add the 'parent_id' and 'depth' columns to the testcatalog table,
+    and fill them and the catalog hierarchy closure table from the 
+    catalog page names
+    """
+    cursor = db.cursor()
+    
+    realm = 'testcatalog'
+
+    env.log.info("Adding hierarchy columns to table for class %s" % realm)
+    cursor.execute("ALTER TABLE %(realm)s ADD COLUMN parent_id text" % {'realm': realm})
+    cursor.execute("ALTER TABLE %(realm)s ADD COLUMN depth integer" % {'realm': realm})
+
+    create_indexes_for_realm(env, realm, realm_schema, db)
+
+    # The closure table may have already been created, depending on the
+    # order the realms are upgraded in
+    if need_db_create_for_realm(env, 'testcatalogclosure', closure_schema, db):
+        create_db_for_realm(env, 'testcatalogclosure', closure_schema, db)
+
+    TestManagerModelProvider(env).rebuild_catalog_hierarchy(db)
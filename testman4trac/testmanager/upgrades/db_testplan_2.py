@@ -12,7 +12,22 @@
 # Author: Roberto Longobardi <otrebor.dev@gmail.com>
 # 
 
-from testmanager.model import TestManagerModelProvider
+from trac.db import Table, Column, Index
+
+from tracgenericclass.util import get_timestamp_db_type
+
+# The testplan table at version 2.
+table_metadata = Table('testplan', key = ('id'))[
+                       Column('id'),
+                       Column('catid'),
+                       Column('page_name'),
+                       Column('name'),
+                       Column('author'),
+                       Column('time', type=get_timestamp_db_type()),
+                       Column('contains_all', type='int'),
+                       Column('freeze_tc_versions', type='int'),
+                       Index(['id']),
+                       Index(['catid'])]
 
 def do_upgrade(env, ver, db_backend, db):
     """
@@ -24,8 +39,6 @@ def do_upgrade(env, ver, db_backend, db):
     cursor.execute("CREATE TEMPORARY TABLE %(realm)s_old AS SELECT * FROM %(realm)s" % {'realm': realm})
     cursor.execute("DROP TABLE %(realm)s" % {'realm': realm})
 
-    table_metadata = TestManagerModelProvider(env).get_data_models()[realm]['table']
-
     env.log.info("Updating table for class %s" % realm)
     for stmt in db_backend.to_sql(table_metadata):
         env.log.debug(stmt)
@@ -42,6 +42,21 @@ def get_page_description(text):
             result = ''
         
     return result
+
+SUMMARY_LENGTH = 200
+
+def get_page_summary(text):
+    """
+    Returns a short, single line summary of the page description,
+    i.e. its first SUMMARY_LENGTH characters with the whitespace 
+    collapsed.
+    """
+    result = ' '.join(get_page_description(text).split())
+
+    if len(result) > SUMMARY_LENGTH:
+        result = result[:SUMMARY_LENGTH - 3].rstrip() + '...'
+
+    return result
  
 html_escape_table = {
     "&": "&amp;",
@@ -31,9 +31,11 @@ from trac.wiki.parser import WikiParser
 
 from testmanager.admin import get_all_table_columns_for_object
 from testmanager.api import TestManagerSystem
-from testmanager.model import TestCatalog, TestCase, TestCaseInPlan, TestPlan, TestManagerModelProvider
-from testmanager.util import html_escape, get_page_title
+from testmanager.model import TestCatalog, TestCase, TestCaseInPlan, TestPlan, TestManagerModelProvider, \
+    update_test_description_title, get_test_description_titles
+from testmanager.util import html_escape
 from tracgenericclass.model import GenericClassModelProvider
+from tracgenericclass.query import ObjectQuery, SubQuery
 from tracgenericclass.util import fix_base_location, from_any_timestamp
 
 
@@ -43,6 +45,10 @@ except ImportError:
 	from trac.util.translation import _, N_
 	tag_ = _
 
+# Number of changes shown at a time in the object change history
+CHANGE_HISTORY_PAGE_SIZE = 50
+
+
 class WikiTestManagerInterface(Component):
     """Implement generic template provider."""
     
@@ -93,7 +99,7 @@ class WikiTestManagerInterface(Component):
 
     def wiki_page_changed(self, page, version, t, comment, author, ipnr):
         """Called when a page has been modified."""
-        pass
+        update_test_description_title(self.env, page)
 
     def wiki_page_deleted(self, page):
         """Called when a page has been deleted."""
@@ -121,7 +127,9 @@ class WikiTestManagerInterface(Component):
         """Called when a version of a page has been deleted."""
         
         # TODO Maybe should look into all test plans with "snapshot" test case versions and handle this deletion in some way?
-        pass
+
+        # The title of the latest remaining version may be different
+        update_test_description_title(self.env, WikiPage(self.env, page.name))
 
     def wiki_page_renamed(self, page, old_name): 
         """Called when a page has been renamed.""" 
@@ -370,7 +378,7 @@ class WikiTestManagerInterface(Component):
             table_columns, table_columns_map, custom_ctx = get_all_table_columns_for_object(self.env, 'testplan', self.env.config)
             
         tmmodelprovider = GenericClassModelProvider(self.env)
-        tp = TestPlan(self.env, planid)
+        tp = tmmodelprovider.get_object('testplan', {'id': planid})
         
         insert1 = tag.div()(
                     tag.a(href=req.href.wiki(page_name))(_("Back to the Catalog")),
@@ -823,10 +831,16 @@ class WikiTestManagerInterface(Component):
         text += '<tr><th>'+_("Timestamp")+'</th><th>'+_("Author")+'</th><th>'+_("Property")+'</th><th>'+_("Previous Value")+'</th><th>'+_("New Value")+'</th></tr>'
         text += '</thead><tbody>'
 
-        for ts, author, fname, oldvalue, newvalue in obj.list_change_history():
-            if exclude_fields is not None and fname in exclude_fields:
-                continue
-            
+        # Only the most recent changes are rendered, the older ones are 
+        # loaded on demand with the "Show older changes" button
+        changes = list(obj.list_change_history(limit=CHANGE_HISTORY_PAGE_SIZE + 1, exclude_fields=exclude_fields))
+        
+        next_marker = None
+        if len(changes) > CHANGE_HISTORY_PAGE_SIZE:
+            changes = changes[:CHANGE_HISTORY_PAGE_SIZE]
+            next_marker = obj.get_change_history_marker(changes[-1])
+        
+        for ts, author, fname, oldvalue, newvalue in changes:
             if oldvalue is None:
                 oldvalue = ''
             
@@ -842,6 +856,10 @@ class WikiTestManagerInterface(Component):
             text += '</tr>'
             
         text += '</tbody></table>'
+        
+        if next_marker is not None:
+            text += '<input type="button" id="objectChangeHistoryMore" value="'+_("Show older changes")+'" data-realm="'+obj.realm+'" data-key="'+html_escape(obj.gey_key_string())+'" data-next="'+html_escape(next_marker)+'" data-exclude="'+html_escape(','.join(exclude_fields or []))+'" data-limit="'+str(CHANGE_HISTORY_PAGE_SIZE)+'" onclick="loadChangeHistory(this)"/>'
+        
         text += '</fieldset></form>'
 
         return HTML(text)
@@ -1126,15 +1144,18 @@ class WikiTestManagerInterface(Component):
         
         breadcrumb = [{'name': 'TC', 'title': _("All Catalogs"), 'id': 'TC'}]
 
-        for i, tc in enumerate(tokens):
+        path_names = []
+        for tc in tokens:
             curr_path += '_'+tc
-            page = WikiPage(self.env, curr_path)
-            page_title = get_page_title(page.text)
-            
-            breadcrumb[(i+1):] = [{'name': tc, 'title': page_title, 'id': curr_path}]
+            path_names.append(curr_path)
 
             if tc == cat_name:
                 break
+                
+        titles = get_test_description_titles(self.env, path_names)
+
+        for i, curr_path in enumerate(path_names):
+            breadcrumb[(i+1):] = [{'name': tokens[i], 'title': titles[curr_path], 'id': curr_path}]
 
         text = u''
 
@@ -1192,6 +1213,7 @@ class WikiTestManagerInterface(Component):
             
             text += self._render_subtree_as_table(context, None, components, ind, 0, table_columns, table_columns_map, custom_ctx, fulldetails)
             
+            self._compute_totals(ind['totals'], curpage, None)
             text += self._render_totals(table_columns, ind['totals'])
             
             text += '</tbody></table>'
@@ -1244,6 +1266,7 @@ class WikiTestManagerInterface(Component):
             
             text += self._render_subtree_as_table(context, planid, components, ind, 0, table_columns, table_columns_map, custom_ctx)
 
+            self._compute_totals(ind['totals'], curpage, planid)
             text += self._render_totals(table_columns, ind['totals'])
             
             text += '</tbody></table>'
@@ -1281,8 +1304,8 @@ class WikiTestManagerInterface(Component):
         result += '<tr><th>'+_("Plan Name")+'</th><th>'+_("Author")+'</th><th>'+_("Timestamp")+'</th><th>'+_("Contained Test Cases")+'</th><th>'+_("Test Case Versions")+'</th><th></th></tr>'
         result += '</thead><tbody>'
         
-        num_plans = 0
-        for tp in sorted(cat.list_testplans(), cmp=lambda x,y: cmp(x['time'],y['time']), reverse=True):
+        num_plans = cat.count_testplans()
+        for tp in cat.list_testplans(newest_first=True):
             result += '<tr>'
             result += '<td><a title="'+_("Open Test Plan")+'" href="'+tp['page_name']+'?planid='+tp['id']+'">'+tp['name']+'</a></td>'
             result += '<td>'+html_escape(tp['author'])+'</td>'
@@ -1296,7 +1319,6 @@ class WikiTestManagerInterface(Component):
                 result += '<td></td>'
             
             result += '</tr>'
-            num_plans += 1
 
         result += '</tbody></table>'
 
@@ -1518,8 +1540,6 @@ class WikiTestManagerInterface(Component):
 
                 text += '</tr>'
 
-                self._update_totals(ind['totals'], tcat)
-                
                 ind['count']+=1
                 text += self._render_subtree_as_table(context, planid, subcData, ind, level+1, table_columns, table_columns_map, custom_ctx, fulldetails)
                 if ('childrenT' in comp):            
@@ -1568,7 +1588,7 @@ class WikiTestManagerInterface(Component):
 
             tc = None
             if fulldetails or custom_ctx['testcase'][0] or table_columns_map['description']['visible'] == 'True':
-                tc = TestCase(self.env, tick['tc_id'])
+                tc = GenericClassModelProvider(self.env).get_object('testcase', {'id': tick['tc_id']})
 
             text += '<tr name="testcase">'
 
@@ -1600,8 +1620,6 @@ class WikiTestManagerInterface(Component):
             if tc and tc.exists and custom_ctx['testcase'][0]:
                 text += self._get_custom_fields_columns(tc, table_columns, table_columns_map, custom_ctx['testcase'][1])
 
-            self._update_totals(ind['totals'], tc)
-                
             if has_status:
                 # Base testcaseinplan columns
                 if table_columns_map['status']['visible'] == 'True':
@@ -1614,11 +1632,9 @@ class WikiTestManagerInterface(Component):
                 # Custom testcaseinplan columns
                 tcip = None
                 if custom_ctx['testcaseinplan'][0]:
-                    tcip = TestCaseInPlan(self.env, tick['tc_id'], planid)
+                    tcip = GenericClassModelProvider(self.env).get_object('testcaseinplan', {'id': tick['tc_id'], 'planid': planid})
                     text += self._get_custom_fields_columns(tcip, table_columns, table_columns_map, custom_ctx['testcaseinplan'][1])
 
-                self._update_totals(ind['totals'], tcip)
-                    
             #if fulldetails:
             if table_columns_map['description']['visible'] == 'True':
                 wikidom = WikiParser(self.env).parse(tc.description)
@@ -1898,34 +1914,82 @@ class WikiTestManagerInterface(Component):
 
         return text
 
-    def _update_totals(self, totals, obj):
-        self.env.log.debug(">>> _update_totals: %s %s", totals, obj)
-        if obj is not None:
-            for col in totals:
-                col_totals = totals[col]
-                operation = col_totals['operation']
-                if operation == 'sum':
-                    col_totals['sum'] += self._get_field_value(col, obj)
+    def _compute_totals(self, totals, curpage, planid):
+        """
+        Computes the column totals over the test catalogs, test cases and
+        test cases in plan under the current page, with a query for each
+        column instead of going through every object in the table.
+        
+        Each value is weighted as by _get_field_value(), and the test 
+        cases not yet executed in the plan contribute the default value
+        of the test case in plan fields.
+        """
+        self.env.log.debug(">>> _compute_totals: %s", totals)
 
-                elif operation == 'average':
-                    val = self._get_field_value(col, obj)
-                    
-                    if val != 0:
-                        prev_count = col_totals['count']
-                        if prev_count > 0:
-                            prev_average = col_totals['average']
-                            col_totals['average'] = (val + (prev_average * prev_count)) / (prev_count + 1)
-                        else:
-                            col_totals['average'] = val
-
-                        col_totals['count'] += 1
-                    
-                elif operation == 'count':
-                    val = self._get_field_value(col, obj)
-                    if val != 0:
-                        col_totals['count'] += 1
+        if not totals:
+            return
+
+        gclass_modelprovider = GenericClassModelProvider(self.env)
+
+        contains_all = True
+        if planid is not None:
+            tp = gclass_modelprovider.get_object('testplan', {'id': planid})
+            contains_all = tp['contains_all']
 
-        self.env.log.debug("<<< _update_totals: %s", totals)
+        def get_query(realm):
+            # The '_' is a LIKE wildcard, so the 'T' of the sub catalog and 
+            # test case pages is also required, not to match e.g. TC_TT10
+            # under TC_TT1
+            query = ObjectQuery(self.env, realm).filter('page_name', 'like', curpage + '_T%')
+
+            if realm == 'testcaseinplan':
+                query.filter('planid', '=', planid)
+            elif realm == 'testcase' and not contains_all:
+                # Only the test cases selected for the plan are listed
+                query.filter('id', 'in', SubQuery("SELECT id FROM testcaseinplan WHERE planid=%s", [planid]))
+
+            return query
+
+        realms = ['testcatalog', 'testcase']
+        not_executed = 0
+        if planid is not None:
+            realms.append('testcaseinplan')
+            not_executed = max(0, get_query('testcase').count() - 
+                                  get_query('testcaseinplan').count())
+
+        sums = dict([(col, 0) for col in totals])
+        counts = dict([(col, 0) for col in totals])
+
+        def add_value(col, value, times=1):
+            value = self._get_field_value(value)
+            if value != 0:
+                sums[col] += value * times
+                counts[col] += times
+
+        for realm in realms:
+            descriptor = gclass_modelprovider.get_descriptor(realm)
+
+            for col in totals:
+                if col not in descriptor.fields_by_name:
+                    continue
+
+                for value in get_query(realm).values(col):
+                    add_value(col, value)
+
+                if realm == 'testcaseinplan' and not_executed > 0:
+                    # The test cases not executed yet have no row, and 
+                    # are shown with the default values
+                    default_obj = gclass_modelprovider.get_object(realm)
+                    add_value(col, default_obj[col], not_executed)
+
+        for col in totals:
+            col_totals = totals[col]
+            col_totals['sum'] = sums[col]
+            col_totals['count'] = counts[col]
+            if counts[col] > 0 and col_totals['operation'] == 'average':
+                col_totals['average'] = sums[col] / counts[col]
+
+        self.env.log.debug("<<< _compute_totals: %s", totals)
                         
     def _get_custom_fields_columns(self, obj, table_columns, table_columns_map, fields):
         result = u''
@@ -1943,14 +2007,13 @@ class WikiTestManagerInterface(Component):
 
         return result
 
-    def _get_field_value(self, col_name, obj):
+    def _get_field_value(self, value):
         result = 0
-        self.env.log.debug(">>> _get_field_value %s %s", col_name, obj)
-        if obj[col_name] is not None and obj[col_name] != '':
+        self.env.log.debug(">>> _get_field_value %s", value)
+        if value is not None and value != '':
             try:
-                self.env.log.debug("    _get_field_value - value: %s", obj[col_name])
                 # Try to parse the value as a number
-                result = float(obj[col_name])
+                result = float(value)
             except:
                 # Just count as 1 (non-empty value)
                 result = 1
@@ -18,7 +18,7 @@ from trac.core import Component, implements
 from trac.resource import Resource
 from trac.web.api import ITemplateStreamFilter
 
-from tracgenericclass.util import get_string_from_dictionary
+from tracgenericclass.util import encode_key
 from tracgenericworkflow.api import IWorkflowOperationProvider, \
     ResourceWorkflowSystem
 
@@ -95,7 +95,7 @@ class TestManagerWorkflowInterface(Component):
                     realm = 'testplan'
                     key = {'id': planid}
 
-            id = get_string_from_dictionary(key)
+            id = encode_key(key)
             res = Resource(realm, id)
 
             rwsystem = ResourceWorkflowSystem(self.env)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+#
+# This file is part of the Test Manager plugin for Trac.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at:
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+#
+
+"""
+Microbenchmark of the object keys codec in tracgenericclass.util,
+compared to the previous get_string_from_dictionary() and
+get_dictionary_from_string() implementations.
+
+Usage: python bench/keycodec_benchmark.py [number_of_keys] [repetitions]
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+from tracgenericclass import util
+
+
+# Previous implementations, kept here for comparison
+
+def legacy_get_dictionary_from_string(str):
+    result = {}
+
+    sub = str.partition('{')[2].rpartition('}')[0]
+    tokens = sub.split(",")
+
+    for tok in tokens:
+        name = util.remove_quotes(tok.partition(':')[0])
+        value = util.remove_quotes(tok.partition(':')[2])
+
+        result[name] = value
+
+    return result
+
+def legacy_get_string_from_dictionary(dictionary, values=None):
+    if values is None:
+        values = dictionary
+
+    result = '{'
+    for i, k in enumerate(dictionary):
+        result += "'"+k+"':'"+values[k]+"'"
+        if i < len(dictionary)-1:
+            result += ","
+
+    result += '}'
+
+    return result
+
+
+def run(num_keys, repetitions):
+    keys = [{'id': str(i), 'planid': str(i % 17)} for i in range(num_keys)]
+    key_strings = [util.encode_key(key) for key in keys]
+
+    def legacy_encode():
+        for key in keys:
+            legacy_get_string_from_dictionary(key)
+
+    def legacy_decode():
+        for key_str in key_strings:
+            legacy_get_dictionary_from_string(key_str)
+
+    def cold_encode():
+        util._encoded_keys.clear()
+        for key in keys:
+            util.encode_key(key)
+
+    def cold_decode():
+        util._decoded_keys.clear()
+        for key_str in key_strings:
+            util.decode_key(key_str)
+
+    def hot_encode():
+        for key in keys:
+            util.encode_key(key)
+
+    def hot_decode():
+        for key_str in key_strings:
+            util.decode_key(key_str)
+
+    print("%d keys, best of %d runs (msec):" % (num_keys, repetitions))
+    for name, func in (('legacy encode', legacy_encode),
+                       ('encode (cold)', cold_encode),
+                       ('encode (cached)', hot_encode),
+                       ('legacy decode', legacy_decode),
+                       ('decode (cold)', cold_decode),
+                       ('decode (cached)', hot_decode)):
+        func()
+        best = min(timeit.repeat(func, repeat=repetitions, number=1))
+        print("  %-16s %8.3f" % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    num_keys = 1000
+    repetitions = 10
+
+    if len(sys.argv) > 1:
+        num_keys = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        repetitions = int(sys.argv[2])
+
+    run(num_keys, repetitions)
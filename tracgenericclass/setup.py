@@ -27,5 +27,6 @@ setup(
     description='Test management plugin for Trac - Trac Generic Class component',
     long_description='A Trac plugin to create Test Cases, organize them in catalogs and track their execution status and outcome. This module provides a framework to help creating classes on Trac that: are persisted on the DB, support change history, Support extensibility through custom properties that the User can specify declaratively in the trac.ini file. Also provides an intermediate class to build objects that wrap Wiki pages, plus additional properties.',
     keywords='trac plugin generic class framework persistence test case management project quality assurance statistics stats charts charting graph',
-    entry_points = {'trac.plugins': ['tracgenericclass = tracgenericclass']}
+    entry_points = {'trac.plugins': ['tracgenericclass = tracgenericclass']},
+    test_suite='tracgenericclass.tests.suite'
     )
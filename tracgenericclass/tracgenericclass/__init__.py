@@ -15,4 +15,6 @@
 import api
 import model
 import util
+import query
+import fulltext
 
@@ -12,74 +12,465 @@
 # Author: Roberto Longobardi <otrebor.dev@gmail.com>
 # 
 
+import collections
+import copy
+import json
+import threading
+
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.env import IEnvironmentSetupParticipant
+from trac.perm import PermissionError
 from trac.search import ISearchSource
 from trac.util import get_reporter_id
-from trac.web.api import IRequestHandler
+from trac.util.datefmt import format_datetime
+from trac.util.text import to_unicode
+from trac.web.api import IRequestFilter, IRequestHandler, ITemplateStreamFilter
 from trac.web.chrome import ITemplateProvider
 
-from tracgenericclass.model import GenericClassModelProvider
+from tracgenericclass.model import AbstractVariableFieldsObject, \
+    GenericClassModelProvider, IdentityMap, get_identity_map, get_object_cache, \
+    is_wide_table_enabled, rebuild_wide_table, create_object_cache_generations, \
+    get_missing_object_cache_generations
 from trac.core import Interface, Component, ExtensionPoint, implements
-from tracgenericclass.util import get_dictionary_from_string,\
-    formatExceptionInfo
+from tracgenericclass.util import call_after_commit, decode_key,\
+    formatExceptionInfo, from_any_timestamp
 
 
 class IGenericObjectChangeListener(Interface):
     """
     Extension point interface for components that require notification
     when objects are created, modified, or deleted.
+    
+    Notifications are delivered asynchronously, by a pool of worker 
+    threads, after the transaction of the change has been committed, 
+    and receive a copy of the object as it was at the time of the 
+    change. Changes rolled back are not notified. Several changes to the
+    same object that are still waiting to be delivered are coalesced 
+    into one notification.
+    Listeners that must be called synchronously, in the thread and 
+    transaction of the change, should set the `dispatch_synchronously`
+    class attribute to True.
     """
 
-    def object_created(self, g_object):
+    def object_created(self, realm, g_object):
         """Called when an object is created."""
 
-    def object_changed(self, g_object, comment, author, old_values):
+    def objects_created(self, realm, g_objects):
+        """Called once when several objects of the same realm are 
+        created together, e.g. by `insert_many()`.
+        
+        This method is optional: listeners not implementing it are 
+        notified with one `object_created()` call per object.
+        """
+
+    def object_changed(self, realm, g_object, comment, author, old_values):
         """Called when an object is modified.
         
         `old_values` is a dictionary containing the previous values of the
         fields that have changed.
         """
 
-    def object_deleted(self, g_object):
+    def object_deleted(self, realm, g_object):
         """Called when an object is deleted."""
 
 
+class ChangeEventDispatcher(object):
+    """
+    Delivers the change events of generic objects to the asynchronous
+    IGenericObjectChangeListener components.
+    
+    Events are queued to a fixed pool of worker threads. All the events
+    of the same object are handled by the same worker, so they are 
+    delivered in order. An event is merged with the latest event of
+    the same object still waiting in the queue, if it is of the same
+    type, so that a sequence of changes is delivered as a single change
+    but a deletion and a later creation are both delivered.
+    When the queue is full, the calling thread waits for the workers to
+    make room for the event.
+    """
+    
+    def __init__(self, env, max_queue_size=1000, num_workers=2):
+        self.env = env
+        self.max_queue_size = max_queue_size
+        self.num_workers = num_workers
+        
+        self.lock = threading.Condition()
+        self.queues = [collections.deque() for i in range(num_workers)]
+        self.queued = 0
+        self.latest = {}
+        self.workers = []
+        
+    def dispatch(self, listeners, method, realm, objs, args=(), coalesce=True, 
+                 snapshot=True):
+        """
+        Queues the notification of the specified event to the listeners.
+        
+        :param method: the IGenericObjectChangeListener method to call.
+        :param objs: the objects affected by the event. The listeners
+                     receive a copy of each object.
+        :param args: the additional arguments of the listener method.
+        :param snapshot: False if objs are already copies, not modified
+                         any more by the caller.
+        """
+        if snapshot:
+            objs = [_get_object_snapshot(obj) for obj in objs]
+        
+        if len(objs) == 1:
+            object_key = (realm, objs[0].gey_key_string())
+        else:
+            object_key = (realm, id(objs))
+            
+        self.lock.acquire()
+        try:
+            event = self.latest.get(object_key)
+            if coalesce and event is not None and event['method'] == method:
+                self._merge_event(event, objs, args)
+                return
+                
+            # The workers themselves never wait, since they could be 
+            # waiting for their own queue to drain
+            if self.queued >= self.max_queue_size and \
+                    threading.current_thread() not in self.workers:
+                self.env.log.debug("Change events queue full, waiting to queue %s", method)
+                while self.queued >= self.max_queue_size:
+                    self.lock.wait()
+
+            self._start_workers()
+            
+            event = {'listeners': listeners, 'method': method, 'realm': realm, 
+                     'objs': objs, 'args': args, 'object_key': object_key}
+            self.latest[object_key] = event
+            
+            queue = self.queues[hash(object_key) % self.num_workers]
+            queue.append(event)
+            self.queued += 1
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+        
+    def _merge_event(self, event, objs, args):
+        event['objs'] = objs
+        
+        if event['method'] == 'object_changed':
+            # Keep the earliest old value of each changed field
+            comment, author, old_values = args
+            merged_old_values = dict(old_values)
+            merged_old_values.update(event['args'][2])
+            event['args'] = (comment, author, merged_old_values)
+        
+    def _start_workers(self):
+        if not self.workers:
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._run, args=(self.queues[i],),
+                                          name='tracgenericclass-listener-%d' % i)
+                worker.setDaemon(True)
+                worker.start()
+                self.workers.append(worker)
+        
+    def _run(self, queue):
+        while True:
+            self.lock.acquire()
+            try:
+                while not queue:
+                    self.lock.wait()
+                event = queue.popleft()
+                self.queued -= 1
+                
+                # Later events of the object must not be merged with 
+                # this one any more
+                if self.latest.get(event['object_key']) is event:
+                    del self.latest[event['object_key']]
+                    
+                self.lock.notifyAll()
+            finally:
+                self.lock.release()
+                
+            _deliver_event(self.env, event['listeners'], event['method'], 
+                           event['realm'], event['objs'], event['args'])
+
+
+def _deliver_event(env, listeners, method, realm, objs, args, catch_errors=True):
+    for listener in listeners:
+        try:
+            if method == 'objects_created':
+                if hasattr(listener, 'objects_created'):
+                    listener.objects_created(realm, objs)
+                else:
+                    for obj in objs:
+                        listener.object_created(realm, obj)
+            else:
+                getattr(listener, method)(realm, objs[0], *args)
+        except:
+            if not catch_errors:
+                raise
+            env.log.error("Error notifying %s to listener %s", method, listener)
+            env.log.error(formatExceptionInfo())
+
+def _get_object_snapshot(obj):
+    """
+    Returns a copy of the object, which values are not affected by 
+    later changes to the original object.
+    """
+    snapshot = copy.copy(obj)
+    snapshot.values = dict(obj.values)
+    snapshot._old = dict(obj._old)
+    
+    return snapshot
+
+
 class GenericClassSystem(Component):
     """
     Generic Class system for Trac.
     """
 
-    implements(IRequestHandler, ITemplateProvider, ISearchSource)
+    implements(IAdminCommandProvider, IEnvironmentSetupParticipant, IRequestFilter, 
+               IRequestHandler, ITemplateProvider, ITemplateStreamFilter, ISearchSource)
 
     change_listeners = ExtensionPoint(IGenericObjectChangeListener)
 
+    def __init__(self):
+        self.dispatcher = None
+        self.dispatcher_lock = threading.Lock()
+        
         
     # Change listeners management
 
     def object_created(self, testobject):
-        for c in self.change_listeners:
-            c.object_created(testobject)
+        self.notify_created(testobject.realm, [testobject])
 
     def object_changed(self, testobject, comment, author):
-        for c in self.change_listeners:
-            c.object_changed(testobject, comment, author, testobject._old)
+        self.notify_changed(testobject.realm, testobject, comment, author, testobject._old)
 
     def object_deleted(self, testobject):
-        for c in self.change_listeners:
-            c.object_deleted(testobject)
+        self.notify_deleted(testobject.realm, testobject)
+
+    def notify_created(self, realm, objs, db=None):
+        """
+        Notifies the listeners that the specified objects, all of the
+        same realm, have been created.
+        
+        :param db: the transaction of the change, if any. The 
+                   asynchronous listeners are only notified once it has
+                   been committed.
+        """
+        if len(objs) == 1:
+            self._notify('object_created', realm, objs, db=db)
+        elif len(objs) > 1:
+            self._notify('objects_created', realm, objs, coalesce=False, db=db)
+
+    def notify_changed(self, realm, obj, comment, author, old_values, db=None):
+        """
+        Notifies the listeners that the specified object has changed.
+        See notify_created() for the db parameter.
+        """
+        self._notify('object_changed', realm, [obj], (comment, author, old_values), db=db)
+
+    def notify_deleted(self, realm, obj, db=None):
+        """
+        Notifies the listeners that the specified object has been deleted.
+        See notify_created() for the db parameter.
+        """
+        self._notify('object_deleted', realm, [obj], db=db)
+
+    def _notify(self, method, realm, objs, args=(), coalesce=True, db=None):
+        sync_listeners = []
+        async_listeners = []
+        
+        for listener in self.change_listeners:
+            if getattr(listener, 'dispatch_synchronously', False) or \
+                    not self.config.getbool('tracgenericclass', 'async_listeners', True):
+                sync_listeners.append(listener)
+            else:
+                async_listeners.append(listener)
+                
+        if sync_listeners:
+            _deliver_event(self.env, sync_listeners, method, realm, objs, args, 
+                           catch_errors=False)
+            
+        if async_listeners:
+            dispatcher = self._get_dispatcher()
+            if db is None:
+                dispatcher.dispatch(async_listeners, method, realm, objs, args, coalesce)
+            else:
+                # The objects are copied now, as the listeners must 
+                # receive them as they are at the time of the change
+                snapshots = [_get_object_snapshot(obj) for obj in objs]
+                call_after_commit(self.env, db, lambda: dispatcher.dispatch(
+                    async_listeners, method, realm, snapshots, args, coalesce, False))
+
+    def _get_dispatcher(self):
+        self.dispatcher_lock.acquire()
+        try:
+            if self.dispatcher is None:
+                self.dispatcher = ChangeEventDispatcher(self.env,
+                    self.config.getint('tracgenericclass', 'listener_queue_size', 1000),
+                    max(1, self.config.getint('tracgenericclass', 'listener_workers', 2)))
+        finally:
+            self.dispatcher_lock.release()
+            
+        return self.dispatcher
+
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        @self.env.with_transaction()
+        def do_environment_created(db):
+            self.upgrade_environment(db)
+
+    def environment_needs_upgrade(self, db):
+        return len(get_missing_object_cache_generations(self.env, db)) > 0
+
+    def upgrade_environment(self, db):
+        # The object cache generation counters are created in advance,
+        # so that they are only updated when objects change
+        create_object_cache_generations(self.env, db)
+
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('genericclass widetable rebuild', '<realm>',
+               """Rebuild the wide custom fields table of a class
+               
+               The class must be listed in the [tracgenericclass] 
+               wide_custom_tables option. Run this command after 
+               changing the custom fields of the class in trac.ini.
+               """,
+               self._complete_wide_table_realm, self._do_rebuild_wide_table)
+        yield ('genericclass fulltext rebuild', '<realm>',
+               """Rebuild the full-text index of a class
+               
+               The class must have the 'fulltext_index' metadata 
+               property, and the database backend must support 
+               full-text search.
+               """,
+               self._complete_fulltext_realm, self._do_rebuild_fulltext_index)
+
+    def _complete_wide_table_realm(self, args):
+        if len(args) == 1:
+            return [realm for realm in GenericClassModelProvider(self.env).get_known_realms()
+                    if is_wide_table_enabled(self.env, realm)]
+
+    def _do_rebuild_wide_table(self, realm):
+        if not is_wide_table_enabled(self.env, realm):
+            raise AdminCommandError("Class %s is not listed in the [tracgenericclass] "
+                                    "wide_custom_tables option." % realm)
+
+        rebuild_wide_table(self.env, realm)
+
+    def _complete_fulltext_realm(self, args):
+        from tracgenericclass.fulltext import get_fulltext_realms
+        if len(args) == 1:
+            return get_fulltext_realms(self.env)
+
+    def _do_rebuild_fulltext_index(self, realm):
+        from tracgenericclass.fulltext import get_fulltext_realms, \
+            rebuild_fulltext_index, FULLTEXT_TABLE
+        from tracgenericclass.model import _get_system_value
+        
+        if realm not in get_fulltext_realms(self.env):
+            raise AdminCommandError("Class %s does not have the 'fulltext_index' "
+                                    "metadata property." % realm)
+
+        if _get_system_value(self.env, FULLTEXT_TABLE + '_version') is None:
+            raise AdminCommandError("The full-text index is not available. "
+                                    "Check that the database backend supports it "
+                                    "and upgrade the environment.")
+
+        rebuild_fulltext_index(self.env, realm)
 
        
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        """
+        Activates a new identity map for generic class objects, so that
+        each object is loaded only once while processing the request.
+        
+        Also makes sure that the object cache, if enabled, does not 
+        return objects changed by other processes.
+        """
+        IdentityMap(self.env).activate()
+        
+        cache = get_object_cache(self.env)
+        if cache is not None:
+            cache.check_generation()
+        
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        """
+        Deactivates the identity map of the request once the response
+        has been rendered, since template stream filters still need it 
+        while rendering, or right away if there is nothing to render.
+        """
+        identity_map = get_identity_map(self.env)
+        if identity_map is not None:
+            if template is None:
+                identity_map.deactivate()
+            else:
+                req._genericclass_identity_map = identity_map
+
+        return template, data, content_type
+
+
+    # ITemplateStreamFilter methods
+
+    def filter_stream(self, req, method, filename, stream, data):
+        identity_map = getattr(req, '_genericclass_identity_map', None)
+        if identity_map is None:
+            return stream
+
+        # Only the stream of the response template, and not the ones
+        # of the fragments rendered while generating it
+        req._genericclass_identity_map = None
+
+        def deactivate_at_end(stream):
+            try:
+                for event in stream:
+                    yield event
+            finally:
+                identity_map.deactivate()
+
+        return stream | deactivate_at_end
+
+        
     # IRequestHandler methods
 
     def match_request(self, req):
-        return (req.path_info.startswith('/propertyupdate'))
+        return (req.path_info.startswith('/propertyupdate') or
+                req.path_info.startswith('/propertyhistory'))
 
     def process_request(self, req):
         """
         Handles Ajax requests to change an object's property.
         """
+        try:
+            return self._process_property_request(req)
+        finally:
+            # The response has been written already, so the identity
+            # map of the request is not needed any more
+            identity_map = get_identity_map(self.env)
+            if identity_map is not None:
+                identity_map.deactivate()
+
+    def _process_property_request(self, req):
         author = get_reporter_id(req, 'author')
 
-        if req.path_info.startswith('/propertyupdate'):
+        if req.path_info.startswith('/propertyupdate/batch'):
+            result = self._process_batch_update(req, author)
+            
+            result = json.dumps(result)
+            if isinstance(result, unicode):
+                result = result.encode('utf-8')
+
+            req.send_header("Content-Type", "application/json")
+            req.send_header("Content-Length", len(result))
+            req.write(result)
+            return
+
+        elif req.path_info.startswith('/propertyupdate'):
             realm = req.args.get('realm')
             key_str = req.args.get('key')
             name = req.args.get('name')
@@ -87,7 +478,7 @@ class GenericClassSystem(Component):
             
             result = 'ERROR'
             
-            key = get_dictionary_from_string(key_str)
+            key = decode_key(key_str)
 
             try:
                 self.env.log.debug("Setting property %s to %s, in %s with key %s" % (name, value, realm, key))
@@ -105,23 +496,18 @@ class GenericClassSystem(Component):
                 obj.remote_addr = req.remote_addr
                 if obj is not None and obj.exists:
                     comment = "Property changed"
+                    # The listeners are notified by save_changes() and insert()
                     obj.save_changes(author, comment)
-
-                    # Call listeners
-                    self.object_changed(obj, comment, author)
                     
                 else:
                     self.env.log.debug("Object to update not found. Creating it.")
                     props_str = req.args.get('props')
                     if props_str is not None and not props_str == '':
                         # In order to create an object, additional properties may be required
-                        props = get_dictionary_from_string(props_str)
+                        props = decode_key(props_str)
                         obj.set_values(props)
                     obj.insert()
 
-                    # Call listeners
-                    self.object_created(obj)
-
                 result = 'OK'
 
             except:
@@ -131,9 +517,200 @@ class GenericClassSystem(Component):
             req.write(result)
             return 
 
+        elif req.path_info.startswith('/propertyhistory'):
+            # Returns a page of an object's change history, as JSON
+            realm = req.args.get('realm')
+            key_str = req.args.get('key')
+            before = req.args.get('before') or None
+            after = req.args.get('after') or None
+            limit = req.args.get('limit') or 50
+            fields = req.args.get('fields')
+            exclude_fields = req.args.get('exclude')
+
+            result = {'changes': [], 'next': None}
+
+            try:
+                gclass_modelprovider = GenericClassModelProvider(self.env)
+
+                gclass_modelprovider.check_permission(req, realm, key_str, 'view')
+
+                obj = gclass_modelprovider.get_object(realm, decode_key(key_str))
+
+                if fields:
+                    fields = fields.split(',')
+                else:
+                    fields = None
+
+                if exclude_fields:
+                    exclude_fields = exclude_fields.split(',')
+
+                limit = int(limit)
+
+                # Read one more change, to know whether there is a next page
+                changes = list(obj.list_change_history(before=before, after=after,
+                    limit=limit + 1, fields=fields, exclude_fields=exclude_fields))
+
+                if len(changes) > limit:
+                    changes = changes[:limit]
+                    result['next'] = obj.get_change_history_marker(changes[-1])
+
+                for ts, author, fname, oldvalue, newvalue in changes:
+                    result['changes'].append({
+                        'time': format_datetime(from_any_timestamp(ts)),
+                        'author': author,
+                        'field': fname,
+                        'oldvalue': oldvalue or '',
+                        'newvalue': newvalue or ''})
+
+            except PermissionError:
+                raise
+
+            except:
+                self.env.log.error(formatExceptionInfo())
+                result = 'ERROR'
+
+            result = json.dumps(result)
+            if isinstance(result, unicode):
+                result = result.encode('utf-8')
+
+            req.send_header("Content-Type", "application/json")
+            req.send_header("Content-Length", len(result))
+            req.write(result)
+            return
+
         return 'empty.html', {}, None
 
 
+    def _process_batch_update(self, req, author):
+        """
+        Applies a list of property changes, possibly to several objects 
+        of different classes, in a single transaction.
+        
+        The 'operations' request argument is a JSON list of objects with
+        the 'realm', 'key', 'name' and 'value' properties, and optionally
+        'props', with the additional properties needed to create the 
+        object if it does not exist, as for the single property update.
+        The key can be either a dictionary or its string representation.
+        
+        Returns a list with one result per operation, in the same order,
+        each one a dictionary with a 'result' property, 'OK' or 'ERROR',
+        and an error 'message'.
+        """
+        try:
+            operations = json.loads(req.args.get('operations', '[]'))
+        except ValueError:
+            return [{'result': 'ERROR', 'message': "Invalid operations list."}]
+            
+        results = [{'result': 'ERROR', 'message': ''} for op in operations]
+
+        gclass_modelprovider = GenericClassModelProvider(self.env)
+        identity_map = get_identity_map(self.env)
+        
+        # Check permissions once per realm and group operations by object
+        allowed_realms = {}
+        objects_ops = {}
+        for i, op in enumerate(operations):
+            try:
+                realm = op['realm']
+                key = op['key']
+                if isinstance(key, basestring):
+                    key = decode_key(key)
+                    
+                if realm not in allowed_realms:
+                    try:
+                        gclass_modelprovider.check_permission(req, realm, None, 'set')
+                        allowed_realms[realm] = True
+                    except PermissionError:
+                        allowed_realms[realm] = False
+                        
+                if not allowed_realms[realm]:
+                    results[i]['message'] = "Permission denied."
+                    continue
+                    
+                map_key = (realm, tuple(sorted([(k, to_unicode(v)) for k, v in key.items()])))
+                objects_ops.setdefault(map_key, []).append((i, key, op))
+                
+            except:
+                self.env.log.debug(formatExceptionInfo())
+                results[i]['message'] = "Invalid operation."
+
+        # Load all the existing objects of each realm with one batch fetch
+        objects = {}
+        realms_keys = {}
+        for (realm, key_tuple), ops in objects_ops.items():
+            realms_keys.setdefault(realm, []).append(ops[0][1])
+
+        for realm, keys in realms_keys.items():
+            if identity_map is not None:
+                realm_objects = identity_map.get_many(realm, keys)
+            else:
+                realm_objects = AbstractVariableFieldsObject.fetch_many(self.env, realm, keys)
+                
+            for obj in realm_objects:
+                map_key = (realm, tuple(sorted([(k, to_unicode(v)) 
+                    for k, v in obj.build_key_object().items()])))
+                objects[map_key] = obj
+
+        # Apply the changes to the objects
+        to_save = []
+        to_insert = []
+        for map_key, ops in objects_ops.items():
+            realm = map_key[0]
+            obj = objects.get(map_key)
+            
+            try:
+                if obj is None:
+                    obj = gclass_modelprovider.get_object(realm, ops[0][1])
+                    
+                for i, key, op in ops:
+                    obj[op['name']] = op.get('value')
+                    
+                obj.author = author
+                obj.remote_addr = req.remote_addr
+                
+                if obj.exists:
+                    to_save.append((obj, ops))
+                else:
+                    for i, key, op in ops:
+                        props = op.get('props')
+                        if props:
+                            if isinstance(props, basestring):
+                                props = decode_key(props)
+                            obj.set_values(props)
+                    to_insert.append((obj, ops))
+                    
+            except:
+                self.env.log.debug(formatExceptionInfo())
+                for i, key, op in ops:
+                    results[i]['message'] = "Invalid property or value."
+
+        # Save everything in a single transaction
+        try:
+            @self.env.with_transaction()
+            def do_batch_update(db):
+                for obj, ops in to_save:
+                    obj.save_changes(author, "Property changed", db=db)
+                    
+                for obj, ops in to_insert:
+                    obj.insert(db=db)
+                    
+            for obj, ops in to_save + to_insert:
+                for i, key, op in ops:
+                    results[i]['result'] = 'OK'
+                    
+        except:
+            self.env.log.error(formatExceptionInfo())
+            for obj, ops in to_save + to_insert:
+                # Do not keep objects with unsaved changes in the identity map
+                if identity_map is not None:
+                    identity_map.remove(obj)
+                    
+                for i, key, op in ops:
+                    results[i]['message'] = "Error saving the changes."
+
+        return results
+        
+
     # ITemplateProvider methods
     def get_templates_dirs(self):
         """
@@ -176,18 +753,39 @@ class GenericClassSystem(Component):
 
 
     def get_search_results(self, req, terms, filters):
+        """
+        Objects of the classes in the full-text index are all searched
+        with one query on the index, the others by their own 
+        get_search_results() method.
+        """
+        from tracgenericclass.fulltext import is_fulltext_indexed, \
+            search_fulltext_index
+
         gclass_modelprovider = GenericClassModelProvider(self.env)
 
         known_realms = gclass_modelprovider.get_known_realms()
         
+        indexed_realms = []
         for realm in filters:
             if realm in known_realms:
                 metadata = gclass_modelprovider.get_metadata(realm)
                 
                 if 'searchable' in metadata and metadata['searchable']:
+                    if is_fulltext_indexed(self.env, realm):
+                        try:
+                            gclass_modelprovider.get_class_provider(realm).check_permission(req, realm, key_str=None, operation='search')
+                            indexed_realms.append(realm)
+                        except PermissionError:
+                            self.env.log.debug("No permission to search on realm %s." % realm)
+                        continue
+                    
                     obj = gclass_modelprovider.get_object(realm)
                     if obj is not None:
                         for result in obj.get_search_results(req, terms, filters):
                             yield result
 
+        if len(indexed_realms) > 0:
+            for result in search_fulltext_index(self.env, req, indexed_realms, terms):
+                yield result
+
 
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+#
+# This file is part of the Test Manager plugin for Trac.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at:
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+#
+
+from trac.core import Component, implements
+from trac.db import Table, Column, DatabaseManager
+from trac.env import IEnvironmentSetupParticipant
+from trac.resource import Resource, get_resource_url
+from trac.search import shorten_result
+from trac.util.text import to_unicode
+from trac.wiki.api import IWikiChangeListener
+
+from tracgenericclass.api import IGenericObjectChangeListener
+from tracgenericclass.model import GenericClassModelProvider, \
+    MAX_SQL_PARAMS, need_db_upgrade_for_realm, _get_system_value, \
+    _set_system_value, _get_chunks, _group_by_realm
+from tracgenericclass.util import from_any_timestamp, to_any_timestamp, \
+    get_timestamp_db_type, list_available_tables, db_supports_fulltext
+
+
+# Full-text index of generic class objects
+#
+# The documents of all the realms with the 'fulltext_index' metadata
+# property are stored in a plain table, one row per object. The actual
+# full-text index is built on it by the database backend:
+#   * SQLite: an FTS5 virtual table using the documents table as
+#     external content, kept in sync by triggers.
+#   * PostgreSQL: a GIN index on the tsvector of the documents.
+# Other backends do not support the index, and the search falls back
+# to the get_search_results() method of each class.
+
+FULLTEXT_TABLE = 'genericclass_fulltext'
+
+FULLTEXT_DB_VERSION = 1
+
+# Text search configuration used for the PostgreSQL tsvector. The
+# 'simple' configuration does not stem words, so it fits contents
+# written in any language.
+FULLTEXT_PG_CONFIG = 'simple'
+
+FULLTEXT_PG_DOCUMENT = "to_tsvector('%s', coalesce(title,'') || ' ' || coalesce(body,''))" % FULLTEXT_PG_CONFIG
+
+FULLTEXT_SCHEMA = Table(FULLTEXT_TABLE, key=('realm', 'key_str'))[
+                      Column('realm'),
+                      Column('key_str'),
+                      Column('link'),
+                      Column('title'),
+                      Column('body'),
+                      Column('author'),
+                      Column('time', type=get_timestamp_db_type())]
+
+
+def is_fulltext_indexed(env, realm, db=None):
+    """
+    Returns whether the objects of the specified realm are in the
+    full-text index, and the index is complete, i.e. any existing
+    object has already been indexed.
+    """
+    metadata = GenericClassModelProvider(env).get_metadata(realm)
+    if not metadata or not metadata.get('fulltext_index'):
+        return False
+
+    if not db:
+        db = env.get_read_db()
+
+    if db_supports_fulltext(env, db) is None:
+        return False
+
+    return _get_system_value(env, _get_realm_indexed_key(realm), None, db) is not None
+
+def get_fulltext_realms(env):
+    """
+    Returns the realms with the 'fulltext_index' metadata property.
+    """
+    gclass_modelprovider = GenericClassModelProvider(env)
+
+    return [realm for realm in gclass_modelprovider.get_known_realms()
+            if gclass_modelprovider.get_metadata(realm).get('fulltext_index')]
+
+def create_fulltext_index(env, db=None):
+    """
+    Creates the full-text index tables, if supported by the database
+    backend in use.
+    """
+    @env.with_transaction(db)
+    def do_create_fulltext_index(db):
+        engine = db_supports_fulltext(env, db)
+        if engine is None:
+            return
+
+        cursor = db.cursor()
+        db_backend, _ = DatabaseManager(env).get_connector()
+
+        env.log.info("Creating full-text index with engine %s", engine)
+
+        for stmt in db_backend.to_sql(FULLTEXT_SCHEMA):
+            env.log.debug(stmt)
+            cursor.execute(stmt)
+
+        if engine == 'fts5':
+            cursor.execute("""
+                CREATE VIRTUAL TABLE %(table)s_fts USING fts5(title, body,
+                    content='%(table)s', content_rowid='rowid')
+                """ % {'table': FULLTEXT_TABLE})
+            cursor.execute("""
+                CREATE TRIGGER %(table)s_ai AFTER INSERT ON %(table)s BEGIN
+                    INSERT INTO %(table)s_fts (rowid, title, body)
+                        VALUES (new.rowid, new.title, new.body);
+                END
+                """ % {'table': FULLTEXT_TABLE})
+            cursor.execute("""
+                CREATE TRIGGER %(table)s_ad AFTER DELETE ON %(table)s BEGIN
+                    INSERT INTO %(table)s_fts (%(table)s_fts, rowid, title, body)
+                        VALUES ('delete', old.rowid, old.title, old.body);
+                END
+                """ % {'table': FULLTEXT_TABLE})
+            cursor.execute("""
+                CREATE TRIGGER %(table)s_au AFTER UPDATE ON %(table)s BEGIN
+                    INSERT INTO %(table)s_fts (%(table)s_fts, rowid, title, body)
+                        VALUES ('delete', old.rowid, old.title, old.body);
+                    INSERT INTO %(table)s_fts (rowid, title, body)
+                        VALUES (new.rowid, new.title, new.body);
+                END
+                """ % {'table': FULLTEXT_TABLE})
+        elif engine == 'tsvector':
+            cursor.execute("CREATE INDEX %s_document_idx ON %s USING gin(%s)"
+                           % (FULLTEXT_TABLE, FULLTEXT_TABLE, FULLTEXT_PG_DOCUMENT))
+
+        _set_system_value(env, FULLTEXT_TABLE + '_version', FULLTEXT_DB_VERSION, db)
+
+def rebuild_fulltext_index(env, realm, db=None):
+    """
+    Removes all the documents of the specified realm from the full-text
+    index and indexes again all the objects of the realm.
+    """
+    @env.with_transaction(db)
+    def do_rebuild_fulltext_index(db):
+        env.log.info("Rebuilding full-text index for class %s", realm)
+
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM %s WHERE realm=%%s" % FULLTEXT_TABLE, (realm,))
+
+        template = GenericClassModelProvider(env).get_object(realm)
+
+        objects = []
+        for obj in template.list_matching_objects(db=db, stream=True):
+            objects.append(obj)
+            if len(objects) == MAX_SQL_PARAMS:
+                update_fulltext_index(env, realm, objects, db)
+                objects = []
+
+        update_fulltext_index(env, realm, objects, db)
+
+        _set_system_value(env, _get_realm_indexed_key(realm), 1, db)
+
+def update_fulltext_index(env, realm, objects, db=None):
+    """
+    Writes the current documents of the specified objects, all of the
+    same realm, into the full-text index.
+    """
+    if len(objects) == 0:
+        return
+
+    @env.with_transaction(db)
+    def do_update_fulltext_index(db):
+        cursor = db.cursor()
+
+        _delete_fulltext_rows(realm, objects, cursor)
+
+        rows = []
+        for obj in objects:
+            document = obj.get_fulltext_document()
+            time = document.get('time')
+            if time is not None:
+                time = to_any_timestamp(time)
+
+            rows.append((realm, obj.gey_key_string(), document.get('link'),
+                         to_unicode(document.get('title') or ''),
+                         to_unicode(document.get('body') or ''),
+                         document.get('author'), time))
+
+        cursor.executemany("""
+            INSERT INTO %s (realm,key_str,link,title,body,author,time)
+            VALUES (%%s,%%s,%%s,%%s,%%s,%%s,%%s)
+            """ % FULLTEXT_TABLE, rows)
+
+def delete_from_fulltext_index(env, realm, objects, db=None):
+    """
+    Removes the documents of the specified objects, all of the same
+    realm, from the full-text index.
+    """
+    @env.with_transaction(db)
+    def do_delete_from_fulltext_index(db):
+        _delete_fulltext_rows(realm, objects, db.cursor())
+
+def search_fulltext_index(env, req, realms, terms, db=None):
+    """
+    Searches the full-text index for the objects of the specified
+    realms containing all the specified terms, returning the results
+    in the format of the Trac search API, best matches first.
+    """
+    if not db:
+        db = env.get_read_db()
+
+    engine = db_supports_fulltext(env, db)
+    realms = list(realms)
+    terms = [term for term in terms if term]
+    if engine is None or len(realms) == 0 or len(terms) == 0:
+        return
+
+    cursor = db.cursor()
+
+    columns = 'd.realm,d.key_str,d.link,d.title,d.body,d.author,d.time'
+    realms_in = ','.join(['%s'] * len(realms))
+
+    if engine == 'fts5':
+        # Every term is matched as a prefix, quoted so that it is never
+        # parsed as an FTS5 operator
+        match = ' '.join(['"%s"*' % term.replace('"', '""') for term in terms])
+        cursor.execute("""
+            SELECT %(columns)s FROM %(table)s_fts f
+                JOIN %(table)s d ON d.rowid=f.rowid
+            WHERE %(table)s_fts MATCH %%s AND d.realm IN (%(realms)s)
+            ORDER BY f.rank
+            """ % {'columns': columns, 'table': FULLTEXT_TABLE, 'realms': realms_in},
+            [match] + realms)
+    else:
+        query = ' '.join(terms)
+        cursor.execute("""
+            SELECT %(columns)s FROM %(table)s d
+            WHERE %(document)s @@ plainto_tsquery('%(config)s', %%s)
+                AND d.realm IN (%(realms)s)
+            ORDER BY ts_rank(%(document)s, plainto_tsquery('%(config)s', %%s)) DESC
+            """ % {'columns': columns, 'table': FULLTEXT_TABLE, 'realms': realms_in,
+                   'document': FULLTEXT_PG_DOCUMENT, 'config': FULLTEXT_PG_CONFIG},
+            [query] + realms + [query])
+
+    for realm, key_str, link, title, body, author, time in cursor.fetchall():
+        if link:
+            href = req.href(link)
+        else:
+            href = get_resource_url(env, Resource(realm, key_str), req.href)
+
+        if time is not None:
+            time = from_any_timestamp(time)
+
+        yield (href, title, time, author, shorten_result(body, terms))
+
+def _get_realm_indexed_key(realm):
+    return FULLTEXT_TABLE + '_' + realm
+
+def _delete_fulltext_rows(realm, objects, cursor):
+    for chunk in _get_chunks(objects, MAX_SQL_PARAMS - 1):
+        cursor.execute("DELETE FROM %s WHERE realm=%%s AND key_str IN (%s)"
+                       % (FULLTEXT_TABLE, ','.join(['%s'] * len(chunk))),
+                       [realm] + [obj.gey_key_string() for obj in chunk])
+
+
+class GenericClassFullTextIndex(Component):
+    """
+    Maintains the full-text index of the generic class objects,
+    following the changes to the objects and to the wiki pages they
+    are based on.
+    """
+
+    implements(IEnvironmentSetupParticipant, IGenericObjectChangeListener,
+               IWikiChangeListener)
+
+    # The index is updated in the transaction of the change, so that it 
+    # is rolled back along with it
+    dispatch_synchronously = True
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        @self.env.with_transaction()
+        def do_environment_created(db):
+            self.upgrade_environment(db)
+
+    def environment_needs_upgrade(self, db):
+        if db_supports_fulltext(self.env, db) is None:
+            return False
+
+        if _get_system_value(self.env, FULLTEXT_TABLE + '_version', None, db) is None:
+            return True
+
+        for realm in get_fulltext_realms(self.env):
+            if _get_system_value(self.env, _get_realm_indexed_key(realm), None, db) is None:
+                return True
+
+        return False
+
+    def upgrade_environment(self, db):
+        if db_supports_fulltext(self.env, db) is None:
+            return
+
+        if _get_system_value(self.env, FULLTEXT_TABLE + '_version', None, db) is None:
+            create_fulltext_index(self.env, db)
+
+        dburi = self.env.config.get('trac', 'database')
+        tables = list_available_tables(dburi, db.cursor())
+
+        gclass_modelprovider = GenericClassModelProvider(self.env)
+
+        for realm in get_fulltext_realms(self.env):
+            if _get_system_value(self.env, _get_realm_indexed_key(realm), None, db) is not None:
+                continue
+
+            if realm not in tables:
+                # The class tables are yet to be created, so any object
+                # will be indexed as it is created
+                _set_system_value(self.env, _get_realm_indexed_key(realm), 1, db)
+                continue
+
+            realm_schema = gclass_modelprovider.get_class_provider(realm).get_data_models()[realm]
+            if need_db_upgrade_for_realm(self.env, realm, realm_schema, db):
+                # The objects can only be read after the class tables
+                # have been upgraded, so the index is built at the next
+                # environment upgrade
+                self.env.log.info("Full-text index for class %s will be built "
+                                  "after the class tables are upgraded", realm)
+                continue
+
+            rebuild_fulltext_index(self.env, realm, db)
+
+
+    # IGenericObjectChangeListener methods
+
+    def object_created(self, realm, g_object):
+        self.objects_created(realm, [g_object])
+
+    def objects_created(self, realm, g_objects):
+        if self._is_indexed(realm):
+            update_fulltext_index(self.env, realm, g_objects)
+
+    def object_changed(self, realm, g_object, comment, author, old_values):
+        if self._is_indexed(realm):
+            update_fulltext_index(self.env, realm, [g_object])
+
+    def object_deleted(self, realm, g_object):
+        if self._is_indexed(realm):
+            delete_from_fulltext_index(self.env, realm, [g_object])
+
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._update_wiki_page_objects(page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self._update_wiki_page_objects(page.name)
+
+    def wiki_page_deleted(self, page):
+        # Objects based on the page are deleted along with it, if at
+        # all, and removed from the index by object_deleted()
+        pass
+
+    def wiki_page_version_deleted(self, page):
+        self._update_wiki_page_objects(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        self._update_wiki_page_objects(page.name)
+
+
+    def _is_indexed(self, realm):
+        metadata = GenericClassModelProvider(self.env).get_metadata(realm)
+        if not metadata or not metadata.get('fulltext_index'):
+            return False
+
+        return db_supports_fulltext(self.env, self.env.get_read_db()) is not None
+
+    def _update_wiki_page_objects(self, page_name):
+        """
+        Indexes again the objects based on the specified wiki page.
+        """
+        gclass_modelprovider = GenericClassModelProvider(self.env)
+
+        objects = []
+        for realm in get_fulltext_realms(self.env):
+            if 'page_name' not in gclass_modelprovider.get_descriptor(realm).std_fields:
+                continue
+
+            prefix = gclass_modelprovider.get_metadata(realm).get('page_name_prefix')
+            if prefix is not None and not page_name.startswith(prefix):
+                continue
+
+            if not self._is_indexed(realm):
+                continue
+
+            template = gclass_modelprovider.get_object(realm)
+            template['page_name'] = page_name
+            objects.extend(template.list_matching_objects())
+
+        for realm, realm_objects in _group_by_realm(objects).items():
+            update_fulltext_index(self.env, realm, realm_objects)
@@ -12,21 +12,54 @@
 # Author: Roberto Longobardi <otrebor.dev@gmail.com>
 # 
 
+import collections
 import copy
 from datetime import date, datetime
 import re
+import threading
+import time
 
 from trac.core import Interface, TracError, Component, ExtensionPoint
 from trac.db import Table, Column, Index, DatabaseManager, with_transaction
 from trac.resource import Resource
 from trac.util.datefmt import utc
+from trac.util.text import to_unicode
 from trac.util.translation import _
 from trac.wiki.model import WikiPage
 from trac.wiki.web_ui import WikiModule
 
-from tracgenericclass.util import from_any_timestamp, get_string_from_dictionary, \
+from tracgenericclass.util import from_any_timestamp, encode_key, \
     to_any_timestamp, to_list, get_timestamp_db_type, list_available_tables, \
-    db_get_config_property
+    list_available_indexes, db_get_config_property, get_upsert_query, \
+    get_stream_batch_size, call_after_commit, \
+    get_streaming_cursor, iter_cursor_batches, iter_cursor_rows
+
+
+# Maximum number of parameters bound to a single SQL statement, as
+# allowed by the most restrictive of the supported database backends
+# (SQLite).
+MAX_SQL_PARAMS = 999
+
+# Name of the row version field of the realms with the 'has_version'
+# metadata property.
+VERSION_FIELD = 'version'
+
+
+class ConcurrentModificationError(TracError):
+    """
+    Raised by save_changes() when the object has been modified in the
+    database, by someone else, after it was read.
+    
+    The transaction is rolled back, so the caller can fetch the object
+    again, reapply its changes and retry.
+    """
+
+    def __init__(self, realm, key_str):
+        TracError.__init__(self, 
+            _("The %(realm)s object %(key)s has been modified by someone else. "
+              "Please reload it and retry.", realm=realm, key=key_str))
+        self.realm = realm
+        self.key_str = key_str
 
 
 class IConcreteClassProvider(Interface):
@@ -76,6 +109,14 @@ class IConcreteClassProvider(Interface):
                             {'name': 'prop2', 'type': 'text', 'label': N_('Property 2')},
                             {'name': 'time', 'type': 'time', 'label': N_('Last Change')}
                        }
+                
+                Besides 'name', 'type' and 'label', a field can have the 
+                following properties:
+                    'no_history': If present and equal to True indicates 
+                                  the changes to the field are not 
+                                  recorded in the property change history,
+                                  e.g. because the field is derived from 
+                                  other data.
         """
         
     def get_metadata(self):
@@ -95,6 +136,25 @@ class IConcreteClassProvider(Interface):
                                   supports custom fields.
                     'has_change': If present and equal to True indicates the class
                                   supports property change history.
+                    'fulltext_index': If present and equal to True indicates the
+                                      objects of the class are kept in a full-text
+                                      index, used to search them if supported
+                                      by the database backend. The indexed
+                                      text is returned by the objects' 
+                                      get_fulltext_document() method.
+                    'page_name_prefix': If present, the prefix of the names of
+                                        the wiki pages the objects of the class
+                                        are based on. Changes to wiki pages 
+                                        with other names are not checked for
+                                        objects to index again.
+                    'has_version': If present and equal to True indicates the class
+                                   uses optimistic concurrency control. The
+                                   class must declare an 'int' standard 
+                                   field named 'version', which is 
+                                   incremented on every save_changes(). 
+                                   Saving an object which has been modified
+                                   by someone else after it was read raises
+                                   a ConcurrentModificationError.
                     
                 See the following example:
                 return {'sample_realm': {
@@ -124,10 +184,11 @@ class IConcreteClassProvider(Interface):
         Possible operations are:
             'set': set a property with a value. 'name' and 'value' parameters are required.
             'search': search for objects of this class.
+            'view': read an object's change history.
         
         :param key_str: optional, the object's key, in the form of a string representing 
                         a dictionary. To get a dictionary back from this string, use the 
-                        get_dictionary_from_string() function in the
+                        decode_key() function in the
                         tracgenericclass.util package.
         :param operation: optional, the operation to be performed on the object.
         :param name: optional property name, valid for the 'set' operation type
@@ -175,6 +236,13 @@ class AbstractVariableFieldsObject(object):
                      
         self.metadata: points to a dictionary object describing 
                        further meta-data about this object.
+                       
+        self.descriptor: points to the RealmDescriptor of this object's 
+                         realm, shared by all the objects in the realm.
+                         
+        Note: self.fields, self.metadata and self.descriptor are shared
+              among all the objects in the same realm and must not be 
+              modified.
     
     Note: database tables for specific realms are supposed to already
           exist, this object does not create any tables.
@@ -211,11 +279,12 @@ class AbstractVariableFieldsObject(object):
         
         tmmodelprovider = GenericClassModelProvider(self.env)
         
-        self.fields = tmmodelprovider.get_fields(realm)
-        self.time_fields = [f['name'] for f in self.fields
-                            if f['type'] == 'time']
+        self.descriptor = tmmodelprovider.get_descriptor(realm)
+        
+        self.fields = self.descriptor.fields
+        self.time_fields = self.descriptor.time_fields
 
-        self.metadata = tmmodelprovider.get_metadata(realm)
+        self.metadata = self.descriptor.metadata
 
         if key is not None and len(key) > 0:
             self.key = key
@@ -291,6 +360,7 @@ class AbstractVariableFieldsObject(object):
     def _fetch_object(self, key, db=None):
         self.env.log.debug('>>> _fetch_object')
     
+        in_transaction = db is not None
         if not db:
             db = self.env.get_read_db()
 
@@ -301,20 +371,33 @@ class AbstractVariableFieldsObject(object):
         row = None
 
         # Fetch the standard fields
-        std_fields = [f['name'] for f in self.fields
-                      if not f.get('custom')]
+        std_fields = self.descriptor.std_fields
         cursor = db.cursor()
 
-        sql_where = "WHERE 1=1"
-        for k in self.get_key_prop_names():
-            sql_where += " AND " + k + "=%%s" 
-
-        self.env.log.debug("Searching for %s: %s" % (self.realm, sql_where))
-        for k in self.get_key_prop_names():
-            self.env.log.debug("%s = %s" % (k, self[k]))
+        key_values = self.get_key_prop_values()
+        self.env.log.debug("Searching for %s: %s", self.realm, key_values)
+        
+        # Objects are read from the cache, if enabled, unless in a 
+        # transaction
+        cache = None
+        if not in_transaction:
+            cache = get_object_cache(self.env)
+            
+        if cache is not None:
+            values = cache.get(self.realm, key_values)
+            if values is not None:
+                self.env.log.debug("Object found in cache.")
+                self.values.update(values)
+                self.key = self.build_key_object()
+                self.post_fetch_object(db)
+                self.exists = True
+
+                self.env.log.debug('<<< _fetch_object')
+                return True
+                
+            generation = cache.get_generation(self.realm)
         
-        cursor.execute(("SELECT %s FROM %s " + sql_where)
-                       % (','.join(std_fields), self.realm), self.get_key_prop_values())
+        cursor.execute(self.descriptor.get_statement(_sql_select), key_values)
         row = cursor.fetchone()
 
         if not row:
@@ -326,27 +409,20 @@ class AbstractVariableFieldsObject(object):
         self.env.log.debug("Object found.")
             
         self.key = self.build_key_object()
-        for i, field in enumerate(std_fields):
-            value = row[i]
-            if field in self.time_fields:
-                self.values[field] = from_any_timestamp(value)
-            elif value is None:
-                self.values[field] = '0'
-            else:
-                self.values[field] = value
+        self._load_std_values(std_fields, row)
 
         # Fetch custom fields if available
-        custom_fields = [f['name'] for f in self.fields if f.get('custom')]
+        custom_fields = self.descriptor.custom_fields
         if len(custom_fields) > 0:
-            cursor.execute(("SELECT name,value FROM %s_custom " + sql_where)
-                           % self.realm, self.get_key_prop_values())
+            cursor.execute(self.descriptor.get_statement(_sql_select_custom), key_values)
 
-            for name, value in cursor:
-                if name in custom_fields:
-                    if value is None:
-                        self.values[name] = '0'
-                    else:
-                        self.values[name] = value
+            self._load_custom_values(custom_fields, cursor)
+
+        if cache is not None:
+            cache.put(self.realm, key_values, 
+                      [(name, self.values[name]) for name in std_fields + custom_fields 
+                       if name in self.values], 
+                      generation)
 
         self.post_fetch_object(db)
     
@@ -355,6 +431,32 @@ class AbstractVariableFieldsObject(object):
         self.env.log.debug('<<< _fetch_object')
         return True
         
+    def _load_std_values(self, std_fields, row):
+        """
+        Fills this object's standard fields with the values in the
+        specified database row, in the same order as std_fields.
+        """
+        for i, field in enumerate(std_fields):
+            value = row[i]
+            if field in self.time_fields:
+                self.values[field] = from_any_timestamp(value)
+            elif value is None:
+                self.values[field] = '0'
+            else:
+                self.values[field] = value
+
+    def _load_custom_values(self, custom_fields, rows):
+        """
+        Fills this object's custom fields with the (name, value) pairs
+        in the specified rows.
+        """
+        for name, value in rows:
+            if name in custom_fields:
+                if value is None:
+                    self.values[name] = '0'
+                else:
+                    self.values[name] = value
+
     def build_key_object(self):
         """
         Builds and returns a dictionary object with the key properties,
@@ -374,7 +476,7 @@ class AbstractVariableFieldsObject(object):
         """
         Returns a JSON string with the object key properties
         """
-        return get_string_from_dictionary(self.key)
+        return encode_key(self.key)
 
     def get_values_as_string(self, props):
         """
@@ -382,7 +484,7 @@ class AbstractVariableFieldsObject(object):
         
         :param props: An array of field names. 
         """
-        return get_string_from_dictionary(props, self.values)
+        return encode_key(props, self.values)
 
     def __getitem__(self, name):
         """
@@ -411,8 +513,8 @@ class AbstractVariableFieldsObject(object):
         if value:
             if isinstance(value, list):
                 raise TracError(_("Multi-values fields not supported yet"))
-            field = [field for field in self.fields if field['name'] == name]
-            if field and field[0].get('type') == 'text':
+            field = self.descriptor.fields_by_name.get(name)
+            if field and field.get('type') == 'text':
                 value = value.strip()
         self.values[name] = value
         self.env.log.debug("Value after: %s" % self.values[name])
@@ -425,9 +527,9 @@ class AbstractVariableFieldsObject(object):
             value = self.values[name]
             if value is not '0':
                 return value
-            field = [field for field in self.fields if field['name'] == name]
+            field = self.descriptor.fields_by_name.get(name)
             if field:
-                return field[0].get('value', '')
+                return field.get('value', '')
         except KeyError:
             pass
         
@@ -435,7 +537,7 @@ class AbstractVariableFieldsObject(object):
         """
         Populate the object with 'suitable' values from a dictionary
         """
-        field_names = [f['name'] for f in self.fields]
+        field_names = self.descriptor.fields_by_name
         for name in [name for name in values.keys() if name in field_names]:
             self[name] = values.get(name, '')
 
@@ -464,67 +566,171 @@ class AbstractVariableFieldsObject(object):
                 self.env.log.debug('<<< insert (pre_insert returned False)')
                 return
 
-            t_when = when
-
-            # Add a timestamp
-            if t_when is None:
-                t_when = datetime.now(utc)
-            self.values['time'] = self.values['changetime'] = t_when
-
-            # Perform type conversions
-            self.env.log.debug('  Performing type conversions')
-            values = dict(self.values)
-            for field in self.time_fields:
-                if field in values:
-                    values[field] = to_any_timestamp(values[field])
-            
-            # Insert record
-            self.env.log.debug('  Getting fields')
-            std_fields = []
-            custom_fields = []
-            for f in self.fields:
-                fname = f['name']
-                if fname in self.values:
-                    if f.get('custom'):
-                        custom_fields.append(fname)
-                    else:
-                        std_fields.append(fname)
+            std_fields, std_values, custom_rows = self._get_insert_rows(when)
             
             self.env.log.debug('  Inserting record')
             cursor = db.cursor()
-            cursor.execute("INSERT INTO %s (%s) VALUES (%s)"
-                           % (self.realm,
-                              ','.join(std_fields),
-                              ','.join(['%s'] * len(std_fields))),
-                           [values[name] for name in std_fields])
+            cursor.execute(self.descriptor.get_statement(_sql_insert, std_fields),
+                           std_values)
 
             # Insert custom fields
-            key_names = self.get_key_prop_names()
-            key_values = self.get_key_prop_values()
-            if len(custom_fields) > 0:
+            if len(custom_rows) > 0:
                 self.env.log.debug('  Inserting custom fields')
-                cursor.executemany("""
-                INSERT INTO %s_custom (%s,name,value) VALUES (%s,%%s,%%s)
-                """ 
-                % (self.realm, 
-                   ','.join(key_names),
-                   ','.join(['%s'] * len(key_names))),
-                [to_list((key_values, name, self[name])) for name in custom_fields])
+                cursor.executemany(self.descriptor.get_statement(_sql_insert_custom),
+                                   custom_rows)
+
+            if self.metadata['has_custom']:
+                update_wide_table(self.env, self.realm, [self], db)
 
             self.post_insert(db)
+
+            self._set_inserted()
+
+            self.env.log.debug('  Calling listeners')
+            from tracgenericclass.api import GenericClassSystem
+            GenericClassSystem(self.env).notify_created(self.realm, [self], db)
+                
+        _invalidate_cached_objects(self.env, self.realm, [self], db)
+
+        self.env.log.debug('<<< insert')
+        return self.key
+
+    @classmethod
+    def insert_many(cls, env, objects, when=None, db=None):
+        """
+        Add several objects to database, in a single transaction.
+        
+        The base table rows of all the objects of a realm are written
+        with one multi-row statement, and so are their custom fields.
+        Change listeners are notified once for each realm, through the
+        objects_created() method, or with one object_created() call per
+        object for listeners not implementing it.
+        
+        Note that the pre_insert() callbacks of all the objects are 
+        invoked before any of them is written into the database, and 
+        the post_insert() callbacks after all of them have been written.
+        
+        Parameters:
+            When: a datetime object to specify a creation date.
+        
+        Returns the list of the objects actually inserted, i.e. excluding
+        the ones which pre_insert() returned False.
+        """
+        env.log.debug('>>> insert_many')
+
+        objects = list(objects)
+        inserted = []
+
+        if when is None:
+            when = datetime.now(utc)
+        
+        @env.with_transaction(db)
+        def do_insert_many(db):
+            base_rows = {}
+            custom_rows = {}
+            
+            for obj in objects:
+                assert not obj.exists, 'Cannot insert an existing object'
+                
+                if not obj.pre_insert(db):
+                    env.log.debug('  pre_insert returned False, skipping object')
+                    continue
+
+                std_fields, std_values, obj_custom_rows = obj._get_insert_rows(when)
+                
+                base_rows.setdefault((obj.descriptor, std_fields), []).append(std_values)
+                custom_rows.setdefault(obj.descriptor, []).extend(obj_custom_rows)
                 
+                inserted.append(obj)
+
+            cursor = db.cursor()
+            
+            env.log.debug('  Inserting records')
+            for (descriptor, std_fields), rows in base_rows.items():
+                cursor.executemany(descriptor.get_statement(_sql_insert, std_fields),
+                                   rows)
+            
+            env.log.debug('  Inserting custom fields')
+            for descriptor, rows in custom_rows.items():
+                if len(rows) > 0:
+                    cursor.executemany(descriptor.get_statement(_sql_insert_custom),
+                                       rows)
+
+            for realm, realm_objects in _group_by_realm(inserted).items():
+                if realm_objects[0].metadata['has_custom']:
+                    update_wide_table(env, realm, realm_objects, db)
+
+            for obj in inserted:
+                obj.post_insert(db)
+
+            for obj in inserted:
+                obj._set_inserted()
+
+            env.log.debug('  Calling listeners')
+            from tracgenericclass.api import GenericClassSystem
+            for realm, realm_objects in _group_by_realm(inserted).items():
+                GenericClassSystem(env).notify_created(realm, realm_objects, db)
+
+        for realm, realm_objects in _group_by_realm(inserted).items():
+            _invalidate_cached_objects(env, realm, realm_objects, db)
+
+        env.log.debug('<<< insert_many')
+        return inserted
+
+    def _get_insert_rows(self, when=None):
+        """
+        Sets the creation timestamp and returns the names and the values 
+        of the standard fields to be written into the base table, along
+        with the rows to be written into the custom fields table.
+        """
+        t_when = when
+
+        # Add a timestamp
+        if t_when is None:
+            t_when = datetime.now(utc)
+        self.values['time'] = self.values['changetime'] = t_when
+
+        if self.metadata.get('has_version'):
+            self.values[VERSION_FIELD] = 1
+
+        # Perform type conversions
+        self.env.log.debug('  Performing type conversions')
+        values = dict(self.values)
+        for field in self.time_fields:
+            if field in values:
+                values[field] = to_any_timestamp(values[field])
+        
+        self.env.log.debug('  Getting fields')
+        std_fields = []
+        custom_fields = []
+        for f in self.fields:
+            fname = f['name']
+            if fname in self.values:
+                if f.get('custom'):
+                    custom_fields.append(fname)
+                else:
+                    std_fields.append(fname)
+        
+        key_values = self.get_key_prop_values()
+        
+        return (tuple(std_fields), 
+                [values[name] for name in std_fields],
+                [to_list((key_values, name, self[name])) for name in custom_fields])
+
+    def _set_inserted(self):
+        """
+        Sets up the internal fields of a newly inserted object.
+        """
         self.env.log.debug('  Setting up internal fields')
         self.exists = True
+        if self.resource is None:
+            self.resource = Resource(self.realm)
         self.resource = self.resource(id=self.get_resource_id())
         self._old = {}
 
-        self.env.log.debug('  Calling listeners')
-        from tracgenericclass.api import GenericClassSystem
-        for listener in GenericClassSystem(self.env).change_listeners:
-            listener.object_created(self.realm, self)
-
-        self.env.log.debug('<<< insert')
-        return self.key
+        identity_map = get_identity_map(self.env)
+        if identity_map is not None:
+            identity_map.add(self)
 
     def save_changes(self, author=None, comment=None, when=None, db=None, cnum=''):
         """
@@ -553,63 +759,88 @@ class AbstractVariableFieldsObject(object):
             cursor = db.cursor()
 
             # store fields
-            custom_fields = [f['name'] for f in self.fields if f.get('custom')]
+            custom_fields = self.descriptor.custom_fields
             
-            key_names = self.get_key_prop_names()
             key_values = self.get_key_prop_values()
-            sql_where = '1=1'
-            for k in key_names:
-                sql_where += " AND " + k + "=%%s" 
-
-            for name in self._old.keys():
-                if name in custom_fields:
-                    cursor.execute(("""
-                        SELECT * FROM %s_custom 
-                        WHERE name=%%s AND 
-                        """ + sql_where) % self.realm, to_list((name, key_values)))
-                        
-                    if cursor.fetchone():
-                        cursor.execute(("""
-                            UPDATE %s_custom SET value=%%s
-                            WHERE name=%%s AND 
-                            """ + sql_where) % self.realm, to_list((self[name], name, key_values)))
+
+            # The version field is never saved as a regular field: its 
+            # value is the version expected to be found in the database
+            changes = [name for name in self._old if name != VERSION_FIELD]
+            changed_std = [name for name in changes if name not in custom_fields]
+            changed_custom = [name for name in changes if name in custom_fields]
+
+            # All the standard fields are updated with a single statement.
+            # With optimistic concurrency control, the row version is 
+            # checked and incremented by the same statement, so it runs
+            # first, and even when only custom fields have changed, to 
+            # also lock the row against concurrent updates.
+            has_version = self.metadata.get('has_version')
+            if len(changed_std) > 0 or has_version:
+                std_values = []
+                for name in changed_std:
+                    if name in self.time_fields and self[name] is not None:
+                        std_values.append(to_any_timestamp(self[name]))
                     else:
-                        cursor.execute("""
-                            INSERT INTO %s_custom (%s,name,value) 
-                            VALUES (%s,%%s,%%s)
-                            """ 
-                            % (self.realm, 
-                            ','.join(key_names),
-                            ','.join(['%s'] * len(key_names))),
-                            to_list((key_values, name, self[name])))
+                        std_values.append(self[name])
+
+                version_values = []
+                if has_version:
+                    version_values.append(int(self[VERSION_FIELD] or 0))
+                        
+                cursor.execute(self.descriptor.get_statement(_sql_update, 
+                                   tuple(changed_std), bool(has_version)),
+                               to_list((std_values, key_values, version_values)))
+
+                if has_version and cursor.rowcount == 0:
+                    cache = get_object_cache(self.env)
+                    if cache is not None:
+                        cache.discard(self.realm, [key_values])
+                    raise ConcurrentModificationError(self.realm, 
+                        self.gey_key_string())
+
+            # All the custom fields are upserted with a single statement, 
+            # or replaced if the database does not support upserts
+            if len(changed_custom) > 0:
+                custom_rows = [to_list((key_values, name, self[name])) 
+                               for name in changed_custom]
+                
+                upsert_sql = self.descriptor.get_statement(_sql_upsert_custom, self.env)
+                    
+                if upsert_sql is not None:
+                    cursor.executemany(upsert_sql, custom_rows)
                 else:
-                    cursor.execute(("""
-                        UPDATE %s SET %s=%%s WHERE 
-                        """ + sql_where) 
-                        % (self.realm, name),
-                        to_list((self[name], key_values)))
+                    cursor.execute(self.descriptor.get_statement(
+                                       _sql_delete_custom_values, len(changed_custom)),
+                                   to_list((changed_custom, key_values)))
+                    
+                    cursor.executemany(self.descriptor.get_statement(_sql_insert_custom),
+                                       custom_rows)
+
+                update_wide_table(self.env, self.realm, [self], db)
                 
-                if self.metadata['has_change']:
-                    cursor.execute(("""
-                        INSERT INTO %s_change
-                            (%s, time,author,field,oldvalue,newvalue)
-                        VALUES (%s, %%s, %%s, %%s, %%s, %%s)
-                        """
-                        % (self.realm, 
-                        ','.join(key_names),
-                        ','.join(['%s'] * len(key_names)))),
-                        to_list((key_values, when_ts, author, name, 
-                        self._old[name], self[name])))
+            if self.metadata['has_change']:
+                fields_by_name = self.descriptor.fields_by_name
+                history_changes = [name for name in changes 
+                                   if not fields_by_name.get(name, {}).get('no_history')]
+                if len(history_changes) > 0:
+                    cursor.executemany(self.descriptor.get_statement(_sql_insert_change),
+                        [to_list((key_values, when_ts, author, name, 
+                         self._old[name], self[name])) for name in history_changes])
             
             self.post_save_changes(db)
 
-        old_values = self._old
-        self._old = {}
-        self.values['changetime'] = when
+            old_values = dict([(name, value) for name, value in self._old.items()
+                               if name != VERSION_FIELD])
+            self._old = {}
+            self.values['changetime'] = when
+            if has_version:
+                self.values[VERSION_FIELD] = int(self.values[VERSION_FIELD]) + 1
+
+            from tracgenericclass.api import GenericClassSystem
+            GenericClassSystem(self.env).notify_changed(self.realm, self, comment, 
+                                                        author, old_values, db)
 
-        from tracgenericclass.api import GenericClassSystem
-        for listener in GenericClassSystem(self.env).change_listeners:
-            listener.object_changed(self.realm, self, comment, author, old_values)
+        _invalidate_cached_objects(self.env, self.realm, [self], db)
 
         self.env.log.debug('<<< save_changes')
         return True
@@ -634,37 +865,37 @@ class AbstractVariableFieldsObject(object):
 
             cursor = db.cursor()
 
-            key_names = self.get_key_prop_names()
             key_values = self.get_key_prop_values()
 
-            sql_where = 'WHERE 1=1'
-            for k in key_names:
-                sql_where += " AND " + k + "=%%s" 
-
-            self.env.log.debug("Deleting %s: %s" % (self.realm, sql_where))
-            for k in key_names:
-                self.env.log.debug("%s = %s" % (k, self[k]))
+            self.env.log.debug("Deleting %s: %s", self.realm, key_values)
                            
-            cursor.execute(("DELETE FROM %s " + sql_where)
-                % self.realm, key_values)
+            cursor.execute(self.descriptor.get_statement(_sql_delete, ''), key_values)
                 
             if self.metadata['has_change']:
-                cursor.execute(("DELETE FROM %s_change " + sql_where)
-                    % self.realm, key_values)
+                cursor.execute(self.descriptor.get_statement(_sql_delete, '_change'), 
+                               key_values)
 
             if self.metadata['has_custom']:
-                custom_fields = [f['name'] for f in self.fields if f.get('custom')]
+                custom_fields = self.descriptor.custom_fields
                 if len(custom_fields) > 0:
-                    cursor.execute(("DELETE FROM %s_custom " + sql_where) 
-                        % self.realm, key_values)
+                    cursor.execute(self.descriptor.get_statement(_sql_delete, '_custom'), 
+                                   key_values)
+
+                delete_from_wide_table(self.env, self.realm, [self], db)
 
             self.post_delete(db)
+
+            from tracgenericclass.api import GenericClassSystem
+            GenericClassSystem(self.env).notify_deleted(self.realm, self, db)
+            
+            identity_map = get_identity_map(self.env)
+            if identity_map is not None:
+                identity_map.remove(self)
+
+            self.exists = False
                 
-        from tracgenericclass.api import GenericClassSystem
-        for listener in GenericClassSystem(self.env).change_listeners:
-            listener.object_deleted(self.realm, self)
-        
-        self.exists = False
+        _invalidate_cached_objects(self.env, self.realm, [self], db)
+
         self.env.log.debug('<<< delete')
 
     def save_as(self, new_key, when=None, db=None):
@@ -697,35 +928,124 @@ class AbstractVariableFieldsObject(object):
 
         self.env.log.debug('<<< save_as')
         
-    def list_change_history(self, db=None):
+    def list_change_history(self, db=None, stream=False, before=None, after=None, 
+                            limit=None, fields=None, exclude_fields=None):
         """
         Returns an ordered list of all the changes to standard and
         custom field, with the old and new value, along with timestamp
         and author, starting from the most recent.
+        
+        Changes with the same timestamp are ordered by field name, so
+        that the history can be paged through with the 'before' and 
+        'after' markers.
+        
+        :param stream: if True, the changes are read in batches, through
+                       a server-side cursor where supported, so that 
+                       long histories are never held in memory as a 
+                       whole. See list_matching_objects().
+        :param before: only return the changes older than the specified
+                       marker, which is either a timestamp (a datetime 
+                       or a database timestamp) or a (timestamp, field)
+                       tuple, as returned by get_change_history_marker()
+                       for the last change of the previous page.
+        :param after: only return the changes newer than the specified
+                      marker. Together with 'limit', the changes right
+                      after the marker are returned, still starting from
+                      the most recent.
+        :param limit: the maximum number of changes to return.
+        :param fields: only return the changes to these fields.
+        :param exclude_fields: do not return the changes to these fields.
         """
         self.env.log.debug('>>> list_change_history')
 
         if self.metadata['has_change']:
-            std_fields = [f['name'] for f in self.fields
-                          if not f.get('custom')]
-
-            sql_where = "WHERE 1=1"
-            for k in self.get_key_prop_names():
-                sql_where += " AND " + k + "=%%s" 
-
+            params = list(self.get_key_prop_values())
+            
+            num_fields = None
+            if fields is not None:
+                if len(fields) == 0:
+                    self.env.log.debug('<<< list_change_history')
+                    return
+                num_fields = len(fields)
+                params.extend(fields)
+            
+            num_excluded = 0
+            if exclude_fields:
+                num_excluded = len(exclude_fields)
+                params.extend(exclude_fields)
+            
+            # The kind of each marker, i.e. None, 'time' or 'field'
+            marker_kinds = []
+            for marker in (before, after):
+                if marker is None:
+                    marker_kinds.append(None)
+                else:
+                    ts, fname = self._get_change_history_marker_values(marker)
+                    if fname is None:
+                        marker_kinds.append('time')
+                        params.append(ts)
+                    else:
+                        marker_kinds.append('field')
+                        params.extend((ts, ts, fname))
+            
+            # Read the oldest changes first when paging forward from 'after'
+            reverse = after is not None and before is None and limit is not None
+            
+            if limit is not None:
+                params.append(int(limit))
+            
+            sql = self.descriptor.get_statement(_sql_select_change_history, 
+                num_fields, num_excluded, marker_kinds[0], marker_kinds[1], 
+                reverse, limit is not None)
+            
             if not db:
                 db = self.env.get_read_db()
                 
-            cursor = db.cursor()
+            if stream:
+                cursor = get_streaming_cursor(self.env, db)
+            else:
+                cursor = db.cursor()
+
+            cursor.execute(sql, params)
 
-            cursor.execute(("SELECT time,author,field,oldvalue,newvalue FROM %s_change " + sql_where+ " ORDER BY time DESC")
-                           % self.realm, self.get_key_prop_values())
+            if reverse:
+                cursor = reversed(cursor.fetchall())
+            elif stream:
+                cursor = iter_cursor_rows(cursor, get_stream_batch_size(self.env))
 
             for ts, author, fname, oldvalue, newvalue in cursor:
                 yield ts, author, fname, oldvalue, newvalue
 
         self.env.log.debug('<<< list_change_history')
 
+    def get_change_history_marker(self, change):
+        """
+        Returns a string identifying the specified change, as returned
+        by list_change_history(), which can be used as the 'before' or
+        'after' marker to page through the change history.
+        """
+        return '%s:%s' % (change[0], change[2])
+
+    def _get_change_history_marker_values(self, marker):
+        """
+        Returns the database timestamp and the field name, or None, of
+        the specified change history marker.
+        """
+        fname = None
+        
+        if isinstance(marker, basestring):
+            ts, sep, fname = marker.partition(':')
+            if not sep:
+                fname = None
+            marker = long(ts)
+        elif isinstance(marker, tuple):
+            marker, fname = marker
+            
+        if isinstance(marker, datetime):
+            marker = to_any_timestamp(marker)
+            
+        return marker, fname
+
     def get_non_empty_prop_names(self):
         """
         Returns a list of names of the fields that are not None.
@@ -784,7 +1104,119 @@ class AbstractVariableFieldsObject(object):
         """
         pass
             
-    def list_matching_objects(self, exact_match=True, operator=None, db=None):
+    @classmethod
+    def fetch_many(cls, env, realm, keys, db=None):
+        """
+        Fetches all the objects of the specified realm matching the
+        specified keys, using a single query on the base table and a
+        single query on the custom fields table (for every chunk of
+        keys the database backend allows in one statement), instead of
+        two queries per object.
+
+        Returns a list with the objects found, in the same order as the
+        keys. Keys not matching any object in the database are skipped.
+
+        The pre_fetch_object() and post_fetch_object() callbacks are
+        invoked on every object, as when fetching a single object at
+        construction time.
+
+        :param keys: a list of dictionaries, each one with the key
+                     properties of an object.
+        """
+        env.log.debug('>>> fetch_many')
+
+        keys = list(keys)
+        template = GenericClassModelProvider(env).get_object(realm)
+        if template is None:
+            raise TracError("Requested class %s not found." % realm)
+
+        if not db:
+            db = env.get_read_db()
+
+        key_names = template.get_key_prop_names()
+        std_fields = template.descriptor.std_fields
+
+        objects = {}
+        cursor = db.cursor()
+        for keys_chunk in _get_chunks(keys, MAX_SQL_PARAMS // len(key_names)):
+            sql_where, params = _get_keys_where_clause(key_names, keys_chunk)
+
+            cursor.execute("SELECT %s FROM %s WHERE %s"
+                           % (','.join(std_fields), realm, sql_where), params)
+
+            for obj in template._create_from_rows(std_fields, cursor.fetchall(), db):
+                objects[_get_key_tuple(key_names, obj.values)] = obj
+
+        result = []
+        for key in keys:
+            obj = objects.get(_get_key_tuple(key_names, key))
+            if obj is not None:
+                result.append(obj)
+
+        env.log.debug('<<< fetch_many')
+        return result
+
+    def _create_empty_instance(self):
+        """
+        Returns a new, empty object of the same realm as this one,
+        without accessing the database.
+        """
+        return GenericClassModelProvider(self.env).get_object(self.realm)
+
+    def _create_from_rows(self, std_fields, rows, db):
+        """
+        Builds objects of the same realm as this one from the specified
+        database rows, each one holding the values of std_fields.
+        Custom fields for all of the objects are loaded with one query
+        for every chunk of objects, so no per-object query is performed.
+        """
+        key_names = self.get_key_prop_names()
+        custom_fields = self.descriptor.custom_fields
+
+        objects = []
+        for row in rows:
+            obj = self._create_empty_instance()
+            obj.values = {}
+            for i, field in enumerate(std_fields):
+                if field in key_names:
+                    obj.values[field] = row[i]
+            obj.key = obj.build_key_object()
+
+            if not obj.pre_fetch_object(db):
+                continue
+
+            obj._load_std_values(std_fields, row)
+            objects.append(obj)
+
+        if len(custom_fields) > 0 and len(objects) > 0:
+            by_key = {}
+            for obj in objects:
+                by_key[_get_key_tuple(key_names, obj.values)] = obj
+
+            cursor = db.cursor()
+            for objs_chunk in _get_chunks(objects, MAX_SQL_PARAMS // len(key_names)):
+                sql_where, params = _get_keys_where_clause(key_names,
+                    [obj.key for obj in objs_chunk])
+
+                cursor.execute("SELECT %s,name,value FROM %s_custom WHERE %s"
+                               % (','.join(key_names), self.realm, sql_where), params)
+
+                for row in cursor:
+                    obj = by_key.get(_get_key_tuple(key_names,
+                        dict(zip(key_names, row))))
+                    if obj is not None:
+                        obj._load_custom_values(custom_fields,
+                            [row[len(key_names):]])
+
+        for obj in objects:
+            obj.post_fetch_object(db)
+            obj.exists = True
+            obj.resource = Resource(obj.realm, obj.gey_key_string())
+            obj._old = {}
+
+        return objects
+
+    def list_matching_objects(self, exact_match=True, operator=None, db=None, hydrate=True, stream=False):
         """
         List the objects that match the current values of this object's
         fields.
@@ -797,6 +1229,21 @@ class AbstractVariableFieldsObject(object):
         specify exact_match=False, in which case the SQL 'LIKE' operator
         will be used.
         
+        By default, all the standard fields are read by the same query
+        used for matching, and the custom fields of all the objects found
+        are loaded in bulk, so the objects are built without any further
+        per-object query.
+        Specify hydrate=False to only read the keys of the matching
+        objects and have them created, and fetched one by one, by the
+        create_instance() method.
+        
+        Specify stream=True to read the results in batches of the size
+        configured by the [tracgenericclass] stream_batch_size option,
+        through a server-side cursor on PostgreSQL and with fetchmany()
+        on the other backends, so that the memory used does not depend
+        on the number of objects found. Do not modify the objects of 
+        the same class while iterating over a streamed result.
+        
         The `db` argument is deprecated in favor of `with_transaction()`.
         """
         self.env.log.debug('>>> list_matching_objects')
@@ -806,76 +1253,340 @@ class AbstractVariableFieldsObject(object):
 
         self.pre_list_matching_objects(db)
 
-        cursor = db.cursor()
+        if stream:
+            cursor = get_streaming_cursor(self.env, db)
+        else:
+            cursor = db.cursor()
 
-        non_empty_std_names, non_empty_custom_names = self.get_non_empty_prop_names()
+        sql_where, non_empty_std_values = self._get_matching_condition(exact_match, operator)
         
-        non_empty_std_values = self.get_values(non_empty_std_names)
-        non_empty_custom_values = self.get_values(non_empty_custom_names)
+        if hydrate and GenericClassModelProvider(self.env).get_class_provider(self.realm):
+            std_fields = self.descriptor.std_fields
 
-        if operator == None:
-            operator = '='
-            if not exact_match:
-                operator = ' LIKE '
-        
-        sql_where = '1=1'
-        for k in non_empty_std_names:
-            sql_where += " AND " + k + operator + '%%s'
-        
-        cursor.execute(('SELECT %s FROM %s WHERE ' + sql_where)
-                       % (','.join(self.get_key_prop_names()), self.realm), 
+            cursor.execute('SELECT %s FROM %s WHERE '
+                           % (','.join(std_fields), self.realm) + sql_where, 
+                           non_empty_std_values)
+
+            batch_size = MAX_SQL_PARAMS // len(self.get_key_prop_names())
+            if stream:
+                rows_chunks = iter_cursor_batches(cursor, 
+                    min(batch_size, get_stream_batch_size(self.env)))
+            else:
+                rows_chunks = _get_chunks(cursor.fetchall(), batch_size)
+
+            for rows_chunk in rows_chunks:
+                for obj in self._create_from_rows(std_fields, rows_chunk, db):
+                    self.env.log.debug('<<< list_matching_objects - returning result')
+                    yield obj
+
+            self.env.log.debug('<<< list_matching_objects')
+            return
+
+        cursor.execute('SELECT %s FROM %s WHERE '
+                       % (','.join(self.get_key_prop_names()), self.realm) + sql_where, 
                        non_empty_std_values)
 
+        if stream:
+            cursor = iter_cursor_rows(cursor, get_stream_batch_size(self.env))
+
         for row in cursor:
             key = self._get_key_from_row(row)
             self.env.log.debug('<<< list_matching_objects - returning result')
             yield self.create_instance(key)
 
         self.env.log.debug('<<< list_matching_objects')
-       
-    def get_search_results(self, req, terms, filters):
+
+    def list_matching_rows(self, fields=None, exact_match=True, operator=None, db=None):
         """
-        Called in the context of the trac search API, to return a list
-        of objects of this class matching the specified terms.
+        List, as lightweight read-only records, the specified fields of 
+        the objects that match the current values of this object's 
+        fields.
+        Matching works as in list_matching_objects(), but no object is
+        built: each result is a tuple-backed ProjectionRow, which values
+        can be accessed by position, by name with the row['fieldname'] 
+        syntax, or as attributes.
+        Use this method for listings and exports, where objects would 
+        only be read.
         
-        Concrete classes should override this method to perform class-specific
-        searches.
+        :param fields: the names of the standard and custom fields to 
+                       read. By default, all the standard fields are read.
+                       Custom fields without a value for an object are 
+                       returned with their default value.
         """
-        if False:
-            yield None
+        self.env.log.debug('>>> list_matching_rows')
 
-    # Following is a set of callbacks allowing subclasses to perform
-    # actions around the operations that pertain the lifecycle of 
-    # this object.
-    
-    def pre_fetch_object(self, db):
-        """ 
-        Use this method to perform initialization before fetching the
-        object from the database.
-        Return False to prevent the object from being fetched from the 
-        database.
-        """
-        return True
+        if fields is None:
+            fields = self.descriptor.std_fields
+        fields = tuple(fields)
 
-    def post_fetch_object(self, db):
+        for f in fields:
+            if f not in self.descriptor.fields_by_name:
+                raise TracError("Field %s not found for class %s." % (f, self.realm))
+
+        if not db:
+            db = self.env.get_read_db()
+
+        self.pre_list_matching_objects(db)
+
+        key_names = self.get_key_prop_names()
+        std_fields = [f for f in fields if f in self.descriptor.std_fields]
+        custom_fields = [f for f in fields if f in self.descriptor.custom_fields]
+        select_fields = key_names + [f for f in std_fields if f not in key_names]
+        custom_defaults = dict([(f, self.descriptor.fields_by_name[f].get('value', '')) 
+                                for f in custom_fields])
+
+        row_class = get_row_class(self.realm, fields)
+        
+        sql_where, params = self._get_matching_condition(exact_match, operator)
+        
+        cursor = db.cursor()
+        cursor.execute('SELECT %s FROM %s WHERE '
+                       % (','.join(select_fields), self.realm) + sql_where, 
+                       params)
+
+        rows = cursor.fetchall()
+        for rows_chunk in _get_chunks(rows, (MAX_SQL_PARAMS - len(custom_fields)) // len(key_names)):
+            custom_values = {}
+            if len(custom_fields) > 0:
+                sql_where, params = _get_keys_where_clause(key_names, 
+                    [dict(zip(key_names, row)) for row in rows_chunk])
+
+                cursor.execute("SELECT %s,name,value FROM %s_custom WHERE name IN (%s) AND (%s)"
+                               % (','.join(key_names), self.realm, 
+                                  ','.join(['%s'] * len(custom_fields)), sql_where), 
+                               custom_fields + params)
+
+                for row in cursor:
+                    key = _get_key_tuple(key_names, dict(zip(key_names, row)))
+                    value = row[len(key_names) + 1]
+                    if value is None:
+                        value = '0'
+                    custom_values[(key, row[len(key_names)])] = value
+
+            for row in rows_chunk:
+                values = dict(zip(select_fields, row))
+                key = _get_key_tuple(key_names, values)
+                result = []
+                for f in fields:
+                    if f in custom_fields:
+                        # Objects without a value take the field default
+                        result.append(custom_values.get((key, f), custom_defaults[f]))
+                    else:
+                        value = values[f]
+                        if f in self.time_fields:
+                            value = from_any_timestamp(value)
+                        elif value is None:
+                            value = '0'
+                        result.append(value)
+                        
+                yield row_class(result)
+
+        self.env.log.debug('<<< list_matching_rows')
+
+    def count_matching_objects(self, exact_match=True, operator=None, db=None):
         """
-        Use this method to further fulfill your object after being
-        fetched from the database.
+        Returns the number of objects that match the current values of
+        this object's fields, as in list_matching_objects(), computed
+        with a single query and without building any object.
         """
-        pass
-        
-    def pre_insert(self, db):
-        """ 
-        Use this method to perform work before inserting the
-        object into the database.
-        Return False to prevent the object from being inserted into the 
-        database.
+        self.env.log.debug('>>> count_matching_objects')
+
+        result = self.aggregate_matching_objects('count', exact_match=exact_match,
+                                                 operator=operator, db=db)
+
+        self.env.log.debug('<<< count_matching_objects')
+        return result
+
+    def aggregate_matching_objects(self, function, field=None, group_by=None,
+                                   exact_match=True, operator=None, db=None):
         """
-        return True
+        Computes an aggregate function over the objects that match the
+        current values of this object's fields, as in
+        list_matching_objects(), with a single query and without
+        building any object.
 
-    def post_insert(self, db):
+        :param function: one of 'count', 'sum', 'min', 'max' and 'avg'.
+        :param field: the standard or custom field to aggregate. Not
+                      needed for 'count'. Custom field values are
+                      converted to integers for 'sum' and 'avg'.
+        :param group_by: an optional standard or custom field to group
+                         the results by.
+
+        :returns: the aggregate value if group_by is not specified,
+                  otherwise a dictionary from the group_by field values
+                  to the corresponding aggregate values.
         """
-        Use this method to perform further work after your object has
+        self.env.log.debug('>>> aggregate_matching_objects')
+
+        function = function.lower()
+        if function not in ('count', 'sum', 'min', 'max', 'avg'):
+            raise TracError("Unsupported aggregate function: %s" % function)
+
+        for f in (field, group_by):
+            if f is not None and f not in self.descriptor.fields_by_name:
+                raise TracError("Field %s not found for class %s." % (f, self.realm))
+
+        if field is None and function != 'count':
+            raise TracError("A field is required for the %s function." % function)
+
+        if not db:
+            db = self.env.get_read_db()
+
+        self.pre_list_matching_objects(db)
+
+        key_names = self.get_key_prop_names()
+
+        # Custom fields are joined from the <realm>_custom table
+        joins = []
+        join_params = []
+        columns = {}
+        for f in (field, group_by):
+            if f is None or f in columns:
+                continue
+
+            if f in self.descriptor.custom_fields:
+                alias = 'c%d' % len(joins)
+                joins.append(" LEFT OUTER JOIN %s_custom %s ON (%s AND %s.name=%%s)"
+                    % (self.realm, alias,
+                       ' AND '.join(['%s.%s=t.%s' % (alias, k, k) for k in key_names]),
+                       alias))
+                join_params.append(f)
+                columns[f] = alias + '.value'
+            else:
+                columns[f] = 't.' + f
+
+        if field is None:
+            expression = 'COUNT(*)'
+        else:
+            column = columns[field]
+            if field in self.descriptor.custom_fields and function in ('sum', 'avg'):
+                column = db.cast(column, 'int')
+            expression = '%s(%s)' % (function.upper(), column)
+
+        sql_where, params = self._get_matching_condition(exact_match, operator, 't')
+
+        sql = "SELECT %s FROM %s t%s WHERE %s" % (
+            expression if group_by is None else '%s,%s' % (columns[group_by], expression),
+            self.realm, ''.join(joins), sql_where)
+
+        if group_by is not None:
+            sql += " GROUP BY " + columns[group_by]
+
+        cursor = db.cursor()
+        cursor.execute(sql, join_params + params)
+
+        if group_by is None:
+            row = cursor.fetchone()
+            result = row[0]
+            if result is None and function == 'count':
+                result = 0
+        else:
+            result = {}
+            for group_value, value in cursor:
+                if group_by in self.time_fields:
+                    group_value = from_any_timestamp(group_value)
+                result[group_value] = value
+
+        self.env.log.debug('<<< aggregate_matching_objects')
+        return result
+
+    def _get_matching_condition(self, exact_match=True, operator=None, alias=None):
+        """
+        Returns an SQL condition matching the current values of this 
+        object's standard fields, along with the corresponding 
+        parameters, as used by list_matching_objects().
+        
+        :param alias: an optional alias of the realm table, to qualify
+                      the field names with.
+        """
+        non_empty_std_names, non_empty_custom_names = self.get_non_empty_prop_names()
+        
+        non_empty_std_values = self.get_values(non_empty_std_names)
+
+        if operator == None:
+            operator = '='
+            if not exact_match:
+                operator = ' LIKE '
+        
+        prefix = ''
+        if alias is not None:
+            prefix = alias + '.'
+
+        sql_where = '1=1'
+        for k in non_empty_std_names:
+            sql_where += " AND " + prefix + k + operator + '%s'
+
+        return sql_where, non_empty_std_values
+       
+    def get_search_results(self, req, terms, filters):
+        """
+        Called in the context of the trac search API, to return a list
+        of objects of this class matching the specified terms.
+        
+        Concrete classes should override this method to perform class-specific
+        searches.
+        """
+        if False:
+            yield None
+
+    def get_fulltext_document(self):
+        """
+        Called to index this object for full-text search, if the class
+        has the 'fulltext_index' metadata property. Returns a dictionary
+        with the following entries:
+            'title': the title of the object in the search results.
+            'body': the text to be searched, along with the title.
+            'author': the author of the last change, or None.
+            'time': the datetime of the last change, or None.
+            'link': the path of the object's page, relative to the Trac
+                    base URL (e.g. 'wiki/SomePage'), or None to use the
+                    URL of the object's resource.
+        
+        By default, the title is the object's key and the body is made
+        of the values of the text fields. Concrete classes can override
+        this method to provide more meaningful contents.
+        """
+        texts = [to_unicode(self.values[f['name']]) for f in self.fields 
+                 if f['type'] in ('text', 'textarea') and self.values.get(f['name'])]
+        
+        return {'title': self.gey_key_string(),
+                'body': '\n'.join(texts),
+                'author': None,
+                'time': self.values.get('changetime'),
+                'link': None}
+
+    # Following is a set of callbacks allowing subclasses to perform
+    # actions around the operations that pertain the lifecycle of 
+    # this object.
+    
+    def pre_fetch_object(self, db):
+        """ 
+        Use this method to perform initialization before fetching the
+        object from the database.
+        Return False to prevent the object from being fetched from the 
+        database.
+        """
+        return True
+
+    def post_fetch_object(self, db):
+        """
+        Use this method to further fulfill your object after being
+        fetched from the database.
+        """
+        pass
+        
+    def pre_insert(self, db):
+        """ 
+        Use this method to perform work before inserting the
+        object into the database.
+        Return False to prevent the object from being inserted into the 
+        database.
+        """
+        return True
+
+    def post_insert(self, db):
+        """
+        Use this method to perform further work after your object has
         been inserted into the database.
         
         You should throw an exception inside here if you want the insert
@@ -948,11 +1659,83 @@ class AbstractWikiPageWrapper(AbstractVariableFieldsObject):
     one.     
     """
     def __init__(self, env, realm='wiki_wrapper_obj', key=None, db=None):
+        self._wikipage = None
+        self._wikipage_loaded = False
+
         AbstractVariableFieldsObject.__init__(self, env, realm, key, db)
     
+    def _get_wikipage(self):
+        """
+        The wiki page of the object, loaded on first access.
+        """
+        if not self._wikipage_loaded:
+            self._wikipage = WikiPage(self.env, self.values['page_name'])
+            self._wikipage_loaded = True
+            
+        return self._wikipage
+
+    def _set_wikipage(self, wikipage):
+        self._wikipage = wikipage
+        self._wikipage_loaded = True
+
+    wikipage = property(_get_wikipage, _set_wikipage)
+
     def post_fetch_object(self, db):
-        self.wikipage = WikiPage(self.env, self.values['page_name'])
+        # The wiki page is loaded only when needed
+        self._wikipage = None
+        self._wikipage_loaded = False
     
+    @classmethod
+    def prefetch_wiki_pages(cls, env, objects, db=None):
+        """
+        Loads the latest version of the wiki pages of the specified 
+        objects with a single query (for every chunk of pages the 
+        database backend allows in one statement), instead of one query
+        per object when their 'wikipage' property is first accessed.
+        Objects which wiki page is already loaded are skipped.
+        """
+        env.log.debug('>>> prefetch_wiki_pages')
+
+        by_name = {}
+        for obj in objects:
+            if not obj._wikipage_loaded and obj.values['page_name']:
+                by_name.setdefault(obj.values['page_name'], []).append(obj)
+
+        if not db:
+            db = env.get_read_db()
+
+        cursor = db.cursor()
+        for names in _get_chunks(by_name.keys(), MAX_SQL_PARAMS):
+            cursor.execute("SELECT w.name,w.version,w.time,w.author,w.text,w.comment,w.readonly "
+                           "FROM wiki w, (SELECT name,max(version) AS version FROM wiki "
+                           "WHERE name IN (%s) GROUP BY name) m "
+                           "WHERE w.name=m.name AND w.version=m.version"
+                           % ','.join(['%s'] * len(names)), names)
+
+            pages = {}
+            for name, version, time_, author, text, comment, readonly in cursor:
+                page = WikiPage(env)
+                page.name = name
+                page.version = int(version)
+                page.time = from_any_timestamp(time_)
+                page.author = author
+                page.text = page.old_text = text
+                page.comment = comment
+                page.readonly = page.old_readonly = readonly and int(readonly) or 0
+                pages[name] = page
+
+            for name in names:
+                page = pages.get(name)
+                if page is None:
+                    # Not existing page, as it would be loaded by WikiPage
+                    page = WikiPage(env)
+                    page.name = name
+
+                for obj in by_name[name]:
+                    obj.wikipage = page
+
+        env.log.debug('<<< prefetch_wiki_pages')
+
     def delete(self, del_wiki_page=True, db=None):
         """
         Delete the object. Also deletes the Wiki page if so specified in the parameters.
@@ -965,6 +1748,20 @@ class AbstractWikiPageWrapper(AbstractVariableFieldsObject):
         
         AbstractVariableFieldsObject.delete(self, db)
         
+    def save_changes(self, author=None, comment=None, when=None, db=None, cnum='', save_wiki_page=True):
+        """
+        Store object changes in the database. Also saves the Wiki page,
+        unless otherwise specified in the parameters, e.g. when the 
+        object changes follow from a direct edit of the Wiki page.
+        
+        The `db` argument is deprecated in favor of `with_transaction()`.
+        """
+        
+        # The actual wiki page saving is delayed until pre_save_changes.
+        self.save_wiki_page = save_wiki_page
+        
+        return AbstractVariableFieldsObject.save_changes(self, author, comment, when, db, cnum)
+        
     def pre_insert(self, db):
         """ 
         Assuming the following fields have been given a value before this call:
@@ -983,10 +1780,18 @@ class AbstractWikiPageWrapper(AbstractVariableFieldsObject):
         """ 
         Assuming the following fields have been given a value before this call:
         text, author, remote_addr, values['page_name']
+        
+        The saved Wiki page refers to this object in its 'generic_object'
+        attribute, so that the Wiki change listeners can tell it from
+        the direct edits of the page.
         """
         
+        if not self.save_wiki_page:
+            return True
+            
         wikipage = WikiPage(self.env, self.values['page_name'])
         wikipage.text = self.text
+        wikipage.generic_object = self
         wikipage.save(self.author, '', self.remote_addr)
     
         self.wikipage = wikipage
@@ -1015,6 +1820,665 @@ class AbstractWikiPageWrapper(AbstractVariableFieldsObject):
         for result in WikiModule(self.env).get_search_results(req, terms, ('wiki',)):
             yield result
 
+    def get_fulltext_document(self):
+        """
+        The document of the object includes the text of its wiki page,
+        and links to the wiki page.
+        """
+        document = AbstractVariableFieldsObject.get_fulltext_document(self)
+        
+        document['title'] = self.values['page_name']
+        document['link'] = 'wiki/' + self.values['page_name']
+        
+        wikipage = getattr(self, 'wikipage', None)
+        if wikipage is not None and wikipage.exists:
+            document['body'] = wikipage.text + '\n' + document['body']
+            document['author'] = wikipage.author or getattr(self, 'author', None)
+            document['time'] = wikipage.time
+            
+        return document
+
+
+class ProjectionRow(tuple):
+    """
+    A compact, read-only record with the values of some fields of a 
+    generic class object, as returned by list_matching_rows().
+    
+    Values can be accessed by position, by name with the 
+    row['fieldname'] syntax, or as attributes.
+    Concrete subclasses, one for each realm and set of fields, are 
+    created on demand, with the following class properties:
+        realm: the realm of the object.
+        fields: a tuple with the names of the fields.
+    """
+    
+    __slots__ = ()
+
+    realm = None
+    fields = ()
+    _index = {}
+    
+    def __getitem__(self, name):
+        if isinstance(name, basestring):
+            return tuple.__getitem__(self, self._index[name])
+            
+        return tuple.__getitem__(self, name)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        if name in self._index:
+            return tuple.__getitem__(self, self._index[name])
+            
+        return default
+
+    def as_dict(self):
+        return dict(zip(self.fields, self))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, 
+            ', '.join(['%s=%r' % (f, v) for f, v in zip(self.fields, self)]))
+
+
+_row_classes = {}
+
+def get_row_class(realm, fields):
+    """
+    Returns the ProjectionRow subclass for the specified realm and
+    fields, creating it the first time.
+    Can also be used to return the results of custom queries as 
+    ProjectionRow records.
+    """
+    row_class = _row_classes.get((realm, fields))
+    
+    if row_class is None:
+        row_class = type(str('%sRow' % realm.capitalize()), (ProjectionRow,), 
+                         {'__slots__': (), 
+                          'realm': realm, 
+                          'fields': fields, 
+                          '_index': dict([(f, i) for i, f in enumerate(fields)])})
+        _row_classes[(realm, fields)] = row_class
+
+    return row_class
+
+
+class IdentityMap(object):
+    """
+    A registry of the generic class objects loaded in the scope of a 
+    request or of a transaction, keyed by realm and key.
+    
+    While an identity map is active for the current thread, objects
+    retrieved through the GenericClassModelProvider.get_object() factory
+    method are loaded from the database only once, and any further 
+    lookup returns the same, already loaded, object.
+    Inserted objects are registered and deleted objects are evicted
+    automatically.
+    
+    The identity map also acts as a unit of work: the flush() method 
+    saves all the modified (i.e. "dirty") registered objects in a 
+    single transaction.
+    
+    The GenericClassSystem activates a new identity map at the beginning
+    of each web request, and deactivates it once the response has been 
+    rendered. To use an identity map elsewhere, for example
+    inside a transaction, do as follows:
+    
+        identity_map = IdentityMap(env)
+        identity_map.activate()
+        try:
+            ...
+            identity_map.flush(author, comment)
+        finally:
+            identity_map.deactivate()
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.objects = {}
+        
+    def get(self, realm, key, db=None):
+        """
+        Returns the object of the specified realm with the specified key,
+        loading it only if not already registered.
+        """
+        map_key = self._get_map_key(realm, key)
+        
+        if map_key in self.objects:
+            return self.objects[map_key]
+        
+        provider = GenericClassModelProvider(self.env).get_class_provider(realm)
+        if provider is None:
+            return None
+            
+        obj = provider.create_instance(realm, key)
+        if obj is not None:
+            self.objects[map_key] = obj
+
+        return obj
+
+    def get_many(self, realm, keys, db=None):
+        """
+        Returns the objects of the specified realm with the specified 
+        keys, loading all of the missing ones with one batch fetch.
+        Keys not matching any object in the database are skipped.
+        """
+        keys = list(keys)
+        
+        missing = [key for key in keys 
+                   if self._get_map_key(realm, key) not in self.objects]
+                   
+        if len(missing) > 0:
+            for obj in AbstractVariableFieldsObject.fetch_many(self.env, realm, missing, db):
+                self.add(obj)
+
+        result = []
+        for key in keys:
+            obj = self.objects.get(self._get_map_key(realm, key))
+            if obj is not None and obj.exists:
+                result.append(obj)
+                
+        return result
+        
+    def add(self, obj):
+        """
+        Registers the specified object, replacing any other object
+        with the same realm and key.
+        """
+        if obj.key:
+            self.objects[self._get_map_key(obj.realm, obj.key)] = obj
+
+    def remove(self, obj):
+        """
+        Evicts the specified object from the identity map.
+        """
+        if obj.key:
+            self.objects.pop(self._get_map_key(obj.realm, obj.key), None)
+
+    def clear(self, realm=None):
+        """
+        Evicts all the objects, or only the ones of the specified realm,
+        from the identity map. 
+        Use this method after modifying objects in the database without
+        going through the generic class API, e.g. with bulk SQL updates.
+        """
+        if realm is None:
+            self.objects = {}
+        else:
+            for map_key in [k for k in self.objects if k[0] == realm]:
+                del self.objects[map_key]
+
+    def get_dirty_objects(self):
+        """
+        Returns the registered objects with unsaved changes.
+        """
+        return [obj for obj in self.objects.values() 
+                if obj.exists and obj._old]
+
+    def flush(self, author=None, comment=None, when=None, db=None):
+        """
+        Saves the changes of all the dirty objects in a single 
+        transaction.
+        Returns the number of objects saved.
+        """
+        dirty_objects = self.get_dirty_objects()
+
+        if len(dirty_objects) > 0:
+            if when is None:
+                when = datetime.now(utc)
+                
+            @self.env.with_transaction(db)
+            def do_flush(db):
+                for obj in dirty_objects:
+                    obj.save_changes(author, comment, when, db)
+        
+        return len(dirty_objects)
+
+    def activate(self):
+        """
+        Makes this identity map the active one for the current thread.
+        """
+        _identity_maps.current = self
+
+    def deactivate(self):
+        """
+        Deactivates this identity map, if active for the current thread.
+        """
+        if getattr(_identity_maps, 'current', None) is self:
+            _identity_maps.current = None
+
+    def _get_map_key(self, realm, key):
+        return (realm, tuple(sorted([(k, to_unicode(v)) for k, v in key.items()])))
+
+        
+_identity_maps = threading.local()
+
+def get_identity_map(env):
+    """
+    Returns the identity map active for the current thread on the 
+    specified environment, or None.
+    """
+    identity_map = getattr(_identity_maps, 'current', None)
+    
+    if identity_map is not None and identity_map.env is env:
+        return identity_map
+        
+    return None
+
+
+class ObjectCache(object):
+    """
+    A read-through cache of the field values of generic class objects,
+    keyed by realm and key, shared by all the threads of the process.
+    
+    The cache is enabled by setting the [tracgenericclass] 
+    object_cache_size option to the maximum number of objects to keep.
+    When full, the least recently used objects are evicted. Objects
+    are also expired after object_cache_ttl seconds.
+    
+    Objects are cached when they are fetched by key, and invalidated
+    when they are inserted, saved or deleted, both right away and after
+    the change has been committed. Once the transaction has been 
+    committed, a generation counter of each changed realm is also 
+    incremented in the Trac 'system' table, where the counters are 
+    created by the environment upgrade. Other processes compare the
+    counters with the last ones they have seen, at the beginning of 
+    each request and at most every GENERATION_CHECK_INTERVAL seconds, 
+    and remove the objects of the realms whose counter has changed.
+    
+    Objects fetched with an explicit database connection, e.g. inside
+    a transaction, are always read from the database.
+    """
+    
+    GENERATION_KEY = 'genericclass_cache_generation_'
+    
+    GENERATION_CHECK_INTERVAL = 1
+    
+    def __init__(self, env, max_size, ttl):
+        self.env = env
+        self.max_size = max_size
+        self.ttl = ttl
+        
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.generations = {}
+        self.generation_checked = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        
+    def get(self, realm, key_values):
+        """
+        Returns a copy of the cached values of the specified object, or
+        None.
+        """
+        if time.time() - self.generation_checked > self.GENERATION_CHECK_INTERVAL:
+            self.check_generation()
+
+        cache_key = self._get_cache_key(realm, key_values)
+        
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(cache_key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+                
+            # Move to the most recently used end
+            self.entries[cache_key] = entry
+            self.hits += 1
+            return dict(entry[1])
+        finally:
+            self.lock.release()
+    
+    def get_generation(self, realm):
+        """
+        Returns the current cache generation of the specified realm, to
+        be passed to put().
+        """
+        return self.generations.get(realm)
+    
+    def put(self, realm, key_values, values, generation):
+        """
+        Caches a copy of the specified values of an object.
+        
+        :param generation: the cache generation of the realm at the time
+                           the values were read from the database. If 
+                           any object of the realm has been invalidated
+                           since then, the values are not cached, since
+                           they could be stale.
+        """
+        cache_key = self._get_cache_key(realm, key_values)
+        
+        self.lock.acquire()
+        try:
+            if generation != self.generations.get(realm):
+                return
+                
+            self.entries.pop(cache_key, None)
+            self.entries[cache_key] = (time.time() + self.ttl, dict(values))
+            
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        finally:
+            self.lock.release()
+
+    def invalidate(self, realm=None, keys_values=None, db=None):
+        """
+        Removes the specified objects from the cache, and notifies the
+        other processes once the transaction changing them has been 
+        committed. Until then, other threads could cache the old values
+        again, so the objects are removed once more after the commit.
+        
+        :param realm: the realm of the objects. If None, the whole 
+                      cache is cleared.
+        :param keys_values: a list with the key values of each object.
+                            If None, all the objects of the realm are
+                            removed.
+        :param db: the transaction where the objects are being changed,
+                   if any.
+        """
+        self.discard(realm, keys_values)
+
+        @self.env.with_transaction(db)
+        def do_invalidate(db):
+            pending = _PendingInvalidations(self)
+            pending.add(realm, keys_values)
+            
+            # All the invalidations of a transaction are flushed together
+            registered = call_after_commit(self.env, db, pending, key=self)
+            if registered is not pending:
+                registered.add(realm, keys_values)
+    
+    def discard(self, realm=None, keys_values=None):
+        """
+        Removes the specified objects from the cache of this process 
+        only. See invalidate() for the parameters.
+        """
+        self.lock.acquire()
+        try:
+            self._discard(realm, keys_values)
+            self.invalidations += 1
+        finally:
+            self.lock.release()
+    
+    def check_generation(self, db=None):
+        """
+        Removes the objects of the realms which other processes have
+        changed since the last check.
+        """
+        if not db:
+            db = self.env.get_read_db()
+
+        generations = self._read_generations(db)
+        self._set_generations(generations, generations)
+
+    def get_stats(self):
+        """
+        Returns the cache statistics, as a dictionary.
+        """
+        return {'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'generations': dict(self.generations)}
+
+    def _read_generations(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT name, value FROM system WHERE name LIKE %s", 
+                       (self.GENERATION_KEY + '%',))
+        
+        return dict([(name[len(self.GENERATION_KEY):], int(value)) 
+                     for name, value in cursor])
+
+    def _set_generations(self, generations, expected):
+        """
+        Records the current generation of each of the specified realms,
+        removing the objects of the realms whose previous generation was
+        not the expected one.
+        """
+        self.lock.acquire()
+        try:
+            for realm, generation in generations.items():
+                if self.generations.get(realm) != expected[realm]:
+                    self.env.log.debug("Object cache generation of %s changed from %s to %s, "
+                                       "removing its objects", realm, 
+                                       self.generations.get(realm), generation)
+                    self._discard(realm)
+                    
+                self.generations[realm] = generation
+
+            self.generation_checked = time.time()
+        finally:
+            self.lock.release()
+
+    def _discard(self, realm=None, keys_values=None):
+        if realm is None:
+            self.entries.clear()
+        elif keys_values is None:
+            for cache_key in [k for k in self.entries if k[0] == realm]:
+                del self.entries[cache_key]
+        else:
+            for key_values in keys_values:
+                self.entries.pop(self._get_cache_key(realm, key_values), None)
+
+    def _flush(self, realms):
+        """
+        Removes again the objects changed by a committed transaction,
+        and increments the generation counters of their realms.
+        
+        :param realms: a dictionary from realm name to the list of the
+                       key values of the changed objects, or None for
+                       all the objects. The None realm stands for all 
+                       the realms.
+        """
+        for realm, keys_values in realms.items():
+            self.discard(realm, keys_values)
+        
+        # The transaction block is not over yet, so a connection of our
+        # own is committed
+        db = DatabaseManager(self.env).get_connection()
+        cursor = db.cursor()
+        if None in realms:
+            cursor.execute("UPDATE system SET value=%s+1 WHERE name LIKE %%s" 
+                           % db.cast('value', 'int'), (self.GENERATION_KEY + '%',))
+        else:
+            cursor.executemany("UPDATE system SET value=%s+1 WHERE name=%%s" 
+                               % db.cast('value', 'int'), 
+                               [(self.GENERATION_KEY + realm,) for realm in realms])
+        db.commit()
+        
+        # The generations this process knows of are incremented as well,
+        # so values read before the commit are not cached any more. If
+        # other processes have also changed the realms, the next check
+        # finds unexpected generations and removes their objects.
+        self.lock.acquire()
+        try:
+            if None in realms:
+                realms = self.generations.keys()
+            for realm in realms:
+                self.generations[realm] = self.generations.get(realm, 0) + 1
+        finally:
+            self.lock.release()
+
+    def _get_cache_key(self, realm, key_values):
+        return (realm, tuple([to_unicode(v) for v in key_values]))
+
+
+class _PendingInvalidations(object):
+    """
+    The objects invalidated by a transaction, flushed from the object
+    cache once the transaction has been committed.
+    """
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.realms = {}
+        
+    def add(self, realm, keys_values):
+        if realm in self.realms and self.realms[realm] is None:
+            return
+        
+        if keys_values is None:
+            self.realms[realm] = None
+        else:
+            self.realms.setdefault(realm, []).extend(keys_values)
+        
+    def __call__(self):
+        self.cache._flush(self.realms)
+
+
+_object_caches = {}
+_object_caches_lock = threading.Lock()
+
+def get_object_cache(env):
+    """
+    Returns the object cache of the specified environment, or None if
+    the cache is not enabled.
+    """
+    cache = _object_caches.get(env)
+    
+    if cache is None:
+        max_size = env.config.getint('tracgenericclass', 'object_cache_size', 0)
+        if max_size <= 0:
+            return None
+
+        _object_caches_lock.acquire()
+        try:
+            cache = _object_caches.get(env)
+            if cache is None:
+                cache = ObjectCache(env, max_size, 
+                    env.config.getint('tracgenericclass', 'object_cache_ttl', 300))
+                _object_caches[env] = cache
+        finally:
+            _object_caches_lock.release()
+    
+    return cache
+
+def create_object_cache_generations(env, db=None):
+    """
+    Creates the object cache generation counters of the known realms 
+    which do not have one yet, so that they only need to be updated 
+    when objects change. The counters are created even if the cache is
+    not enabled in this environment, since other processes could be 
+    using it.
+    """
+    @env.with_transaction(db)
+    def do_create_object_cache_generations(db):
+        missing = get_missing_object_cache_generations(env, db)
+        if missing:
+            cursor = db.cursor()
+            cursor.executemany("INSERT INTO system (name,value) VALUES (%s,%s)",
+                [(ObjectCache.GENERATION_KEY + realm, '0') for realm in missing])
+
+def get_missing_object_cache_generations(env, db=None):
+    """
+    Returns the known realms without an object cache generation counter.
+    """
+    if not db:
+        db = env.get_read_db()
+
+    cursor = db.cursor()
+    cursor.execute("SELECT name FROM system WHERE name LIKE %s", 
+                   (ObjectCache.GENERATION_KEY + '%',))
+    existing = set([row[0][len(ObjectCache.GENERATION_KEY):] for row in cursor])
+    
+    return [realm for realm in GenericClassModelProvider(env).get_known_realms()
+            if realm not in existing]
+
+def _invalidate_cached_objects(env, realm, objects, db):
+    cache = get_object_cache(env)
+    if cache is not None:
+        cache.invalidate(realm, [obj.get_key_prop_values() for obj in objects], db)
+
+def invalidate_object_cache(env, realm=None, db=None):
+    """
+    Removes all the objects of the specified realm, or all the objects
+    if realm is None, from the object cache, if enabled.
+    Call this method after changing objects directly in the database,
+    i.e. not through insert(), save_changes() or delete(), passing the
+    transaction of the change, if any.
+    """
+    cache = get_object_cache(env)
+    if cache is not None:
+        cache.invalidate(realm, None, db)
+
+
+class RealmDescriptor(object):
+    """
+    A read-only description of the fields, the metadata and the key of
+    a realm, compiled once by the GenericClassModelProvider and shared
+    by all the objects in the realm, to avoid copying and scanning the
+    fields list every time an object is built or accessed.
+    
+    Available properties are:
+        realm: the realm name.
+        fields: a tuple with the metadata of all the fields, as 
+                returned by get_fields().
+        fields_by_name: a dictionary of the fields metadata, by name.
+        std_fields: a tuple with the names of the standard fields.
+        custom_fields: a tuple with the names of the custom fields.
+        time_fields: a tuple with the names of the 'time' fields.
+        key_names: a tuple with the names of the key columns of the
+                   realm table.
+        metadata: the realm metadata, as returned by get_metadata().
+        
+    The descriptor also caches the SQL statements of the realm, built
+    by get_statement() the first time they are needed. The counters 
+    statement_hits and statement_misses report how many statements 
+    have been found in the cache or have been built.
+    Since a new descriptor is compiled whenever the custom fields of 
+    the realm are refreshed, the statements never refer to stale 
+    custom fields.
+    """
+    
+    __slots__ = ('realm', 'fields', 'fields_by_name', 'std_fields', 
+                 'custom_fields', 'time_fields', 'key_names', 'metadata',
+                 'statements', 'statement_hits', 'statement_misses')
+
+    def __init__(self, realm, fields, metadata, key_names):
+        self.realm = realm
+        self.fields = tuple(fields)
+        self.fields_by_name = dict([(f['name'], f) for f in self.fields])
+        self.std_fields = tuple([f['name'] for f in self.fields 
+                                 if not f.get('custom')])
+        self.custom_fields = tuple([f['name'] for f in self.fields 
+                                    if f.get('custom')])
+        self.time_fields = tuple([f['name'] for f in self.fields 
+                                  if f['type'] == 'time'])
+        self.key_names = tuple(key_names)
+        self.metadata = metadata
+        self.statements = {}
+        self.statement_hits = 0
+        self.statement_misses = 0
+
+    def get_statement(self, builder, *args):
+        """
+        Returns the SQL statement built by builder(descriptor, *args),
+        calling the builder only the first time. 
+        
+        The statement must only depend on the descriptor and on the 
+        arguments, which must be hashable.
+        """
+        key = (builder,) + args
+        try:
+            sql = self.statements[key]
+            self.statement_hits += 1
+        except KeyError:
+            sql = builder(self, *args)
+            self.statements[key] = sql
+            self.statement_misses += 1
+
+        return sql
+
 
 class GenericClassModelProvider(Component):
     """
@@ -1041,6 +2505,11 @@ class GenericClassModelProvider(Component):
     
     _class_providers_map = None
 
+    def __init__(self):
+        # Compiled realm descriptors are kept per environment, since
+        # custom fields are specified in each environment's trac.ini
+        self.all_descriptors = {}
+
     # Class providers managament
     def get_class_provider(self, realm):
         """
@@ -1084,6 +2553,9 @@ class GenericClassModelProvider(Component):
         """
         Returns an instance of the specified class (by means of its 
         realm name), with the specified key.
+        
+        If an IdentityMap is active for the current thread, and a key
+        is specified, the object is looked up in the identity map.
         """
         obj = None
         
@@ -1092,6 +2564,11 @@ class GenericClassModelProvider(Component):
 
         if provider:
             self.env.log.debug("Object key is %s" % key)
+            
+            identity_map = get_identity_map(self.env)
+            if key is not None and identity_map is not None:
+                return identity_map.get(realm, key)
+                
             return provider.create_instance(realm, key)
         else:
             self.env.log.debug("Provider for realm %s not found" % realm)
@@ -1124,6 +2601,7 @@ class GenericClassModelProvider(Component):
         Invalidate field cache.
         """
         self.all_fields = {}
+        self.all_descriptors = {}
         
     def get_fields(self, realm):
         self.env.log.debug(">>> get_fields")
@@ -1148,6 +2626,63 @@ class GenericClassModelProvider(Component):
 
         return metadata
         
+    def get_descriptor(self, realm):
+        """
+        Return the RealmDescriptor for the specified realm, compiled
+        the first time it is requested after any refresh of the fields.
+        
+        The returned descriptor is shared and must not be modified.
+        """
+        descriptor = self.all_descriptors.get(realm)
+        
+        if descriptor is None:
+            if realm not in self.fields():
+                raise TracError("Requested field information not found for class %s." % realm)
+            
+            tmp_metadata = self.metadata()
+            metadata = copy.deepcopy(tmp_metadata.get(realm))
+
+            descriptor = RealmDescriptor(realm, copy.deepcopy(self.fields()[realm]), 
+                                         metadata, self._get_key_names(realm))
+            
+            self.all_descriptors[realm] = descriptor
+
+        return descriptor
+
+    def get_statement_cache_stats(self):
+        """
+        Return the usage of the SQL statement caches of the realms 
+        compiled so far, for instrumentation purposes, as a dictionary
+        from realm name to a dictionary with the number of cached 
+        'statements', and of cache 'hits' and 'misses'.
+        
+        Counters restart from zero when the fields of a realm are 
+        refreshed.
+        """
+        stats = {}
+        for realm, descriptor in self.all_descriptors.items():
+            stats[realm] = {'statements': len(descriptor.statements),
+                            'hits': descriptor.statement_hits,
+                            'misses': descriptor.statement_misses}
+
+        return stats
+
+    def _get_key_names(self, realm):
+        """
+        Return the names of the key columns of the specified realm table,
+        as declared by its class provider.
+        """
+        provider = self.get_class_provider(realm)
+        if provider is not None:
+            data_models = provider.get_data_models()
+            if realm in data_models:
+                key = data_models[realm]['table'].key
+                if isinstance(key, basestring):
+                    return [key]
+                return list(key)
+                
+        return ['id']
+
     def fields(self, refresh=False):
         """Return the list of fields available for every realm."""
 
@@ -1164,6 +2699,7 @@ class GenericClassModelProvider(Component):
                     fields[realm] = tmp_fields
 
             self.all_fields = fields
+            self.all_descriptors = {}
 
             # Print debug information about all known realms and fields
             for r in self.all_fields:
@@ -1249,6 +2785,13 @@ class GenericClassModelProvider(Component):
             
             self.all_custom_fields[realm] = fields
             
+            # Drop the realm descriptor, along with its cached SQL 
+            # statements, and on refresh also the fields it is compiled
+            # from, which include the custom fields
+            self.all_descriptors.pop(realm, None)
+            if refresh and realm in self.all_fields:
+                self.reset_fields()
+            
         return self.all_custom_fields[realm]
 
                 
@@ -1306,7 +2849,9 @@ def create_db_for_realm(env, realm, realm_schema, db=None):
     
     :param realm_schema: The db schema definition, as returned by 
                    the get_data_models() function in the IConcreteClassProvider
-                   interface.
+                   interface. Besides the indexes of the base table, it
+                   can declare secondary indexes for the other tables of 
+                   the class, see create_indexes_for_realm().
     """
     @env.with_transaction(db)
     def do_create_db_for_realm(db):
@@ -1382,6 +2927,8 @@ def create_db_for_realm(env, realm, realm_schema, db=None):
                 env.log.debug(stmt)
                 cursor.execute(stmt)
 
+        create_indexes_for_realm(env, realm, realm_schema, db)
+
         _set_installed_version(env, realm, version, db)
 
 def upgrade_db_for_realm(env, package_name, realm, realm_schema, db=None):
@@ -1421,6 +2968,223 @@ def upgrade_db_for_realm(env, package_name, realm, realm_schema, db=None):
 
             env.log.info('Upgrade step successful.')
 
+def create_indexes_for_realm(env, realm, realm_schema, db=None):
+    """
+    Creates the secondary indexes declared in the realm schema that do
+    not exist yet in the database.
+    Call this method from your upgrade modules to add newly declared 
+    indexes to existing databases.
+    
+    Besides the Index items of the base table, the realm schema can 
+    declare:
+        'custom_indexes': a list of Index objects on the columns of 
+                          the <realm>_custom table, e.g. 
+                          Index(['name', 'value']).
+        'change_indexes': a list of Index objects on the columns of 
+                          the <realm>_change table.
+        'pattern_indexes': a list of text columns of the base table 
+                          which are searched for with prefix LIKE 
+                          patterns. On PostgreSQL, an additional index 
+                          with the text_pattern_ops operator class is 
+                          created for each of them, since regular 
+                          indexes are not used for LIKE in non-C locales.
+    """
+    @env.with_transaction(db)
+    def do_create_indexes_for_realm(db):
+        cursor = db.cursor()
+        dburi = env.config.get('trac', 'database')
+
+        table_metadata = realm_schema['table']
+        tablename = table_metadata.name
+
+        types = dict([(c.name, c.type) for c in table_metadata.columns])
+        key_types = dict([(k, types.get(k, 'text')) for k in table_metadata.key])
+
+        indexes = [(tablename, index, types) for index in table_metadata.indices]
+
+        if realm_schema['has_custom']:
+            custom_types = dict(key_types, name='text', value='text')
+            indexes += [(tablename + '_custom', index, custom_types)
+                        for index in realm_schema.get('custom_indexes', [])]
+
+        if realm_schema['has_change']:
+            change_types = dict(key_types, time=get_timestamp_db_type())
+            indexes += [(tablename + '_change', index, change_types)
+                        for index in realm_schema.get('change_indexes', [])]
+
+        existing = {}
+        for table, index, col_types in indexes:
+            if table not in existing:
+                existing[table] = list_available_indexes(dburi, cursor, table)
+
+            name = '%s_%s_idx' % (table, '_'.join(index.columns))
+            if name in existing[table]:
+                continue
+
+            columns = index.columns
+            if dburi.startswith('mysql:'):
+                # MySQL can only index a prefix of text columns
+                limit = 333 / len(columns)
+                columns = [(c, '%s(%d)' % (c, limit))[col_types.get(c, 'text') == 'text']
+                           for c in columns]
+
+            env.log.info("Creating index %s...", name)
+            cursor.execute("CREATE %sINDEX %s ON %s (%s)"
+                           % (('', 'UNIQUE ')[bool(index.unique)], name, table, 
+                              ','.join(columns)))
+            existing[table].append(name)
+
+        if dburi.startswith('postgres:'):
+            for column in realm_schema.get('pattern_indexes', []):
+                name = '%s_%s_pattern_idx' % (tablename, column)
+                if tablename not in existing:
+                    existing[tablename] = list_available_indexes(dburi, cursor, tablename)
+
+                if name not in existing[tablename]:
+                    env.log.info("Creating index %s...", name)
+                    cursor.execute("CREATE INDEX %s ON %s (%s text_pattern_ops)"
+                                   % (name, tablename, column))
+
+
+# Materialized wide custom fields tables
+
+def is_wide_table_enabled(env, realm):
+    """
+    Returns whether the custom fields of the specified realm should
+    also be materialized in a wide table, with one column per custom
+    field, as configured by the [tracgenericclass] wide_custom_tables
+    option (a comma separated list of realms).
+    """
+    return realm in env.config.getlist('tracgenericclass', 'wide_custom_tables')
+
+def get_wide_table_name(realm):
+    return realm + '_custom_wide'
+
+def get_wide_table_columns(env, realm, db=None):
+    """
+    Returns the names of the custom fields materialized in the wide
+    table of the specified realm, or None if the wide table is not
+    enabled or has not been built yet.
+
+    The columns are those present when the table was last rebuilt, so
+    custom fields added later to trac.ini are not materialized until
+    the table is rebuilt.
+    """
+    if not is_wide_table_enabled(env, realm):
+        return None
+
+    value = _get_system_value(env, get_wide_table_name(realm) + '_columns', None, db)
+    if value is None:
+        return None
+
+    return [c for c in value.split(',') if c]
+
+def rebuild_wide_table(env, realm, db=None):
+    """
+    (Re)creates the wide custom fields table of the specified realm,
+    with one column per custom field currently configured in trac.ini,
+    and fills it from the <realm>_custom table.
+    """
+    @env.with_transaction(db)
+    def do_rebuild_wide_table(db):
+        provider = GenericClassModelProvider(env)
+        descriptor = provider.get_descriptor(realm)
+
+        if not descriptor.metadata['has_custom'] or len(descriptor.custom_fields) == 0:
+            raise TracError("Class %s has no custom fields." % realm)
+
+        class_provider = provider.get_class_provider(realm)
+        table_metadata = class_provider.get_data_models()[realm]['table']
+
+        key_names = descriptor.key_names
+        custom_fields = descriptor.custom_fields
+        tablename = get_wide_table_name(realm)
+
+        cursor = db.cursor()
+        db_backend = DatabaseManager(env).get_connector()[0]
+
+        dburi = env.config.get('trac', 'database')
+        if tablename in list_available_tables(dburi, cursor):
+            env.log.info("Dropping wide custom fields table %s...", tablename)
+            cursor.execute("DROP TABLE %s" % tablename)
+
+        cols = []
+        for k in key_names:
+            # Determine type of column k
+            type = 'text'
+            for c in table_metadata.columns:
+                if c.name == k:
+                    type = c.type
+
+            cols.append(Column(k, type=type))
+
+        for name in custom_fields:
+            cols.append(Column(name))
+            cols.append(Index([name]))
+
+        table_wide = Table(tablename, key=key_names)[cols]
+        env.log.info("Creating wide custom fields table %s...", tablename)
+        for stmt in db_backend.to_sql(table_wide):
+            env.log.debug(stmt)
+            cursor.execute(stmt)
+
+        # Pivot the custom fields of all the existing objects
+        cursor.execute("""
+            INSERT INTO %s (%s)
+                SELECT %s FROM %s t LEFT OUTER JOIN %s_custom c ON (%s)
+                GROUP BY %s
+            """ % (tablename,
+                   ','.join(key_names + custom_fields),
+                   ','.join(['t.' + k for k in key_names] +
+                            ["MAX(CASE WHEN c.name=%s THEN c.value END)"] * len(custom_fields)),
+                   realm, realm,
+                   ' AND '.join(['c.%s=t.%s' % (k, k) for k in key_names]),
+                   ','.join(['t.' + k for k in key_names])),
+            custom_fields)
+
+        _set_system_value(env, tablename + '_columns', ','.join(custom_fields), db)
+
+def update_wide_table(env, realm, objects, db):
+    """
+    Replaces the rows of the specified objects in the wide custom
+    fields table of their realm, if enabled.
+    """
+    columns = get_wide_table_columns(env, realm, db)
+    if not columns or len(objects) == 0:
+        return
+
+    key_names = objects[0].get_key_prop_names()
+
+    cursor = db.cursor()
+    _delete_wide_table_rows(realm, key_names, objects, cursor)
+
+    cursor.executemany("INSERT INTO %s (%s) VALUES (%s)"
+                       % (get_wide_table_name(realm),
+                          ','.join(key_names + columns),
+                          ','.join(['%s'] * (len(key_names) + len(columns)))),
+                       [to_list((obj.get_key_prop_values(),
+                                 [obj.values.get(c) for c in columns]))
+                        for obj in objects])
+
+def delete_from_wide_table(env, realm, objects, db):
+    """
+    Deletes the rows of the specified objects from the wide custom
+    fields table of their realm, if enabled.
+    """
+    columns = get_wide_table_columns(env, realm, db)
+    if not columns or len(objects) == 0:
+        return
+
+    _delete_wide_table_rows(realm, objects[0].get_key_prop_names(), objects, db.cursor())
+
+def _delete_wide_table_rows(realm, key_names, objects, cursor):
+    for objs_chunk in _get_chunks(objects, MAX_SQL_PARAMS // len(key_names)):
+        sql_where, params = _get_keys_where_clause(key_names,
+            [dict(zip(key_names, obj.get_key_prop_values())) for obj in objs_chunk])
+
+        cursor.execute("DELETE FROM %s WHERE %s"
+                       % (get_wide_table_name(realm), sql_where), params)
+
 
 # DB schema management methods
 
@@ -1487,3 +3251,146 @@ def _set_system_value(env, key, value, db=None):
             cursor.execute(
                 "INSERT INTO system(name, value) VALUES(%s, %s)", (key, value))
 
+
+# SQL statements building helper methods
+
+# Statements cached by RealmDescriptor.get_statement(). Each builder
+# receives the descriptor of the realm, followed by the arguments the
+# statement depends on.
+
+def _sql_key_condition(descriptor):
+    return ' AND '.join([k + '=%s' for k in descriptor.key_names])
+
+def _sql_select(descriptor):
+    return "SELECT %s FROM %s WHERE %s" % (','.join(descriptor.std_fields), 
+        descriptor.realm, _sql_key_condition(descriptor))
+
+def _sql_select_custom(descriptor):
+    return "SELECT name,value FROM %s_custom WHERE %s" % (descriptor.realm, 
+        _sql_key_condition(descriptor))
+
+def _sql_insert(descriptor, std_fields):
+    return "INSERT INTO %s (%s) VALUES (%s)" % (descriptor.realm, 
+        ','.join(std_fields), ','.join(['%s'] * len(std_fields)))
+
+def _sql_insert_custom(descriptor):
+    return "INSERT INTO %s_custom (%s,name,value) VALUES (%s,%%s,%%s)" % (
+        descriptor.realm, ','.join(descriptor.key_names), 
+        ','.join(['%s'] * len(descriptor.key_names)))
+
+def _sql_upsert_custom(descriptor, env):
+    return get_upsert_query(env, descriptor.realm + '_custom', 
+        list(descriptor.key_names) + ['name'], ['value'], env.get_read_db())
+
+def _sql_delete_custom_values(descriptor, num_names):
+    return "DELETE FROM %s_custom WHERE name IN (%s) AND %s" % (descriptor.realm, 
+        ','.join(['%s'] * num_names), _sql_key_condition(descriptor))
+
+def _sql_insert_change(descriptor):
+    return """
+        INSERT INTO %s_change (%s,time,author,field,oldvalue,newvalue)
+        VALUES (%s,%%s,%%s,%%s,%%s,%%s)
+        """ % (descriptor.realm, ','.join(descriptor.key_names), 
+               ','.join(['%s'] * len(descriptor.key_names)))
+
+def _sql_update(descriptor, std_fields, versioned):
+    """
+    The parameters are the values of the std_fields, followed by the 
+    key values and, if versioned, by the expected row version.
+    A NULL version, e.g. of rows written without it, matches 0, which 
+    is the value it is loaded as.
+    """
+    sql_set = [name + '=%s' for name in std_fields]
+    sql_where = _sql_key_condition(descriptor)
+    if versioned:
+        sql_set.append('%s=COALESCE(%s,0)+1' % (VERSION_FIELD, VERSION_FIELD))
+        sql_where += ' AND COALESCE(%s,0)=%%s' % VERSION_FIELD
+
+    return "UPDATE %s SET %s WHERE %s" % (descriptor.realm, ','.join(sql_set), 
+        sql_where)
+
+def _sql_delete(descriptor, table_suffix):
+    return "DELETE FROM %s%s WHERE %s" % (descriptor.realm, table_suffix, 
+        _sql_key_condition(descriptor))
+
+def _sql_select_change_history(descriptor, num_fields, num_excluded, 
+                               before_kind, after_kind, reverse, limited):
+    """
+    See list_change_history(). The parameters are the key values,
+    followed by the fields to include and to exclude, the values of the
+    'before' and 'after' markers and the limit.
+    """
+    sql_where = _sql_key_condition(descriptor)
+
+    if num_fields is not None:
+        sql_where += " AND field IN (%s)" % ','.join(['%s'] * num_fields)
+    
+    if num_excluded > 0:
+        sql_where += " AND field NOT IN (%s)" % ','.join(['%s'] * num_excluded)
+    
+    for kind, operator in ((before_kind, '<'), (after_kind, '>')):
+        if kind == 'time':
+            sql_where += " AND time" + operator + "%s"
+        elif kind == 'field':
+            # Field names are in ascending order within the same time
+            sql_where += " AND (time" + operator + "%s OR (time=%s AND field" + \
+                ('>', '<')[operator == '>'] + "%s))"
+
+    sql = "SELECT time,author,field,oldvalue,newvalue FROM %s_change WHERE %s" % \
+        (descriptor.realm, sql_where)
+    sql += (" ORDER BY time DESC, field", " ORDER BY time, field DESC")[reverse]
+    
+    if limited:
+        sql += " LIMIT %s"
+
+    return sql
+
+def _group_by_realm(objects):
+    """
+    Returns a dictionary from realm to the list of the specified 
+    objects of that realm, in their original order.
+    """
+    result = {}
+    for obj in objects:
+        result.setdefault(obj.realm, []).append(obj)
+
+    return result
+
+def _get_chunks(items, size):
+    """
+    Splits the specified list into consecutive lists of at most 'size'
+    elements each.
+    """
+    size = max(size, 1)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _get_keys_where_clause(key_names, keys):
+    """
+    Returns an SQL condition matching any of the specified keys, along
+    with the corresponding parameters.
+    A single "IN" condition is used for single-column keys.
+    """
+    params = []
+    
+    if len(key_names) == 1:
+        k = key_names[0]
+        for key in keys:
+            params.append(key[k])
+            
+        return "%s IN (%s)" % (k, ','.join(['%s'] * len(keys))), params
+
+    conditions = []
+    for key in keys:
+        conditions.append('(' + ' AND '.join([k + '=%s' for k in key_names]) + ')')
+        for k in key_names:
+            params.append(key[k])
+            
+    return ' OR '.join(conditions), params
+
+def _get_key_tuple(key_names, values):
+    """
+    Returns a hashable representation of the key properties in the
+    specified dictionary, suitable to match keys read from the database.
+    """
+    return tuple([to_unicode(values[k]) for k in key_names])
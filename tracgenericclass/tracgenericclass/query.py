@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+#
+# This file is part of the Test Manager plugin for Trac.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at:
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+#
+
+from datetime import datetime
+
+from trac.core import TracError
+
+from tracgenericclass.model import GenericClassModelProvider, MAX_SQL_PARAMS, \
+    get_wide_table_columns, get_wide_table_name
+from tracgenericclass.util import to_any_timestamp, get_stream_batch_size, \
+    get_streaming_cursor, iter_cursor_batches
+
+
+class SubQuery(object):
+    """
+    An SQL subquery, to be used as the operand of the 'in' and 'not in'
+    query operators in place of a list of values.
+
+    Differently from a list, whose values are all bound as parameters,
+    a subquery lets the database produce the values, so it does not
+    hit the limit on the number of parameters of a statement.
+    Example:
+
+        query = ObjectQuery(env, 'testcase')
+        query.filter('parent_id', 'in', 
+            SubQuery("SELECT descendant FROM testcatalogclosure "
+                     "WHERE ancestor=%s", [catalog_id]))
+    """
+    def __init__(self, sql, params=None):
+        self.sql = sql
+        self.params = list(params or [])
+
+
+class ObjectQuery(object):
+    """
+    A query on the objects of a realm, compiled into a single SQL
+    statement.
+
+    Differently from list_matching_objects(), the query supports:
+        * Comparison operators other than '=' and 'LIKE', including
+          ranges, IN lists and NULL tests.
+        * Predicates on custom fields, which are joined from the
+          <realm>_custom table.
+        * Ordering, also on custom fields.
+        * Limit and offset, and keyset pagination (see after()).
+
+    Conditions are always in AND.
+    All the methods that add conditions return the query itself, so
+    calls can be chained, as in the following example:
+
+        query = ObjectQuery(env, 'testcase')
+        query.filter('page_name', 'like', 'TC_TT0_TC%') \\
+             .filter('priority', 'in', ['high', 'medium']) \\
+             .order_by('exec_order') \\
+             .limit(50)
+
+        for tc in query.execute():
+            ...
+
+    Field names are checked against the realm fields, so they are never
+    taken verbatim from user input.
+    """
+
+    OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'like', 'not like',
+                 'in', 'not in', 'is null', 'is not null')
+
+    def __init__(self, env, realm):
+        self.env = env
+        self.realm = realm
+
+        self.descriptor = GenericClassModelProvider(env).get_descriptor(realm)
+
+        self.conditions = []
+        self.ordering = []
+        self.keyset = None
+        self.max_rows = None
+        self.skip_rows = 0
+
+    def filter(self, name, operator='=', value=None):
+        """
+        Adds a condition on the specified standard or custom field.
+
+        :param operator: one of the values in OPERATORS. The 'in' and
+                         'not in' operators require a list of values
+                         or a SubQuery, the 'is null' and 'is not null'
+                         operators do not require any value.
+                         Every value in a list is bound as a parameter,
+                         so use a SubQuery for lists that can grow 
+                         beyond MAX_SQL_PARAMS values.
+        """
+        self._check_field(name)
+
+        operator = operator.lower()
+        if operator not in self.OPERATORS:
+            raise TracError("Unsupported query operator: %s" % operator)
+
+        if operator in ('in', 'not in'):
+            if not isinstance(value, SubQuery):
+                value = [self._to_db_value(name, v) for v in value]
+        else:
+            value = self._to_db_value(name, value)
+
+        self.conditions.append((name, operator, value))
+        return self
+
+    def order_by(self, name, desc=False):
+        """
+        Adds a field to order the results by, after the ones already
+        specified.
+        """
+        self._check_field(name)
+
+        self.ordering.append((name, desc))
+        return self
+
+    def limit(self, max_rows, offset=0):
+        """
+        Returns at most max_rows results, skipping the first 'offset'
+        ones.
+        """
+        self.max_rows = int(max_rows)
+        self.skip_rows = int(offset)
+        return self
+
+    def after(self, values):
+        """
+        Keyset pagination: returns only the results following, in the
+        query ordering, the one with the specified values.
+
+        :param values: a dictionary with a value for each of the
+                       order_by() fields, usually taken from the last
+                       result of the previous page.
+        """
+        for name, desc in self.ordering:
+            if name not in values:
+                raise TracError("Keyset value missing for field %s." % name)
+
+        self.keyset = dict([(name, self._to_db_value(name, values[name]))
+                            for name, desc in self.ordering])
+        return self
+
+    def get_sql(self, columns=None):
+        """
+        Compiles the query into a single SQL statement, returning it
+        along with its parameters.
+
+        :param columns: the names of the standard or custom fields to
+                        select. By default, all the standard fields are
+                        selected.
+                        Any other SQL expression (e.g. 'COUNT(*)') can
+                        be specified as a string instead of a list.
+        """
+        if columns is None:
+            columns = self.descriptor.std_fields
+
+        key_names = self.descriptor.key_names
+
+        joins = []
+        join_params = []
+        aliases = {}
+        used_fields = [c[0] for c in self.conditions] + [o[0] for o in self.ordering]
+        if not isinstance(columns, basestring):
+            used_fields += [c for c in columns if c not in used_fields]
+        custom_fields = [name for name in used_fields if name in self.descriptor.custom_fields]
+
+        # Join the wide custom fields table once, if it has all the 
+        # custom fields used, otherwise a <realm>_custom table alias 
+        # for every custom field used
+        wide_columns = None
+        if len(custom_fields) > 0:
+            wide_columns = get_wide_table_columns(self.env, self.realm)
+
+        if wide_columns and not [name for name in custom_fields if name not in wide_columns]:
+            joins.append("LEFT OUTER JOIN %s w ON (%s)"
+                % (get_wide_table_name(self.realm),
+                   ' AND '.join(['w.%s=t.%s' % (k, k) for k in key_names])))
+            for name in custom_fields:
+                aliases[name] = 'w.' + name
+            custom_fields = []
+
+        for name in custom_fields:
+            if name not in aliases:
+                alias = 'c%d' % len(aliases)
+                aliases[name] = alias + '.value'
+                joins.append("LEFT OUTER JOIN %s_custom %s ON (%s AND %s.name=%%s)"
+                    % (self.realm, alias,
+                       ' AND '.join(['%s.%s=t.%s' % (alias, k, k) for k in key_names]),
+                       alias))
+                join_params.append(name)
+
+        def column(name):
+            return aliases.get(name, 't.' + name)
+
+        # Conditions
+        where = []
+        params = []
+        for name, operator, value in self.conditions:
+            if operator in ('is null', 'is not null'):
+                where.append('%s %s' % (column(name), operator.upper()))
+            elif operator in ('in', 'not in'):
+                if isinstance(value, SubQuery):
+                    where.append('%s %s (%s)' % (column(name), operator.upper(), value.sql))
+                    params.extend(value.params)
+                elif len(value) == 0:
+                    where.append(('1=0', '1=1')[operator == 'not in'])
+                else:
+                    where.append('%s %s (%s)' % (column(name), operator.upper(),
+                        ','.join(['%s'] * len(value))))
+                    params.extend(value)
+            else:
+                where.append('%s %s %%s' % (column(name), operator.upper()))
+                params.append(value)
+
+        # Keyset pagination, expanded as (a > x) OR (a = x AND b > y) ...
+        if self.keyset is not None and len(self.ordering) > 0:
+            alternatives = []
+            for i, (name, desc) in enumerate(self.ordering):
+                terms = []
+                for prev_name, prev_desc in self.ordering[:i]:
+                    terms.append('%s=%%s' % column(prev_name))
+                    params.append(self.keyset[prev_name])
+                terms.append('%s%s%%s' % (column(name), ('>', '<')[desc]))
+                params.append(self.keyset[name])
+                alternatives.append('(' + ' AND '.join(terms) + ')')
+            where.append('(' + ' OR '.join(alternatives) + ')')
+
+        if isinstance(columns, basestring):
+            select = columns
+        else:
+            select = ','.join([column(c) for c in columns])
+
+        sql = "SELECT %s FROM %s t" % (select, self.realm)
+        if len(joins) > 0:
+            sql += ' ' + ' '.join(joins)
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if len(self.ordering) > 0:
+            sql += ' ORDER BY ' + ','.join([column(name) + ('', ' DESC')[desc]
+                                            for name, desc in self.ordering])
+        if self.max_rows is not None:
+            sql += ' LIMIT %d OFFSET %d' % (self.max_rows, self.skip_rows)
+
+        return sql, join_params + params
+
+    def execute(self, db=None, stream=False):
+        """
+        Runs the query and returns the matching objects, built from the
+        query results without any further per-object query.
+        
+        :param stream: if True, the results are read in batches, as in
+                       list_matching_objects().
+        """
+        self.env.log.debug('>>> ObjectQuery.execute')
+
+        if not db:
+            db = self.env.get_read_db()
+
+        template = GenericClassModelProvider(self.env).get_object(self.realm)
+        if template is None:
+            raise TracError("Requested class %s not found." % self.realm)
+
+        std_fields = self.descriptor.std_fields
+        sql, params = self.get_sql(std_fields)
+
+        self.env.log.debug(sql)
+
+        if stream:
+            cursor = get_streaming_cursor(self.env, db)
+        else:
+            cursor = db.cursor()
+
+        cursor.execute(sql, params)
+
+        batch_size = MAX_SQL_PARAMS // len(self.descriptor.key_names)
+        if stream:
+            rows_chunks = iter_cursor_batches(cursor, 
+                min(batch_size, get_stream_batch_size(self.env)))
+        else:
+            rows_chunks = [cursor.fetchall()]
+
+        for rows_chunk in rows_chunks:
+            for obj in template._create_from_rows(std_fields, rows_chunk, db):
+                yield obj
+
+        self.env.log.debug('<<< ObjectQuery.execute')
+
+    def count(self, db=None):
+        """
+        Returns the number of objects matching the query, ignoring
+        ordering, limit and offset.
+        """
+        if not db:
+            db = self.env.get_read_db()
+
+        ordering, keyset, max_rows = self.ordering, self.keyset, self.max_rows
+        self.ordering, self.keyset, self.max_rows = [], None, None
+        try:
+            sql, params = self.get_sql('COUNT(*)')
+        finally:
+            self.ordering, self.keyset, self.max_rows = ordering, keyset, max_rows
+
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+
+        return cursor.fetchone()[0]
+
+    def values(self, name, db=None):
+        """
+        Returns the values of the specified standard or custom field
+        for the objects matching the query, without building any object.
+        """
+        self._check_field(name)
+
+        if not db:
+            db = self.env.get_read_db()
+
+        sql, params = self.get_sql([name])
+
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+
+        return [row[0] for row in cursor]
+
+    def _check_field(self, name):
+        if name not in self.descriptor.fields_by_name:
+            raise TracError("Field %s not found for class %s." % (name, self.realm))
+
+    def _to_db_value(self, name, value):
+        if name in self.descriptor.time_fields and isinstance(value, datetime):
+            return to_any_timestamp(value)
+
+        return value
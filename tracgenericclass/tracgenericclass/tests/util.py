@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010-2015 Roberto Longobardi
+#
+# This file is part of the Test Manager plugin for Trac.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at:
+#   https://trac-hacks.org/wiki/TestManagerForTracPluginLicense
+#
+# Author: Roberto Longobardi <otrebor.dev@gmail.com>
+#
+
+
+import unittest
+
+from tracgenericclass import util
+from tracgenericclass.util import decode_key, encode_key
+
+
+class KeyCodecTestCase(unittest.TestCase):
+
+    def setUp(self):
+        util._encoded_keys.clear()
+        util._decoded_keys.clear()
+
+    def test_encode(self):
+        self.assertEqual("{'id':'2'}", encode_key({'id': '2'}))
+        self.assertEqual("{'id':'2'}", encode_key({'id': 2}))
+
+    def test_encode_from_values(self):
+        self.assertEqual("{'id':'2'}", 
+                         encode_key({'id': None}, {'id': '2', 'page_name': 'TC'}))
+
+    def test_round_trip(self):
+        for key in ({'id': '2'},
+                    {'id': '2', 'planid': '3'},
+                    {'id': u'\xe8€'},
+                    {'id': ''},
+                    {'id': "it's"},
+                    {'id': 'a\\b'},
+                    {'id': "\\'"},
+                    {'id': "','planid':'"},
+                    {'id': '{x}', 'page_name': 'TC_TT1_TC2'}):
+            self.assertEqual(key, decode_key(encode_key(key)))
+            # Twice, to also go through the caches
+            self.assertEqual(key, decode_key(encode_key(key)))
+
+    def test_decode_legacy_format(self):
+        self.assertEqual({'id': '2', 'planid': '3'}, decode_key("{'id':'2','planid':'3'}"))
+        self.assertEqual({'id': '2', 'planid': '3'}, decode_key("{'id': '2', 'planid': '3'}"))
+        self.assertEqual({}, decode_key("{}"))
+
+    def test_decoded_key_can_be_modified(self):
+        key = decode_key("{'id':'2'}")
+        key['id'] = '3'
+        self.assertEqual({'id': '2'}, decode_key("{'id':'2'}"))
+
+    def test_unhashable_values_are_not_cached(self):
+        encode_key({'id': ['2']})
+        self.assertEqual(0, len(util._encoded_keys))
+
+    def test_caches_are_bounded(self):
+        for i in range(util.KEY_CACHE_SIZE + 10):
+            decode_key(encode_key({'id': str(i)}))
+
+        self.assertTrue(len(util._encoded_keys) <= util.KEY_CACHE_SIZE)
+        self.assertTrue(len(util._decoded_keys) <= util.KEY_CACHE_SIZE)
+
+    def test_deprecated_names(self):
+        self.assertEqual(encode_key({'id': "it's"}), 
+                         util.get_string_from_dictionary({'id': "it's"}))
+        self.assertEqual({'id': "it's"}, 
+                         util.get_dictionary_from_string(encode_key({'id': "it's"})))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(KeyCodecTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
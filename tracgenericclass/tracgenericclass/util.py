@@ -12,11 +12,13 @@
 # Author: Roberto Longobardi <otrebor.dev@gmail.com>
 # 
 
+import itertools
 import os
 import re
 import shutil
 import sys
 import traceback
+import weakref
 
 from datetime import datetime
 
@@ -122,35 +124,102 @@ def to_list(params=[]):
     return tuple(result)
   
 
-def get_dictionary_from_string(str):
-    result = {}
+# Object keys codec
+#
+# Keys are represented as strings in the form {'name1':'value1','name2':'value2'},
+# where single quotes and backslashes in names and values are escaped 
+# with a backslash. 
+# Encoded and decoded keys are cached, since the same keys are converted
+# over and over while rendering a page.
 
-    sub = str.partition('{')[2].rpartition('}')[0]
-    tokens = sub.split(",")
+KEY_CACHE_SIZE = 4096
 
-    for tok in tokens:
-        name = remove_quotes(tok.partition(':')[0])
-        value = remove_quotes(tok.partition(':')[2])
-        
-        result[name] = value
+_encoded_keys = {}
+_decoded_keys = {}
 
-    return result
+_key_item_re = re.compile(r"'((?:[^'\\]|\\.)*)'\s*:\s*'((?:[^'\\]|\\.)*)'")
+_key_unescape_re = re.compile(r"\\(.)")
+
+def _escape_key_token(token):
+    if not isinstance(token, basestring):
+        token = unicode(token)
+        
+    if "'" in token or '\\' in token:
+        token = token.replace('\\', '\\\\').replace("'", "\\'")
+        
+    return token
 
+def _unescape_key_token(token):
+    if '\\' in token:
+        token = _key_unescape_re.sub(r'\1', token)
+        
+    return token
 
-def get_string_from_dictionary(dictionary, values=None):
+def encode_key(dictionary, values=None):
+    """
+    Returns the string representation of the specified key, i.e. a 
+    dictionary of property names to values.
+    
+    :param values: optional dictionary to take the values of the 
+                   properties from, instead of 'dictionary'.
+    """
     if values is None:
         values = dictionary
+        
+    items = tuple([(k, values[k]) for k in dictionary])
     
-    result = '{'
-    for i, k in enumerate(dictionary):
-        result += "'"+k+"':'"+values[k]+"'"
-        if i < len(dictionary)-1:
-            result += ","
+    try:
+        result = _encoded_keys.get(items)
+        cacheable = True
+    except TypeError:
+        # Unhashable values are not cached
+        result = None
+        cacheable = False
+        
+    if result is None:
+        result = '{' + ','.join(["'%s':'%s'" % (_escape_key_token(k), _escape_key_token(v)) 
+                                 for k, v in items]) + '}'
     
-    result += '}'
+        if cacheable:
+            if len(_encoded_keys) >= KEY_CACHE_SIZE:
+                _encoded_keys.clear()
+            _encoded_keys[items] = result
     
     return result
 
+def decode_key(str):
+    """
+    Returns the key, i.e. a dictionary of property names to values, 
+    represented by the specified string, as returned by encode_key().
+    
+    The returned dictionary can be freely modified by the caller.
+    """
+    result = _decoded_keys.get(str)
+    
+    if result is None:
+        result = {}
+        for name, value in _key_item_re.findall(str):
+            result[_unescape_key_token(name)] = _unescape_key_token(value)
+            
+        if len(_decoded_keys) >= KEY_CACHE_SIZE:
+            _decoded_keys.clear()
+        _decoded_keys[str] = result
+        
+    return dict(result)
+
+def get_dictionary_from_string(str):
+    """
+    Deprecated, use decode_key().
+    """
+    return decode_key(str)
+
+
+def get_string_from_dictionary(dictionary, values=None):
+    """
+    Deprecated, use encode_key().
+    """
+    return encode_key(dictionary, values)
+
 
 def remove_quotes(str, quote='\''):
     return str.partition(quote)[2].rpartition(quote)[0]
@@ -261,7 +330,278 @@ def list_available_tables(dburi, cursor):
         raise TracError('Unsupported %s database' % dburi.split(':')[0]) 
     cursor.execute(query) 
 
-    return sorted([row[0] for row in cursor]) 
+    return sorted([row[0] for row in cursor])
+
+def list_available_indexes(dburi, cursor, tablename):
+    if dburi.startswith('sqlite:'):
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='index' AND tbl_name=%s
+            """, (tablename,))
+        return sorted([row[0] for row in cursor])
+    elif dburi.startswith('postgres:'):
+        cursor.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE tablename=%s AND schemaname = ANY (current_schemas(false))
+            """, (tablename,))
+        return sorted([row[0] for row in cursor])
+    elif dburi.startswith('mysql:'):
+        cursor.execute("SHOW INDEX FROM %s" % tablename)
+        return sorted(set([row[2] for row in cursor]))
+    else:
+        raise TracError('Unsupported %s database' % dburi.split(':')[0])
+
+upsert_support = {}
+
+def db_supports_upsert(env, db):
+    """
+    Returns whether the database backend in use supports the 
+    INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE syntax.
+    """
+    dburi = env.config.get('trac', 'database')
+
+    if dburi not in upsert_support:
+        supported = False
+        
+        if dburi.startswith('sqlite:'):
+            try:
+                from trac.db.sqlite_backend import sqlite
+                supported = sqlite.sqlite_version_info >= (3, 24, 0)
+            except:
+                supported = False
+        elif dburi.startswith('postgres:'):
+            try:
+                cursor = db.cursor()
+                cursor.execute("SHOW server_version_num")
+                supported = int(cursor.fetchone()[0]) >= 90500
+            except:
+                supported = False
+        elif dburi.startswith('mysql:'):
+            supported = True
+
+        env.log.debug('Database backend supports upsert: %s', supported)
+        upsert_support[dburi] = supported
+
+    return upsert_support[dburi]
+
+def get_upsert_query(env, tablename, key_names, value_names, db):
+    """
+    Returns an INSERT statement for the specified table that updates
+    the value columns of the existing row when a row with the same key
+    already exists, using the syntax of the database backend in use.
+    The statement parameters are the key values followed by the 
+    other values.
+    
+    Returns None if the database backend does not support it.
+    """
+    if not db_supports_upsert(env, db):
+        return None
+
+    dburi = env.config.get('trac', 'database')
+
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (tablename, 
+        ','.join(key_names + value_names), 
+        ','.join(['%s'] * (len(key_names) + len(value_names))))
+
+    if dburi.startswith('mysql:'):
+        sql += " ON DUPLICATE KEY UPDATE %s" % \
+            ','.join(['%s=VALUES(%s)' % (v, v) for v in value_names])
+    else:
+        sql += " ON CONFLICT (%s) DO UPDATE SET %s" % (','.join(key_names), 
+            ','.join(['%s=excluded.%s' % (v, v) for v in value_names]))
+
+    return sql
+
+fulltext_support = {}
+
+def db_supports_fulltext(env, db):
+    """
+    Returns the full-text search engine available in the database 
+    backend in use: 'fts5' for SQLite with the FTS5 extension,
+    'tsvector' for PostgreSQL, or None if full-text search is not
+    supported.
+    """
+    dburi = env.config.get('trac', 'database')
+
+    if dburi not in fulltext_support:
+        engine = None
+        
+        if dburi.startswith('sqlite:'):
+            try:
+                cursor = db.cursor()
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                if cursor.fetchone()[0]:
+                    engine = 'fts5'
+            except:
+                engine = None
+        elif dburi.startswith('postgres:'):
+            engine = 'tsvector'
+
+        env.log.debug('Database backend full-text search engine: %s', engine)
+        fulltext_support[dburi] = engine
+
+    return fulltext_support[dburi]
+
+DEFAULT_STREAM_BATCH_SIZE = 500
+
+stream_cursor_counter = itertools.count()
+
+def get_integrity_error(env):
+    """
+    Returns the IntegrityError exception class of the database backend,
+    raised for example when inserting a row with a duplicate key.
+    """
+    db_exc = getattr(env, 'db_exc', None)
+    if db_exc is not None:
+        return db_exc.IntegrityError
+
+    # Trac 0.12
+    dburi = env.config.get('trac', 'database')
+
+    if dburi.startswith('postgres:'):
+        import psycopg2
+        return psycopg2.IntegrityError
+    elif dburi.startswith('mysql:'):
+        import MySQLdb
+        return MySQLdb.IntegrityError
+    else:
+        try:
+            import sqlite3 as sqlite
+        except ImportError:
+            from pysqlite2 import dbapi2 as sqlite
+        return sqlite.IntegrityError
+
+def get_stream_batch_size(env):
+    """
+    Returns the number of rows fetched at a time by streaming queries,
+    as configured by the [tracgenericclass] stream_batch_size option.
+    """
+    return env.config.getint('tracgenericclass', 'stream_batch_size',
+                             DEFAULT_STREAM_BATCH_SIZE) or DEFAULT_STREAM_BATCH_SIZE
+
+def get_streaming_cursor(env, db):
+    """
+    Returns a cursor that does not buffer the whole result of its
+    queries on the client side, when the database backend supports it.
+
+    On PostgreSQL, this is a server-side (named) cursor, created on
+    the underlying driver connection, which must be used for a single
+    query. On the other backends, this is a regular cursor, which
+    should be read with fetchmany() (see iter_cursor_rows()).
+    """
+    dburi = env.config.get('trac', 'database')
+
+    if dburi.startswith('postgres:'):
+        cnx = db
+        while hasattr(cnx, 'cnx'):
+            cnx = cnx.cnx
+
+        try:
+            return cnx.cursor('tgc_stream_%d' % stream_cursor_counter.next())
+        except:
+            env.log.debug('Server-side cursors not available, using a regular cursor')
+
+    return db.cursor()
+
+def iter_cursor_batches(cursor, batch_size):
+    """
+    Generator over the rows of the last query executed on the cursor,
+    returned in lists of at most batch_size rows, read with fetchmany().
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+
+        yield rows
+
+def iter_cursor_rows(cursor, batch_size):
+    """
+    Generator over the rows of the last query executed on the cursor,
+    which reads at most batch_size rows at a time.
+    """
+    for rows in iter_cursor_batches(cursor, batch_size):
+        for row in rows:
+            yield row
+
+def call_after_commit(env, db, callback, key=None):
+    """
+    Calls the specified function, with no arguments, once the current 
+    transaction of the specified connection has been committed. 
+    The function is never called if the transaction is rolled back.
+    
+    Functions are called in the order they have been registered, after
+    the commit of the outermost transaction block, so they can safely
+    make the changes visible to other threads and processes. Errors 
+    they raise are logged and ignored, since the transaction is over.
+    Note that the transaction block is not over yet when they are 
+    called, so they must use a connection of their own, and commit it,
+    to write into the database.
+    
+    If a key is specified and a function has already been registered 
+    with the same key in the current transaction, the new function is
+    not registered. Returns the function registered with the key.
+    
+    Connections which cannot record the functions, i.e. not pooled,
+    call them immediately.
+    """
+    try:
+        attrs = vars(db)
+    except TypeError:
+        _call_after_commit_callbacks(env, [callback])
+        return callback
+
+    callbacks = attrs.get('_after_commit_callbacks')
+    if callbacks is None:
+        callbacks = attrs['_after_commit_callbacks'] = []
+        attrs['_after_commit_keys'] = {}
+
+        # The connection is only referenced weakly, as pooled 
+        # connections are returned to the pool by __del__()
+        db_ref = weakref.ref(db)
+
+        def commit():
+            cnx = db_ref()
+            pending = _end_transaction(cnx)
+            cnx.commit()
+            _call_after_commit_callbacks(env, pending)
+
+        def rollback():
+            cnx = db_ref()
+            _end_transaction(cnx)
+            cnx.rollback()
+
+        attrs['commit'] = commit
+        attrs['rollback'] = rollback
+
+    if key is not None:
+        keys = attrs['_after_commit_keys']
+        if key in keys:
+            return keys[key]
+        keys[key] = callback
+
+    callbacks.append(callback)
+    return callback
+
+def _end_transaction(db):
+    """
+    Restores the commit() and rollback() methods of the connection, 
+    returning the functions to call after commit.
+    """
+    attrs = vars(db)
+    del attrs['commit']
+    del attrs['rollback']
+    del attrs['_after_commit_keys']
+
+    return attrs.pop('_after_commit_callbacks')
+
+def _call_after_commit_callbacks(env, callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except:
+            env.log.error("Error in function called after commit: %s", 
+                          formatExceptionInfo())
 
 def fix_base_location(req):
     return req.href('/').rstrip('/')